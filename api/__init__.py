@@ -0,0 +1 @@
+"""JAK Company AI Agent API"""
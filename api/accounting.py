@@ -0,0 +1,163 @@
+"""Mesure de la mémoire réellement occupée par les sessions et par le processus"""
+
+import heapq
+import os
+import random
+import sys
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional
+
+from .memory import ChatMessage, ChatMessageHistory, ConversationMemory, SessionStore
+from .tiering import ColdSession
+
+
+def deep_sizeof(obj: Any, seen: Optional[set] = None) -> int:
+    """Taille récursive (objets, slots, conteneurs) sans double comptage"""
+    if seen is None:
+        seen = set()
+    obj_id = id(obj)
+    if obj_id in seen:
+        return 0
+    seen.add(obj_id)
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (str, bytes, int, float, bool)) or obj is None:
+        return size
+    if isinstance(obj, dict):
+        return size + sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return size + sum(deep_sizeof(item, seen) for item in obj)
+
+    for cls in type(obj).__mro__:
+        for slot in getattr(cls, "__slots__", ()):
+            if hasattr(obj, slot):
+                size += deep_sizeof(getattr(obj, slot), seen)
+    if hasattr(obj, "__dict__"):
+        size += deep_sizeof(obj.__dict__, seen)
+    return size
+
+
+# Surcoûts hors contenu calibrés à l'import : objet slotté, en-têtes str/int, entrée de liste
+# (le type "human"/"ai" est une chaîne internée partagée entre tous les messages)
+MESSAGE_OVERHEAD_BYTES = deep_sizeof(ChatMessage("human", "x"), {id("human")}) - 1 + 8
+SESSION_OVERHEAD_BYTES = deep_sizeof(ConversationMemory())
+# Session froide : métadonnées slottées, en-tête de la charge compressée, entrées des deux index
+COLD_ENTRY_OVERHEAD_BYTES = deep_sizeof(ColdSession(time.time(), (1, 1, 0, 1, 1))) + sys.getsizeof(b"") + 2 * 3 * 8
+
+
+def session_bytes(memory: ConversationMemory) -> int:
+    """Taille mesurée d'une session (objets Python inclus)"""
+    # Les agrégats globaux partagés ne font pas partie de la session
+    seen = {id(memory.chat_memory._stats)}
+    return deep_sizeof(memory, seen)
+
+
+def estimated_session_bytes(memory: ConversationMemory) -> int:
+    """Estimation en O(1) à partir des compteurs de la session"""
+    history: ChatMessageHistory = memory.chat_memory
+    return SESSION_OVERHEAD_BYTES + history.bytes + len(history.messages) * MESSAGE_OVERHEAD_BYTES
+
+
+def process_memory() -> Dict[str, Optional[int]]:
+    """RSS courant (Linux) et pic de RSS du processus"""
+    rss_bytes = None
+    try:
+        with open("/proc/self/statm") as statm:
+            rss_bytes = int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+
+    peak_rss_bytes = None
+    try:
+        import resource
+        peak_rss_bytes = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except (ImportError, OSError):
+        pass
+
+    return {"rss_bytes": rss_bytes, "peak_rss_bytes": peak_rss_bytes}
+
+
+def store_report(store: SessionStore, sample_size: int = 200, top: int = 10) -> Dict[str, Any]:
+    """Rapport mémoire : mesure échantillonnée extrapolée au store et plus grosses sessions"""
+    start = time.perf_counter()
+    session_count = len(store)
+
+    # Mesure des sessions résidentes : les sessions froides (store à niveaux) ne sont pas réveillées
+    resident = store._sessions
+    wa_ids = list(resident.keys())
+    sample = random.sample(wa_ids, min(sample_size, len(wa_ids))) if wa_ids else []
+    measured = [session_bytes(resident[wa_id]) for wa_id in sample if wa_id in resident]
+    mean_bytes = sum(measured) / len(measured) if measured else 0
+
+    largest = heapq.nlargest(top, resident.items(), key=lambda item: estimated_session_bytes(item[1]))
+    top_sessions: List[Dict[str, Any]] = [
+        {
+            "wa_id": wa_id,
+            "messages": len(memory.chat_memory.messages),
+            "content_bytes": memory.chat_memory.bytes,
+            "measured_bytes": session_bytes(memory)
+        }
+        for wa_id, memory in largest
+    ]
+
+    tier_stats = getattr(store, "tier_stats", None)
+    tiers = tier_stats() if tier_stats is not None else None
+    cold_bytes = 0
+    if tiers is not None and tiers["cold_sessions"]:
+        # Charge compressée + entrée d'index (clé, métadonnées) par session froide
+        cold_bytes = tiers["cold_payload_bytes"] + tiers["cold_sessions"] * COLD_ENTRY_OVERHEAD_BYTES
+
+    return {
+        "session_count": session_count,
+        "resident_sessions": len(resident),
+        "content_bytes": store.stats.bytes,
+        "sampled_sessions": len(measured),
+        "mean_session_bytes": round(mean_bytes),
+        "estimated_store_bytes": round(mean_bytes * len(resident)) + sys.getsizeof(resident) + cold_bytes,
+        "tiers": tiers,
+        "top_sessions": top_sessions,
+        "process": process_memory(),
+        "duration_ms": round((time.perf_counter() - start) * 1000, 2)
+    }
+
+
+class TracemallocProbe:
+    """Traçage des allocations à la demande (coûteux : à n'activer que pour un diagnostic)"""
+
+    def __init__(self, frames: int = 1):
+        self.frames = frames
+
+    @property
+    def active(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+
+    def stop(self):
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def report(self, top: int = 10) -> Dict[str, Any]:
+        if not tracemalloc.is_tracing():
+            return {"active": False}
+
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ])
+        package_dir = os.path.dirname(__file__)
+        stats = snapshot.statistics("lineno")
+        return {
+            "active": True,
+            "traced_current_bytes": current,
+            "traced_peak_bytes": peak,
+            "package_bytes": sum(s.size for s in stats if s.traceback[0].filename.startswith(package_dir)),
+            "top_allocations": [
+                {"location": f"{s.traceback[0].filename}:{s.traceback[0].lineno}", "bytes": s.size, "count": s.count}
+                for s in stats[:top]
+            ]
+        }
@@ -0,0 +1,142 @@
+"""Contrôle d'admission devant process_message
+
+Trois protections, vérifiées dans cet ordre :
+- seau de jetons par wa_id (un même numéro ne peut pas saturer le service) ;
+- délestage selon la profondeur de file (au-delà, réponse dégradée immédiate) ;
+- plafond global de requêtes traitées simultanément, avec attente bornée.
+"""
+
+import asyncio
+import math
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+SHED_RATE_LIMITED = "rate_limited"
+SHED_QUEUE_FULL = "queue_full"
+SHED_QUEUE_TIMEOUT = "queue_timeout"
+
+
+class TokenBucket:
+    """Seau de jetons : `rate` jetons par seconde, capacité `burst`"""
+
+    __slots__ = ("tokens", "updated_at")
+
+    def __init__(self, burst: float, now: float):
+        self.tokens = burst
+        self.updated_at = now
+
+    def try_take(self, rate: float, burst: float, now: float) -> bool:
+        self.tokens = min(burst, self.tokens + (now - self.updated_at) * rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def seconds_until_token(self, rate: float) -> float:
+        return max(0.0, (1 - self.tokens) / rate) if rate > 0 else math.inf
+
+
+class AdmissionDecision:
+    """Résultat de l'admission : admis, ou délesté avec raison et délai de réessai"""
+
+    __slots__ = ("admitted", "reason", "retry_after")
+
+    def __init__(self, admitted: bool, reason: Optional[str] = None, retry_after: float = 0.0):
+        self.admitted = admitted
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Plafond de concurrence global, seau de jetons par wa_id et délestage par profondeur de file"""
+
+    def __init__(self, max_concurrency: int = 32, max_queue: int = 64, queue_timeout: float = 2.0,
+                 rate_per_minute: float = 20.0, burst: float = 5.0, max_buckets: int = 100_000):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self.max_buckets = max_buckets
+
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self.active = 0
+        self.waiting = 0
+        self.peak_waiting = 0
+        self.admitted = 0
+        self.shed: Dict[str, int] = {SHED_RATE_LIMITED: 0, SHED_QUEUE_FULL: 0, SHED_QUEUE_TIMEOUT: 0}
+
+    def _check_rate(self, wa_id: str) -> Optional[float]:
+        """Consomme un jeton du wa_id ; retourne le délai de réessai si le seau est vide"""
+        if self.rate <= 0:
+            return None
+        now = time.monotonic()
+        bucket = self._buckets.get(wa_id)
+        if bucket is None:
+            bucket = self._buckets[wa_id] = TokenBucket(self.burst, now)
+            if len(self._buckets) > self.max_buckets:
+                # On oublie le seau le moins récemment utilisé (il s'est très probablement rempli depuis)
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(wa_id)
+
+        if bucket.try_take(self.rate, self.burst, now):
+            return None
+        return bucket.seconds_until_token(self.rate)
+
+    def _overload_retry_after(self) -> float:
+        # Estimation grossière : temps pour écouler la file actuelle
+        return round(max(1.0, self.queue_timeout * (1 + self.waiting / max(self.max_concurrency, 1))), 1)
+
+    def _reject(self, reason: str, retry_after: float) -> AdmissionDecision:
+        self.shed[reason] += 1
+        return AdmissionDecision(False, reason, round(retry_after, 1))
+
+    async def acquire(self, wa_id: str, timeout: Optional[float] = None) -> AdmissionDecision:
+        """Admet la requête (il faudra appeler release) ou la déleste immédiatement
+
+        `timeout` borne l'attente en file (échéance de la requête) en plus de queue_timeout.
+        """
+        retry_after = self._check_rate(wa_id)
+        if retry_after is not None:
+            return self._reject(SHED_RATE_LIMITED, retry_after)
+
+        if self._semaphore.locked():
+            if self.waiting >= self.max_queue:
+                return self._reject(SHED_QUEUE_FULL, self._overload_retry_after())
+
+            self.waiting += 1
+            self.peak_waiting = max(self.peak_waiting, self.waiting)
+            try:
+                queue_timeout = self.queue_timeout if timeout is None else min(self.queue_timeout, timeout)
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=queue_timeout)
+            except asyncio.TimeoutError:
+                return self._reject(SHED_QUEUE_TIMEOUT, self._overload_retry_after())
+            finally:
+                self.waiting -= 1
+        else:
+            # Slot libre : acquisition immédiate, sans passer par la file
+            await self._semaphore.acquire()
+
+        self.active += 1
+        self.admitted += 1
+        return AdmissionDecision(True)
+
+    def release(self):
+        self.active -= 1
+        self._semaphore.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "active": self.active,
+            "waiting": self.waiting,
+            "peak_waiting": self.peak_waiting,
+            "admitted": self.admitted,
+            "shed": dict(self.shed),
+            "tracked_wa_ids": len(self._buckets)
+        }
@@ -0,0 +1,333 @@
+"""Reclassification hors ligne d'archives de conversations (NDJSON ou CSV)
+
+Usage : python -m api.archive ARCHIVE [ARCHIVE ...] --output-dir DIR [--workers N]
+
+L'archive est lue en flux, dans l'ordre des lignes (l'ordre chronologique de
+l'export). Chaque `wa_id` est attribué à un worker par hachage stable ; un worker
+reconstruit l'historique de ses sessions dans l'ordre et rejoue chaque message
+entrant dans le moteur de décision (api.engine.decide_turn), exactement comme le
+serveur. Les résultats sont écrits au fil de l'eau dans DIR/shard-NN.ndjson,
+puis les compteurs fusionnés dans DIR/summary.json.
+
+La mémoire reste bornée quelle que soit la taille de l'archive :
+- files bornées entre le lecteur et les workers (le lecteur attend si un worker est en retard) ;
+- historique de chaque session borné comme en production (fenêtre + résumé) ;
+- au plus --max-sessions sessions par worker (les moins récentes sont évincées).
+
+Colonnes reconnues : wa_id ; message (ou message_original, text, body) ;
+role/direction (user, human, inbound, ... sinon réponse du bot) ; matched_bloc_response ;
+matched_bloc_id ; id et timestamp recopiés ; priority_detected = routage d'origine,
+comparé au nouveau dans le résumé.
+"""
+
+import argparse
+import csv
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+import zlib
+from collections import Counter, OrderedDict
+from queue import Empty, Full
+from typing import Any, Dict, Iterator, List, Optional
+
+from .blocs import BlocCatalog
+from .engine import DEFAULT_RULES_PATH, ResponseValidator, decide_turn
+from .memory import ConversationMemory
+from .rules import RuleSet
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_FIELDS = ("message_original", "message", "text", "body")
+ROLE_FIELDS = ("role", "direction", "type")
+INBOUND_ROLES = {"", "user", "human", "inbound", "in", "incoming", "client"}
+
+# Champs recopiés tels quels de l'archive vers le résultat
+PASSTHROUGH_FIELDS = ("id", "timestamp")
+
+# Enregistrements envoyés par lot à un worker, et lots en attente par worker
+BATCH_SIZE = 500
+QUEUE_BATCHES = 8
+
+
+def shard_of(wa_id: str, shards: int) -> int:
+    """Shard d'un wa_id (CRC32 : stable d'un run et d'une machine à l'autre, contrairement à hash())"""
+    return zlib.crc32(wa_id.encode("utf-8")) % shards
+
+
+def parse_line(line: str, path: str, errors: Counter) -> Optional[Dict[str, Any]]:
+    try:
+        record = json.loads(line)
+    except ValueError:
+        record = None
+    if isinstance(record, dict):
+        return record
+    # Ligne invalide : comptée, le flux continue
+    errors["unreadable_lines"] += 1
+    logger.warning(f"Ligne illisible dans {path}: {line[:100]!r}")
+    return None
+
+
+def read_records(path: str, errors: Counter) -> Iterator[Dict[str, Any]]:
+    """Enregistrements d'une archive NDJSON ou CSV (d'après l'extension), en flux"""
+    if path.endswith(".csv"):
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            yield from csv.DictReader(f)
+        return
+
+    lines = sys.stdin if path == "-" else open(path, "r", encoding="utf-8")
+    try:
+        for line in lines:
+            if line.strip():
+                record = parse_line(line, path, errors)
+                if record is not None:
+                    yield record
+    finally:
+        if lines is not sys.stdin:
+            lines.close()
+
+
+def put_checked(queue, item, process):
+    """put bloquant (contre-pression), mais qui échoue si le worker destinataire est mort"""
+    while True:
+        try:
+            queue.put(item, timeout=1.0)
+            return
+        except Full:
+            if not process.is_alive():
+                raise RuntimeError(f"Worker {process.name} arrêté (code {process.exitcode})")
+
+
+def passthrough(record: Dict[str, Any]) -> Dict[str, Any]:
+    result = {"wa_id": str(record.get("wa_id") or "")}
+    result.update({field: record[field] for field in PASSTHROUGH_FIELDS if record.get(field) not in (None, "")})
+    return result
+
+
+def record_message(record: Dict[str, Any]) -> str:
+    for field in MESSAGE_FIELDS:
+        if record.get(field):
+            return str(record[field])
+    return ""
+
+
+def is_inbound(record: Dict[str, Any]) -> bool:
+    role = next((record[field] for field in ROLE_FIELDS if record.get(field)), "")
+    return str(role).lower() in INBOUND_ROLES
+
+
+class ShardClassifier:
+    """Sessions d'un shard et classification de ses enregistrements (un par worker)"""
+
+    def __init__(self, rules: RuleSet, catalog: Optional[BlocCatalog] = None, max_sessions: int = 100_000,
+                 replay: str = "simulated", full: bool = False):
+        self.rules = rules
+        self.catalog = catalog
+        self.max_sessions = max_sessions
+        self.replay = replay
+        self.full = full
+        self.sessions: "OrderedDict[str, ConversationMemory]" = OrderedDict()
+        self.stats = Counter()
+        self.priorities = Counter()
+        self.transitions = Counter()
+
+    def session(self, wa_id: str) -> ConversationMemory:
+        memory = self.sessions.get(wa_id)
+        if memory is not None:
+            self.sessions.move_to_end(wa_id)
+            return memory
+
+        memory = ConversationMemory()
+        self.sessions[wa_id] = memory
+        self.stats["sessions"] += 1
+        if len(self.sessions) > self.max_sessions:
+            self.sessions.popitem(last=False)
+            self.stats["evicted_sessions"] += 1
+        return memory
+
+    def resolve_bloc(self, record: Dict[str, Any]):
+        if self.catalog is not None and record.get("matched_bloc_id"):
+            bloc = self.catalog.get(str(record["matched_bloc_id"]))
+            if bloc is not None:
+                return bloc
+        return record.get("matched_bloc_response") or None
+
+    def classify(self, record: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Résultat pour un message entrant ; None pour une réponse du bot (ajoutée à l'historique)"""
+        self.stats["records"] += 1
+        wa_id = str(record.get("wa_id") or "")
+        message = record_message(record)
+        if not wa_id or not message.strip():
+            self.stats["skipped"] += 1
+            return None
+
+        memory = self.session(wa_id)
+        if not is_inbound(record):
+            self.stats["bot_messages"] += 1
+            if self.replay == "recorded":
+                memory.chat_memory.add_ai_message(ResponseValidator.clean_response(message))
+            return None
+
+        decision = decide_turn(memory, message, self.resolve_bloc(record), self.rules,
+                               record_response=self.replay == "simulated")
+        self.stats["classified"] += 1
+        self.priorities[decision["priority_detected"]] += 1
+
+        result = passthrough(record)
+        previous = record.get("priority_detected")
+        if previous:
+            result["previous_priority"] = previous
+            if previous != decision["priority_detected"]:
+                self.stats["changed"] += 1
+                self.transitions[f"{previous} -> {decision['priority_detected']}"] += 1
+        if not self.full:
+            decision = {key: value for key, value in decision.items()
+                        if key not in ("response", "processed_message", "conversation_context")}
+        result.update(decision)
+        return result
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "resident_sessions": len(self.sessions),
+            "priorities": dict(self.priorities),
+            "transitions": dict(self.transitions)
+        }
+
+
+def run_worker(index: int, queue, results, output_path: str, rules_path: str, blocs_path: Optional[str],
+               options: Dict[str, Any]):
+    """Boucle d'un worker : classe les lots reçus et écrit ses résultats dans son propre fichier"""
+    logging.basicConfig(level=logging.ERROR)
+    rules = RuleSet.from_file(rules_path)
+    catalog = BlocCatalog.load(blocs_path, ResponseValidator.clean_response) if blocs_path else None
+    classifier = ShardClassifier(rules, catalog, **options)
+
+    with open(output_path, "w", encoding="utf-8", buffering=1 << 20) as output:
+        while True:
+            batch = queue.get()
+            if batch is None:
+                break
+            for record in batch:
+                try:
+                    result = classifier.classify(record)
+                except Exception as e:
+                    classifier.stats["errors"] += 1
+                    result = {**passthrough(record), "error": f"{type(e).__name__}: {str(e)}"}
+                if result is not None:
+                    output.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+    results.put((index, classifier.report()))
+
+
+def merge_reports(reports: List[Dict[str, Any]]) -> Dict[str, Any]:
+    merged = Counter()
+    priorities = Counter()
+    transitions = Counter()
+    for report in reports:
+        report = dict(report)
+        priorities.update(report.pop("priorities"))
+        transitions.update(report.pop("transitions"))
+        merged.update(report)
+    return {
+        **merged,
+        "priorities": dict(priorities.most_common()),
+        "transitions": dict(transitions.most_common())
+    }
+
+
+def classify_archives(paths: List[str], output_dir: str, workers: int, rules_path: str = DEFAULT_RULES_PATH,
+                      blocs_path: Optional[str] = None, max_sessions: int = 100_000,
+                      replay: str = "simulated", full: bool = False) -> Dict[str, Any]:
+    """Répartit les enregistrements par wa_id entre `workers` processus et fusionne leurs compteurs"""
+    os.makedirs(output_dir, exist_ok=True)
+    start = time.perf_counter()
+    options = {"max_sessions": max(1, max_sessions // workers), "replay": replay, "full": full}
+
+    # spawn : des workers neufs qui n'importent que le moteur (pas d'état hérité du parent)
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    queues = [context.Queue(maxsize=QUEUE_BATCHES) for _ in range(workers)]
+    processes = [
+        context.Process(
+            target=run_worker,
+            args=(index, queues[index], results, os.path.join(output_dir, f"shard-{index:02d}.ndjson"),
+                  rules_path, blocs_path, options),
+            daemon=True
+        )
+        for index in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    batches: List[List[Dict[str, Any]]] = [[] for _ in range(workers)]
+    errors = Counter()
+    try:
+        for path in paths:
+            for record in read_records(path, errors):
+                shard = shard_of(str(record.get("wa_id") or ""), workers)
+                batches[shard].append(record)
+                if len(batches[shard]) >= BATCH_SIZE:
+                    # Bloquant si le worker a QUEUE_BATCHES lots en attente : mémoire bornée
+                    put_checked(queues[shard], batches[shard], processes[shard])
+                    batches[shard] = []
+
+        for shard, batch in enumerate(batches):
+            if batch:
+                put_checked(queues[shard], batch, processes[shard])
+            put_checked(queues[shard], None, processes[shard])
+
+        reports = []
+        while len(reports) < workers:
+            try:
+                reports.append(results.get(timeout=1.0)[1])
+            except Empty:
+                if any(process.exitcode not in (None, 0) for process in processes):
+                    raise RuntimeError("Un worker s'est arrêté avant la fin de sa partition")
+        for process in processes:
+            process.join()
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    elapsed = time.perf_counter() - start
+    summary = merge_reports(reports)
+    summary.update({
+        "unreadable_lines": errors["unreadable_lines"],
+        "workers": workers,
+        "rules_version": RuleSet.from_file(rules_path).version,
+        "seconds": round(elapsed, 3),
+        "records_per_second": round(summary.get("records", 0) / elapsed, 1) if elapsed > 0 else None
+    })
+    with open(os.path.join(output_dir, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    return summary
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m api.archive", description=__doc__.splitlines()[0])
+    parser.add_argument("archives", nargs="+", help="archives NDJSON ou .csv (\"-\" : entrée standard en NDJSON)")
+    parser.add_argument("--output-dir", required=True, help="répertoire des résultats (shard-NN.ndjson, summary.json)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--rules", default=DEFAULT_RULES_PATH, help="configuration des règles")
+    parser.add_argument("--blocs", help="catalogue des blocs pour résoudre matched_bloc_id")
+    parser.add_argument("--max-sessions", type=int, default=100_000, help="sessions résidentes, tous workers confondus")
+    parser.add_argument("--replay", choices=("simulated", "recorded"), default="simulated",
+                        help="historique du bot : réponses décidées par le moteur ou réponses de l'archive")
+    parser.add_argument("--full", action="store_true", help="inclut le texte de réponse et le contexte")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    summary = classify_archives(
+        args.archives, args.output_dir, max(1, args.workers), args.rules, args.blocs,
+        args.max_sessions, args.replay, args.full
+    )
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,98 @@
+"""Catalogue versionné des blocs de réponse n8n
+
+Chargé au démarrage depuis un fichier JSON :
+
+    {"version": "2024-06-01", "blocs": {"bloc_id": "texte du bloc", ...}}
+
+Le texte est nettoyé une seule fois et ses caractéristiques (bloc de repli
+générique, mention paiement/délai) sont précalculées. Le webhook peut alors
+envoyer `matched_bloc_id` au lieu du texte complet ; un texte envoyé en clair
+identique à un bloc du catalogue réutilise aussi l'entrée précalculée.
+"""
+
+import json
+import logging
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Formulations des blocs de repli génériques (pas de vraie réponse n8n)
+BLOC_FALLBACK_INDICATORS = (
+    "je vais faire suivre ta demande à notre équipe",
+    "notre équipe est disponible du lundi au vendredi",
+    "on te tiendra informé dès que possible"
+)
+
+BLOC_PAYMENT_KEYWORDS = ("paiement", "délai")
+
+
+class Bloc:
+    """Bloc de réponse nettoyé, avec ses caractéristiques précalculées"""
+
+    __slots__ = ("bloc_id", "text", "is_fallback", "mentions_payment_delay")
+
+    def __init__(self, text: str, bloc_id: Optional[str] = None):
+        self.bloc_id = bloc_id
+        self.text = text
+        lowered = text.lower()
+        self.is_fallback = any(indicator in lowered for indicator in BLOC_FALLBACK_INDICATORS)
+        self.mentions_payment_delay = any(keyword in lowered for keyword in BLOC_PAYMENT_KEYWORDS)
+
+    def __repr__(self) -> str:
+        return f"Bloc(bloc_id={self.bloc_id!r}, text={self.text[:30]!r})"
+
+
+class BlocCatalog:
+    """Blocs indexés par id et par texte nettoyé, avec compteurs de résolution"""
+
+    def __init__(self, version: Optional[str] = None, blocs: Optional[Dict[str, Bloc]] = None):
+        self.version = version
+        self._by_id: Dict[str, Bloc] = blocs or {}
+        self._by_text: Dict[str, Bloc] = {bloc.text: bloc for bloc in self._by_id.values()}
+        self.id_hits = 0
+        self.id_misses = 0
+        self.text_hits = 0
+        self.text_misses = 0
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    @classmethod
+    def load(cls, path: str, clean: Callable[[str], str]) -> "BlocCatalog":
+        """Charge le catalogue JSON ; `clean` est appliqué une fois à chaque texte"""
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+
+        blocs = {}
+        for bloc_id, text in data["blocs"].items():
+            cleaned = clean(str(text))
+            if cleaned:
+                blocs[str(bloc_id)] = Bloc(cleaned, str(bloc_id))
+        return cls(str(data.get("version", "unversioned")), blocs)
+
+    def get(self, bloc_id: str) -> Optional[Bloc]:
+        bloc = self._by_id.get(bloc_id)
+        if bloc is None:
+            self.id_misses += 1
+        else:
+            self.id_hits += 1
+        return bloc
+
+    def match_text(self, text: str) -> Bloc:
+        """Bloc du catalogue au texte identique, sinon bloc ad hoc (caractéristiques calculées à la volée)"""
+        bloc = self._by_text.get(text)
+        if bloc is None:
+            self.text_misses += 1
+            return Bloc(text)
+        self.text_hits += 1
+        return bloc
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "blocs": len(self._by_id),
+            "id_hits": self.id_hits,
+            "id_misses": self.id_misses,
+            "text_hits": self.text_hits,
+            "text_misses": self.text_misses
+        }
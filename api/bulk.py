@@ -0,0 +1,225 @@
+"""Opérations de masse sur les sessions : effacement en tâche de fond et export NDJSON
+
+Une sélection combine (ET) une liste de wa_id, un préfixe et une durée
+d'inactivité minimale. L'effacement est un job de fond qui avance par tranches
+de temps bornées (`slice_seconds`) et rend la main à la boucle entre deux
+tranches : une requête de conversation n'attend jamais plus d'une tranche. Les
+critères sont réévalués au moment de l'effacement, si bien qu'une session
+redevenue active entre-temps n'est pas effacée par un filtre d'inactivité.
+Les jobs sont consultables (progression, durée des tranches) et annulables.
+
+L'export produit une ligne NDJSON par session, une tranche à la fois : le
+générateur n'avance que lorsque le client a consommé la tranche précédente
+(contre-pression du streaming), la mémoire reste donc bornée quel que soit le
+nombre de sessions. Les sessions froides sont lues sans être réhydratées.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+from .memory import ConversationMemory
+
+logger = logging.getLogger(__name__)
+
+
+class SessionSelector:
+    """Critères de sélection des sessions (combinés en ET)"""
+
+    def __init__(self, wa_ids: Optional[List[str]] = None, prefix: Optional[str] = None,
+                 idle_seconds: Optional[float] = None):
+        # Les clés du store sont textuelles : un wa_id fourni en nombre JSON est converti
+        self.wa_ids = list(dict.fromkeys(str(wa_id) for wa_id in wa_ids)) if wa_ids is not None else None
+        self.prefix = prefix or None
+        self.idle_seconds = idle_seconds
+
+    @property
+    def empty(self) -> bool:
+        return self.wa_ids is None and self.prefix is None and self.idle_seconds is None
+
+    def candidates(self, store) -> List[str]:
+        """wa_id à examiner : la liste fournie, sinon une copie des clés du store"""
+        if self.wa_ids is not None:
+            return self.wa_ids
+        return list(store.keys())
+
+    def matches(self, store, wa_id: str, now: float) -> bool:
+        if self.prefix is not None and not str(wa_id).startswith(self.prefix):
+            return False
+        last_interaction = store.last_interaction(wa_id)
+        if last_interaction is None:
+            return False
+        return self.idle_seconds is None or last_interaction <= now - self.idle_seconds
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "wa_ids": len(self.wa_ids) if self.wa_ids is not None else None,
+            "prefix": self.prefix,
+            "idle_seconds": self.idle_seconds
+        }
+
+
+class BulkJob:
+    """Effacement de masse en cours ou terminé"""
+
+    def __init__(self, job_id: int, selector: SessionSelector, dry_run: bool):
+        self.id = job_id
+        self.selector = selector
+        self.dry_run = dry_run
+        self.status = "pending"
+        self.candidates = 0
+        self.scanned = 0
+        self.matched = 0
+        self.cleared = 0
+        self.slices = 0
+        self.max_slice_seconds = 0.0
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.error: Optional[str] = None
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("done", "cancelled", "failed")
+
+    def to_dict(self) -> Dict[str, Any]:
+        end = self.finished_at or time.time()
+        return {
+            "job_id": self.id,
+            "operation": "clear",
+            "status": self.status,
+            "dry_run": self.dry_run,
+            "selector": self.selector.to_dict(),
+            "candidates": self.candidates,
+            "scanned": self.scanned,
+            "matched": self.matched,
+            "cleared": self.cleared,
+            "slices": self.slices,
+            "max_slice_ms": round(self.max_slice_seconds * 1000, 3),
+            "seconds": round(end - self.started_at, 4) if self.started_at else None,
+            "error": self.error
+        }
+
+
+class BulkOperations:
+    """Jobs d'effacement de masse et exports NDJSON, découpés en tranches de temps"""
+
+    def __init__(self, store, slice_seconds: float = 0.005, max_jobs: int = 50):
+        self.store = store
+        self.slice_seconds = slice_seconds
+        self.max_jobs = max_jobs
+        self.jobs: "OrderedDict[int, BulkJob]" = OrderedDict()
+        self._next_id = 1
+        self.sessions_cleared = 0
+        self.sessions_exported = 0
+        self.active_exports = 0
+
+    def submit_clear(self, selector: SessionSelector, dry_run: bool = False) -> BulkJob:
+        """Démarre un job d'effacement en tâche de fond"""
+        job = BulkJob(self._next_id, selector, dry_run)
+        self._next_id += 1
+        self.jobs[job.id] = job
+        self._prune()
+        job.task = asyncio.create_task(self._run_clear(job))
+        return job
+
+    def _prune(self):
+        """Ne garde que les `max_jobs` derniers jobs (les jobs en cours ne sont jamais oubliés)"""
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.done][:max(0, len(self.jobs) - self.max_jobs)]:
+            del self.jobs[job_id]
+
+    async def _run_clear(self, job: BulkJob):
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            candidates = job.selector.candidates(self.store)
+            job.candidates = len(candidates)
+            index = 0
+            while index < len(candidates):
+                slice_start = time.perf_counter()
+                slice_end = slice_start + self.slice_seconds
+                now = time.time()
+                while index < len(candidates) and time.perf_counter() < slice_end:
+                    wa_id = candidates[index]
+                    index += 1
+                    job.scanned += 1
+                    if not job.selector.matches(self.store, wa_id, now):
+                        continue
+                    job.matched += 1
+                    if not job.dry_run:
+                        del self.store[wa_id]
+                        job.cleared += 1
+                job.slices += 1
+                job.max_slice_seconds = max(job.max_slice_seconds, time.perf_counter() - slice_start)
+                await asyncio.sleep(0)
+            job.status = "done"
+            self.sessions_cleared += job.cleared
+            logger.info(f"🧹 Job {job.id} : {job.cleared} sessions effacées sur {job.matched} sélectionnées")
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+            self.sessions_cleared += job.cleared
+            raise
+        except Exception as e:
+            job.status = "failed"
+            job.error = f"{type(e).__name__}: {str(e)}"
+            self.sessions_cleared += job.cleared
+            logger.error(f"Error in bulk clear job {job.id}: {str(e)}")
+        finally:
+            job.finished_at = time.time()
+
+    def cancel(self, job_id: int) -> Optional[BulkJob]:
+        job = self.jobs.get(job_id)
+        if job is not None and not job.done and job.task is not None:
+            job.task.cancel()
+            if job.status == "pending":
+                # Annulé avant sa première tranche : la coroutine ne s'exécutera pas
+                job.status = "cancelled"
+                job.finished_at = time.time()
+        return job
+
+    async def export(self, selector: SessionSelector,
+                     render: Callable[[str, ConversationMemory], Dict[str, Any]]) -> AsyncIterator[str]:
+        """Lignes NDJSON des sessions sélectionnées, une tranche de temps par morceau envoyé"""
+        self.active_exports += 1
+        try:
+            candidates = selector.candidates(self.store)
+            index = 0
+            while index < len(candidates):
+                slice_end = time.perf_counter() + self.slice_seconds
+                now = time.time()
+                lines = []
+                while index < len(candidates) and time.perf_counter() < slice_end:
+                    wa_id = candidates[index]
+                    index += 1
+                    if not selector.matches(self.store, wa_id, now):
+                        continue
+                    memory = self.store.peek(wa_id)
+                    if memory is not None:
+                        lines.append(json.dumps(render(wa_id, memory), ensure_ascii=False) + "\n")
+                if lines:
+                    self.sessions_exported += len(lines)
+                    yield "".join(lines)
+                await asyncio.sleep(0)
+        finally:
+            self.active_exports -= 1
+
+    async def stop(self):
+        """Annule les jobs en cours (les sessions non encore traitées sont conservées)"""
+        running = [job.task for job in self.jobs.values() if not job.done and job.task is not None]
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "jobs_running": sum(1 for job in self.jobs.values() if not job.done),
+            "jobs_submitted": self._next_id - 1,
+            "sessions_cleared": self.sessions_cleared,
+            "sessions_exported": self.sessions_exported,
+            "active_exports": self.active_exports,
+            "slice_ms": round(self.slice_seconds * 1000, 3)
+        }
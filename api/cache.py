@@ -0,0 +1,125 @@
+"""Cache LRU + TTL des réponses générées par le modèle
+
+La clé combine la priorité détectée, le message normalisé, les drapeaux de
+contexte et une empreinte de ce dont la réponse dépend réellement : l'état du
+résumé (drapeaux actifs) et le dernier tour de l'assistant. Deux conversations
+qui divergent plus tôt mais en sont au même point partagent donc leur réponse ;
+une conversation à laquelle l'assistant a répondu autre chose, non.
+"""
+
+import hashlib
+import json
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, Optional, Tuple
+
+# Drapeaux de analyze_conversation_context qui changent la réponse attendue
+CONTEXT_KEY_FLAGS = (
+    "previous_topic",
+    "is_follow_up",
+    "needs_greeting",
+    "awaiting_cpf_info",
+    "awaiting_financing_info",
+    "affiliation_context_detected",
+    "awaiting_steps_info",
+    "payment_context_detected",
+    "financing_question_asked",
+    "timing_question_asked",
+)
+
+_NON_WORD = re.compile(r"[^\w]+")
+
+
+def normalize_message(message: str) -> str:
+    """Minuscules, sans accents ni ponctuation, espaces normalisés"""
+    decomposed = unicodedata.normalize("NFKD", message.lower())
+    without_accents = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return _NON_WORD.sub(" ", without_accents).strip()
+
+
+def history_digest(history: Iterable[Any], summary: Optional[Dict[str, Any]] = None) -> str:
+    """Empreinte du dernier message de l'assistant et des drapeaux actifs du résumé
+
+    Le reste de l'historique et le nombre de messages résumés sont volontairement ignorés.
+    """
+    last_ai = next((message for message in reversed(list(history)) if message.type == "ai"), None)
+    flags = sorted(name for name, value in summary["state"].items() if value is True) if summary else []
+
+    digest = hashlib.blake2b(digest_size=16)
+    content = str(last_ai.content).encode("utf-8") if last_ai is not None else b""
+    # Longueur préfixée : le message et les drapeaux ne peuvent pas se confondre
+    digest.update(f"{len(content)}:".encode("utf-8"))
+    digest.update(content)
+    digest.update(json.dumps(flags, ensure_ascii=False).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def make_cache_key(priority_detected: str, message: str, conversation_context: Dict[str, Any],
+                   rules_version: Optional[str] = None, history: Optional[str] = None) -> Tuple[Hashable, ...]:
+    """La version des règles fait partie de la clé : un nouveau prompt ne réutilise pas les anciennes réponses
+
+    `history` est l'empreinte (history_digest) du dernier tour de l'assistant et de l'état résumé.
+    """
+    flags = tuple(conversation_context.get(flag) for flag in CONTEXT_KEY_FLAGS)
+    return (rules_version, priority_detected, normalize_message(message), flags, history)
+
+
+class ResponseCache:
+    """Cache LRU avec expiration, et métriques de taux de succès"""
+
+    def __init__(self, max_entries: int = 2048, ttl_seconds: float = 3600.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Hashable, Tuple[float, str]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.stores = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.expired += 1
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Hashable, value: str):
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        self.stores += 1
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "stores": self.stores
+        }
@@ -0,0 +1,127 @@
+"""Classification de flux NDJSON par le moteur de décision, sans serveur HTTP
+
+Usage : python -m api.cli [FICHIER ...] [-o SORTIE] [--rules rules.json] [--blocs blocs.json]
+
+Chaque ligne d'entrée est un objet JSON au format du webhook :
+
+    {"wa_id": "...", "message": "...", "matched_bloc_response": "...", "matched_bloc_id": "...",
+     "history": [{"role": "user", "content": "..."}, ...]}
+
+Chaque ligne de sortie reprend `wa_id`/`id` et ajoute la décision (api.engine.decide).
+Une ligne invalide produit une ligne {"line": n, "error": "..."} sans arrêter le flux.
+Sans fichier (ou avec "-"), l'entrée standard est lue.
+"""
+
+import argparse
+import json
+import logging
+import sys
+import time
+from collections import Counter
+from typing import Any, Dict, Iterator, Optional, TextIO
+
+from .blocs import BlocCatalog
+from .engine import DEFAULT_RULES_PATH, ResponseValidator, decide
+from .rules import RuleSet
+
+# Champs de la requête recopiés tels quels dans la sortie
+PASSTHROUGH_FIELDS = ("id", "wa_id")
+
+# Champs de la décision omis en mode --compact
+VERBOSE_FIELDS = ("response", "processed_message", "conversation_context")
+
+
+def read_lines(paths) -> Iterator[str]:
+    for path in paths or ["-"]:
+        if path == "-":
+            yield from sys.stdin
+        else:
+            with open(path, "r", encoding="utf-8") as f:
+                yield from f
+
+
+def classify_record(record: Dict[str, Any], rules: RuleSet, catalog: Optional[BlocCatalog]) -> Dict[str, Any]:
+    """Décision pour un objet d'entrée (mêmes champs et mêmes replis que le webhook)"""
+    message = record.get("message_original", record.get("message", ""))
+    if not message or not str(message).strip():
+        raise ValueError("message is required")
+
+    bloc = None
+    if catalog is not None and record.get("matched_bloc_id"):
+        bloc = catalog.get(str(record["matched_bloc_id"]))
+    if bloc is None:
+        bloc = record.get("matched_bloc_response") or None
+
+    result = {field: record[field] for field in PASSTHROUGH_FIELDS if field in record}
+    result.update(decide(record.get("history") or [], str(message), bloc, record.get("summary"), rules))
+    return result
+
+
+def classify_stream(lines, output: TextIO, rules: RuleSet, catalog: Optional[BlocCatalog] = None,
+                    compact: bool = False) -> Dict[str, Any]:
+    """Classe chaque ligne et écrit le résultat au fil de l'eau ; retourne les compteurs"""
+    priorities = Counter()
+    errors = 0
+    start = time.perf_counter()
+
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError("expected a JSON object")
+            result = classify_record(record, rules, catalog)
+        except Exception as e:
+            errors += 1
+            output.write(json.dumps({"line": number, "error": f"{type(e).__name__}: {str(e)}"}, ensure_ascii=False) + "\n")
+            continue
+
+        priorities[result["priority_detected"]] += 1
+        if compact:
+            for field in VERBOSE_FIELDS:
+                result.pop(field, None)
+        output.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+    elapsed = time.perf_counter() - start
+    classified = sum(priorities.values())
+    return {
+        "classified": classified,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "messages_per_second": round(classified / elapsed, 1) if elapsed > 0 else None,
+        "priorities": dict(priorities.most_common())
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m api.cli", description=__doc__.splitlines()[0])
+    parser.add_argument("inputs", nargs="*", help="fichiers NDJSON (défaut : entrée standard)")
+    parser.add_argument("-o", "--output", default="-", help="fichier de sortie NDJSON (défaut : sortie standard)")
+    parser.add_argument("--rules", help="configuration des règles (défaut : api/rules.json)")
+    parser.add_argument("--blocs", help="catalogue des blocs pour résoudre matched_bloc_id")
+    parser.add_argument("--compact", action="store_true", help="omet le texte de réponse et le contexte")
+    parser.add_argument("--summary", action="store_true", help="affiche les compteurs sur la sortie d'erreur")
+    parser.add_argument("--verbose", action="store_true", help="journalise le détail des règles")
+    args = parser.parse_args(argv)
+
+    # Les règles journalisent chaque message en INFO : silencieux par défaut en traitement par lots
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.ERROR)
+
+    rules = RuleSet.from_file(args.rules or DEFAULT_RULES_PATH)
+    catalog = BlocCatalog.load(args.blocs, ResponseValidator.clean_response) if args.blocs else None
+
+    output = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    try:
+        stats = classify_stream(read_lines(args.inputs), output, rules, catalog, compact=args.compact)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    if args.summary:
+        print(json.dumps({"rules_version": rules.version, **stats}, ensure_ascii=False), file=sys.stderr)
+    return 1 if stats["errors"] and not stats["classified"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
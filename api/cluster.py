@@ -0,0 +1,564 @@
+"""Service multi-processus : N workers, chacun propriétaire d'une partie des wa_id
+
+Usage : python -m api.cluster [--workers N] [--host 0.0.0.0] [--port 8000]
+
+Le processus principal démarre N workers uvicorn (api.process:app) sur des
+sockets Unix et sert un dispatcher léger : pour POST /, le wa_id est extrait
+du corps comme dans process_message et la requête est transmise telle quelle
+au worker propriétaire sur l'anneau de hachage cohérent (api.sharding). Les
+sessions restent dans la mémoire locale de leur worker, sans état partagé ni
+verrou entre processus. /clear_memory/{wa_id} va au propriétaire ; les autres
+endpoints sont diffusés à tous les workers (réponses regroupées par worker).
+
+Chaque worker a ses propres fichiers (snapshot, niveau froid, journal des
+décisions, escalades en fichier), suffixés par son numéro. Au démarrage et à
+chaque changement du nombre de workers (POST /cluster/resize?workers=M), les
+sessions sont redistribuées : pour chaque couple (source, destination), la
+source exporte une copie au format snapshot, la destination l'importe, puis
+seulement la source oublie ses copies. Le routage est suspendu pendant la
+redistribution : les requêtes attendent (au plus --route-timeout secondes).
+Un worker qui s'arrête inopinément est relancé.
+"""
+
+import argparse
+import asyncio
+import glob
+import json
+import logging
+import os
+import re
+import secrets
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+
+import httpx
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+from .sharding import CLUSTER_TOKEN_HEADER, DEFAULT_VNODES, HashRing
+
+logger = logging.getLogger(__name__)
+
+# Fichiers propres à chaque worker : variable, valeur par défaut dans api.process, répertoire ou fichier
+WORKER_PATHS = (
+    ("SESSION_SNAPSHOT_PATH", "sessions.snapshot", False),
+    ("SESSION_COLD_PATH", "sessions.cold.sqlite3", False),
+    ("DECISION_LOG_DIR", "decision_logs", True),
+)
+
+# En-têtes propres à une connexion HTTP, jamais recopiés d'un côté à l'autre
+HOP_BY_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-connection", "te", "trailer", "transfer-encoding", "upgrade",
+    "host", "content-length"
+}
+
+MAX_REQUEST_BODY_BYTES = int(os.getenv("MAX_REQUEST_BODY_BYTES", "65536"))
+
+
+def worker_path(value: str, index: int, directory: bool) -> str:
+    """sessions.snapshot -> sessions.worker2.snapshot ; decision_logs -> decision_logs/worker2"""
+    if directory:
+        return os.path.join(value, f"worker{index}")
+    root, ext = os.path.splitext(value)
+    return f"{root}.worker{index}{ext}"
+
+
+def extract_wa_id(body: bytes) -> str:
+    """wa_id que process_message retiendra pour ce corps (mêmes valeurs par défaut)"""
+    try:
+        payload = json.loads(body)
+    except (ValueError, UnicodeDecodeError):
+        # Corps illisible : le worker répondra 400, n'importe lequel convient
+        return "fallback_wa_id"
+    if isinstance(payload, dict):
+        return str(payload.get("wa_id", "default_wa_id"))
+    return "fallback_wa_id"
+
+
+class RoutingTimeout(Exception):
+    """Le worker propriétaire n'est pas devenu disponible à temps"""
+
+
+class Worker:
+    """Processus uvicorn d'un worker et client HTTP sur sa socket Unix"""
+
+    def __init__(self, index: int, socket_path: str):
+        self.index = index
+        self.socket_path = socket_path
+        self.process: Optional[subprocess.Popen] = None
+        self.client: Optional[httpx.AsyncClient] = None
+        self.ready = asyncio.Event()
+        self.retiring = False
+        self.restarts = 0
+        self.routed = 0
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def spawn(self, env: Dict[str, str], log_level: str):
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "api.process:app", "--uds", self.socket_path, "--log-level", log_level],
+            env=env
+        )
+        self.client = httpx.AsyncClient(
+            transport=httpx.AsyncHTTPTransport(uds=self.socket_path),
+            base_url="http://worker",
+            timeout=None,
+            limits=httpx.Limits(max_connections=1000, max_keepalive_connections=100)
+        )
+        logger.info(f"🧩 Worker {self.index} démarré (pid {self.process.pid})")
+
+    async def wait_ready(self, timeout: float, snapshot_enabled: bool):
+        """Attend /ready (et la fin de la restauration du snapshot, qui précède toute redistribution)"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if not self.alive:
+                raise RuntimeError(f"worker {self.index} exited with code {self.process.returncode}")
+            try:
+                response = await self.client.get("/ready")
+                if response.status_code == 200:
+                    snapshot = response.json().get("snapshot") or {}
+                    if not snapshot_enabled or snapshot.get("complete"):
+                        self.ready.set()
+                        return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.1)
+        raise TimeoutError(f"worker {self.index} not ready after {timeout}s")
+
+    async def terminate(self, timeout: float = 30.0):
+        """Arrêt gracieux (SIGTERM : le worker sauvegarde son snapshot), puis SIGKILL au-delà de `timeout`"""
+        self.retiring = True
+        self.ready.clear()
+        if self.alive:
+            self.process.send_signal(signal.SIGTERM)
+        if self.process is not None:
+            try:
+                await asyncio.wait_for(asyncio.to_thread(self.process.wait), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"🧩 Worker {self.index} toujours actif après {timeout}s, arrêt forcé")
+                self.process.kill()
+                await asyncio.to_thread(self.process.wait)
+        if self.client is not None:
+            await self.client.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pid": self.process.pid if self.process is not None else None,
+            "alive": self.alive,
+            "ready": self.ready.is_set(),
+            "restarts": self.restarts,
+            "routed": self.routed
+        }
+
+
+class Cluster:
+    """Workers, anneau de hachage, routage et redistribution des sessions"""
+
+    def __init__(self, workers: int, vnodes: int = DEFAULT_VNODES, socket_dir: Optional[str] = None,
+                 log_level: str = "info", ready_timeout: float = 120.0, route_timeout: float = 10.0,
+                 drain_timeout: float = 30.0, base_env: Optional[Dict[str, str]] = None):
+        if workers < 1:
+            raise ValueError("at least one worker is required")
+        self.size = workers
+        self.vnodes = vnodes
+        self.ring = HashRing(range(workers), vnodes)
+        self.log_level = log_level
+        self.ready_timeout = ready_timeout
+        self.route_timeout = route_timeout
+        self.drain_timeout = drain_timeout
+        self.base_env = dict(base_env if base_env is not None else os.environ)
+        self.token = secrets.token_hex(16)
+        self._own_socket_dir = socket_dir is None
+        self.socket_dir = socket_dir or tempfile.mkdtemp(prefix="jak-cluster-")
+
+        self.workers: Dict[int, Worker] = {}
+        self._routing = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._supervisor: Optional[asyncio.Task] = None
+        self.inflight = 0
+        self.rebalances = 0
+        self.last_rebalance: Optional[Dict[str, Any]] = None
+        self.last_error: Optional[str] = None
+
+    @property
+    def _auth(self) -> Dict[str, str]:
+        return {CLUSTER_TOKEN_HEADER: self.token}
+
+    @property
+    def snapshot_path(self) -> str:
+        return self.base_env.get("SESSION_SNAPSHOT_PATH", "sessions.snapshot")
+
+    def worker_env(self, index: int) -> Dict[str, str]:
+        env = dict(self.base_env)
+        env.update(CLUSTER_WORKER_ID=str(index), CLUSTER_TOKEN=self.token)
+        for variable, default, directory in WORKER_PATHS:
+            value = env.get(variable, default)
+            if value:
+                env[variable] = worker_path(value, index, directory)
+        if env.get("ESCALATION_SINK", "none") == "file":
+            # Plusieurs processus n'écrivent pas dans le même fichier NDJSON
+            env["ESCALATION_PATH"] = worker_path(env.get("ESCALATION_PATH") or "escalations.ndjson", index, False)
+        return env
+
+    def _spawn(self, index: int) -> Worker:
+        worker = Worker(index, os.path.join(self.socket_dir, f"worker{index}.sock"))
+        worker.spawn(self.worker_env(index), self.log_level)
+        self.workers[index] = worker
+        return worker
+
+    async def start(self):
+        """Démarre les workers, redistribue les sessions restaurées, puis ouvre le routage"""
+        for index in range(self.size):
+            self._spawn(index)
+        await asyncio.gather(*(
+            worker.wait_ready(self.ready_timeout, bool(self.snapshot_path)) for worker in self.workers.values()
+        ))
+        await self._adopt_orphan_snapshots()
+        await self._rebalance(self.ring)
+        self._routing.set()
+        self._supervisor = asyncio.create_task(self._supervise())
+        logger.info(f"✅ Cluster prêt : {self.size} workers")
+
+    async def _adopt_orphan_snapshots(self):
+        """Snapshots laissés par des workers d'un démarrage précédent plus large : confiés au worker 0"""
+        if not self.snapshot_path:
+            return
+        root, ext = os.path.splitext(self.snapshot_path)
+        pattern = re.compile(re.escape(root) + r"\.worker(\d+)" + re.escape(ext) + "$")
+        for path in sorted(glob.glob(f"{glob.escape(root)}.worker*{glob.escape(ext)}")):
+            match = pattern.match(path)
+            if not match or int(match.group(1)) < self.size:
+                continue
+            with open(path, "rb") as f:
+                data = f.read()
+            response = await self.workers[0].client.post("/_cluster/import", content=data, headers=self._auth)
+            response.raise_for_status()
+            os.remove(path)
+            logger.info(f"🔀 Snapshot orphelin {path} repris : {response.json().get('imported')} sessions")
+
+    async def _rebalance(self, ring: HashRing) -> int:
+        """Déplace chaque session vers son propriétaire sur `ring` (copie, import, puis oubli à la source)"""
+        start = time.perf_counter()
+        moved = 0
+        for source in list(self.workers.values()):
+            for target in ring.workers:
+                if target == source.index:
+                    continue
+                params = {"target": target, "workers": len(ring), "vnodes": ring.vnodes}
+                exported = await source.client.post("/_cluster/export", params=params, headers=self._auth)
+                exported.raise_for_status()
+                count = int(exported.headers.get("X-Session-Count", "0"))
+                if not count:
+                    continue
+                imported = await self.workers[target].client.post(
+                    "/_cluster/import", content=exported.content, headers=self._auth
+                )
+                imported.raise_for_status()
+                forgotten = await source.client.post("/_cluster/forget", params=params, headers=self._auth)
+                forgotten.raise_for_status()
+                moved += count
+        self.rebalances += 1
+        self.last_rebalance = {
+            "workers": len(ring),
+            "moved_sessions": moved,
+            "seconds": round(time.perf_counter() - start, 4)
+        }
+        if moved:
+            logger.info(f"🔀 {moved} sessions redistribuées en {self.last_rebalance['seconds']}s")
+        return moved
+
+    async def _drain(self):
+        """Attend la fin des requêtes en cours (dans la limite de drain_timeout)"""
+        deadline = time.monotonic() + self.drain_timeout
+        while self.inflight and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        if self.inflight:
+            logger.warning(f"🔀 {self.inflight} requêtes encore en cours au début de la redistribution")
+
+    async def _retire(self, index: int):
+        worker = self.workers.pop(index)
+        await worker.terminate()
+        # Ses sessions ont été transférées : son snapshot (vide) n'a plus lieu d'être
+        if self.snapshot_path:
+            path = worker_path(self.snapshot_path, index, False)
+            if os.path.exists(path):
+                os.remove(path)
+
+    async def resize(self, size: int) -> Dict[str, Any]:
+        """Change le nombre de workers et redistribue les sessions, routage suspendu pendant le transfert"""
+        if size < 1:
+            raise ValueError("at least one worker is required")
+        async with self._lock:
+            if size == self.size:
+                return self.stats()
+            old_size = self.size
+            ring = HashRing(range(size), self.vnodes)
+            new_workers = [self._spawn(index) for index in range(old_size, size)]
+            try:
+                await asyncio.gather(*(worker.wait_ready(self.ready_timeout, False) for worker in new_workers))
+            except (RuntimeError, TimeoutError):
+                for worker in new_workers:
+                    await self._retire(worker.index)
+                raise
+
+            self._routing.clear()
+            try:
+                await self._drain()
+                try:
+                    await self._rebalance(ring)
+                except httpx.HTTPError as e:
+                    self.last_error = f"{type(e).__name__}: {str(e)}"
+                    logger.error(f"Error rebalancing sessions, reverting to {old_size} workers: {str(e)}")
+                    # Les sessions déjà déplacées reviennent à leur propriétaire sur l'ancien anneau
+                    await self._rebalance(self.ring)
+                    for worker in new_workers:
+                        await self._retire(worker.index)
+                    raise
+                self.ring = ring
+                self.size = size
+                for index in range(size, old_size):
+                    await self._retire(index)
+            finally:
+                self._routing.set()
+            logger.info(f"🧩 Cluster redimensionné : {old_size} -> {size} workers")
+            return self.stats()
+
+    async def _supervise(self):
+        """Relance un worker arrêté inopinément (ses sessions repartent de son dernier snapshot)"""
+        while True:
+            await asyncio.sleep(1.0)
+            for worker in list(self.workers.values()):
+                if worker.process is None or worker.alive or worker.retiring:
+                    continue
+                self.last_error = f"worker {worker.index} exited with code {worker.process.returncode}"
+                logger.error(f"Worker {worker.index} exited with code {worker.process.returncode}, restarting")
+                worker.ready.clear()
+                worker.restarts += 1
+                await worker.client.aclose()
+                worker.spawn(self.worker_env(worker.index), self.log_level)
+                try:
+                    await worker.wait_ready(self.ready_timeout, bool(self.snapshot_path))
+                except (RuntimeError, TimeoutError) as e:
+                    logger.error(f"Error restarting worker {worker.index}: {str(e)}")
+
+    async def stop(self):
+        self._routing.clear()
+        if self._supervisor is not None:
+            self._supervisor.cancel()
+            try:
+                await self._supervisor
+            except asyncio.CancelledError:
+                pass
+            self._supervisor = None
+        await asyncio.gather(*(worker.terminate() for worker in self.workers.values()))
+        if self._own_socket_dir:
+            shutil.rmtree(self.socket_dir, ignore_errors=True)
+
+    async def _wait_routing(self):
+        if not self._routing.is_set():
+            try:
+                await asyncio.wait_for(self._routing.wait(), self.route_timeout)
+            except asyncio.TimeoutError:
+                raise RoutingTimeout("cluster is rebalancing")
+
+    async def route(self, wa_id: str) -> Worker:
+        """Worker propriétaire du wa_id (attend la fin d'une redistribution ou d'un redémarrage)"""
+        await self._wait_routing()
+        worker = self.workers[self.ring.owner(wa_id)]
+        if not worker.ready.is_set():
+            try:
+                await asyncio.wait_for(worker.ready.wait(), self.route_timeout)
+            except asyncio.TimeoutError:
+                raise RoutingTimeout(f"worker {worker.index} is not ready")
+        worker.routed += 1
+        return worker
+
+    async def forward(self, worker: Worker, request: Request, body: bytes) -> Response:
+        """Transmet la requête telle quelle et relaie la réponse au fil de l'eau (streaming compris)"""
+        headers = [(key, value) for key, value in request.headers.items() if key.lower() not in HOP_BY_HOP_HEADERS]
+        upstream = worker.client.build_request(
+            request.method, request.url.path, params=request.url.query, headers=headers, content=body
+        )
+        self.inflight += 1
+        try:
+            response = await worker.client.send(upstream, stream=True)
+        except httpx.HTTPError:
+            self.inflight -= 1
+            raise
+
+        async def relay():
+            try:
+                async for chunk in response.aiter_raw():
+                    yield chunk
+            finally:
+                await response.aclose()
+                self.inflight -= 1
+
+        return StreamingResponse(
+            relay(),
+            status_code=response.status_code,
+            headers={key: value for key, value in response.headers.items() if key.lower() not in HOP_BY_HOP_HEADERS}
+        )
+
+    async def broadcast(self, request: Request, body: bytes) -> Response:
+        """Envoie la requête à tous les workers ; NDJSON concaténé, sinon réponses JSON par worker"""
+        await self._wait_routing()
+        headers = [(key, value) for key, value in request.headers.items() if key.lower() not in HOP_BY_HOP_HEADERS]
+        workers = sorted(self.workers.values(), key=lambda worker: worker.index)
+        responses = await asyncio.gather(*(
+            worker.client.request(request.method, request.url.path, params=request.url.query, headers=headers, content=body)
+            for worker in workers
+        ), return_exceptions=True)
+
+        if any(isinstance(r, httpx.Response) and "ndjson" in r.headers.get("content-type", "") for r in responses):
+            content = b"".join(r.content for r in responses if isinstance(r, httpx.Response) and r.status_code < 400)
+            return Response(content=content, media_type="application/x-ndjson")
+
+        results = {}
+        failed = False
+        for worker, response in zip(workers, responses):
+            if isinstance(response, Exception):
+                failed = True
+                results[str(worker.index)] = {"error": f"{type(response).__name__}: {str(response)}"}
+                continue
+            failed = failed or response.status_code >= 400
+            try:
+                results[str(worker.index)] = response.json()
+            except ValueError:
+                results[str(worker.index)] = {"status_code": response.status_code, "body": response.text}
+        return JSONResponse(status_code=502 if failed else 200, content={"workers": results})
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.size,
+            "vnodes": self.vnodes,
+            "routing": self._routing.is_set(),
+            "inflight": self.inflight,
+            "rebalances": self.rebalances,
+            "last_rebalance": self.last_rebalance,
+            "last_error": self.last_error,
+            "worker_status": {str(index): worker.stats() for index, worker in sorted(self.workers.items())}
+        }
+
+
+async def read_body(request: Request) -> bytes:
+    """Corps de la requête, refusé (413) au-delà de MAX_REQUEST_BODY_BYTES comme dans les workers"""
+    declared = request.headers.get("content-length", "")
+    if declared.isdigit() and int(declared) > MAX_REQUEST_BODY_BYTES:
+        raise HTTPException(status_code=413, detail=f"Request body too large (max {MAX_REQUEST_BODY_BYTES} bytes)")
+    chunks = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > MAX_REQUEST_BODY_BYTES:
+            raise HTTPException(status_code=413, detail=f"Request body too large (max {MAX_REQUEST_BODY_BYTES} bytes)")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def unavailable(reason: str) -> JSONResponse:
+    return JSONResponse(status_code=503, content={"detail": reason}, headers={"Retry-After": "1"})
+
+
+def create_app(cluster: Cluster) -> FastAPI:
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        await cluster.start()
+        yield
+        await cluster.stop()
+
+    app = FastAPI(title="JAK Company AI Agent API (cluster)", version="14.0", lifespan=lifespan)
+
+    @app.post("/")
+    async def dispatch_message(request: Request):
+        """Webhook principal : transmis au worker propriétaire du wa_id"""
+        body = await read_body(request)
+        try:
+            worker = await cluster.route(extract_wa_id(body))
+            return await cluster.forward(worker, request, body)
+        except RoutingTimeout as e:
+            return unavailable(str(e))
+        except httpx.HTTPError as e:
+            logger.error(f"Error forwarding request: {str(e)}")
+            return unavailable("worker unavailable")
+
+    @app.post("/clear_memory/{wa_id}")
+    async def dispatch_clear_memory(wa_id: str, request: Request):
+        """Effacement d'une session : transmis au worker propriétaire du wa_id"""
+        try:
+            worker = await cluster.route(wa_id)
+            return await cluster.forward(worker, request, b"")
+        except RoutingTimeout as e:
+            return unavailable(str(e))
+        except httpx.HTTPError as e:
+            logger.error(f"Error forwarding clear_memory request: {str(e)}")
+            return unavailable("worker unavailable")
+
+    @app.get("/ready")
+    async def cluster_ready():
+        """Prêt quand le routage est ouvert et que tous les workers sont prêts"""
+        ready = cluster._routing.is_set() and all(worker.ready.is_set() for worker in cluster.workers.values())
+        content = {"status": "ready" if ready else "warming_up", **cluster.stats()}
+        return content if ready else JSONResponse(status_code=503, content=content)
+
+    @app.get("/cluster")
+    async def cluster_status():
+        return cluster.stats()
+
+    @app.post("/cluster/resize")
+    async def cluster_resize(workers: int):
+        """Change le nombre de workers à chaud (sessions redistribuées)"""
+        if not 1 <= workers <= 256:
+            raise HTTPException(status_code=400, detail="workers must be between 1 and 256")
+        try:
+            return await cluster.resize(workers)
+        except (RuntimeError, TimeoutError, httpx.HTTPError) as e:
+            raise HTTPException(status_code=500, detail=f"Resize failed: {str(e)}")
+
+    @app.api_route("/{path:path}", methods=["GET", "POST", "DELETE"])
+    async def dispatch_broadcast(path: str, request: Request):
+        """Endpoints d'administration : diffusés à tous les workers"""
+        if path.startswith("_cluster"):
+            raise HTTPException(status_code=404, detail="Not Found")
+        try:
+            return await cluster.broadcast(request, await read_body(request))
+        except RoutingTimeout as e:
+            return unavailable(str(e))
+
+    return app
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m api.cluster", description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=int(os.getenv("CLUSTER_WORKERS", str(os.cpu_count() or 1))),
+                        help="nombre de workers (défaut : CLUSTER_WORKERS ou nombre de cœurs)")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--vnodes", type=int, default=DEFAULT_VNODES, help="points par worker sur l'anneau")
+    parser.add_argument("--socket-dir", help="répertoire des sockets des workers (défaut : temporaire)")
+    parser.add_argument("--route-timeout", type=float, default=10.0,
+                        help="attente maximale d'un worker pendant une redistribution (secondes)")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args(argv)
+
+    import uvicorn
+
+    logging.basicConfig(level=logging.INFO)
+    cluster = Cluster(args.workers, vnodes=args.vnodes, socket_dir=args.socket_dir,
+                      log_level=args.log_level, route_timeout=args.route_timeout)
+    uvicorn.run(create_app(cluster), host=args.host, port=args.port, log_level=args.log_level)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+"""Budget de temps par requête, vérifié à chaque étape du pipeline
+
+L'échéance est fixée à l'arrivée de la requête (REQUEST_DEADLINE_SECONDS, ou
+l'en-tête X-Request-Deadline-Ms de l'appelant, plafonné). Chaque étape vérifie
+le temps restant ; la première étape qui constate le dépassement est comptée et
+le pipeline se rabat sur la meilleure réponse déjà disponible.
+"""
+
+import time
+from typing import Any, Dict, Optional
+
+DEADLINE_HEADER = "x-request-deadline-ms"
+
+# Étapes de process_message, dans l'ordre d'exécution
+STAGES = ("parse", "admission", "context", "rules", "generation", "commit")
+
+
+def resolve_budget(header_value: Optional[str], default: float, maximum: float) -> float:
+    """Budget en secondes : en-tête de l'appelant (en ms) s'il est valide, sinon la valeur par défaut"""
+    if header_value:
+        try:
+            requested = float(header_value) / 1000
+        except ValueError:
+            requested = 0
+        if requested > 0:
+            return min(requested, maximum)
+    return min(default, maximum)
+
+
+class DeadlineMetrics:
+    """Compteurs de dépassement d'échéance, par étape"""
+
+    def __init__(self, default_budget: float, max_budget: float):
+        self.default_budget = default_budget
+        self.max_budget = max_budget
+        self.requests = 0
+        self.exceeded = 0
+        self.overruns: Dict[str, int] = {stage: 0 for stage in STAGES}
+
+    def record_overrun(self, stage: str):
+        self.exceeded += 1
+        self.overruns[stage] = self.overruns.get(stage, 0) + 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "default_budget_seconds": self.default_budget,
+            "max_budget_seconds": self.max_budget,
+            "requests": self.requests,
+            "exceeded": self.exceeded,
+            "overruns_by_stage": dict(self.overruns)
+        }
+
+
+class RequestDeadline:
+    """Échéance d'une requête ; retient la première étape qui l'a dépassée"""
+
+    __slots__ = ("budget", "started_at", "expires_at", "exceeded_stage", "_metrics")
+
+    def __init__(self, budget: float, metrics: Optional[DeadlineMetrics] = None):
+        self.budget = budget
+        self.started_at = time.monotonic()
+        self.expires_at = self.started_at + budget
+        self.exceeded_stage: Optional[str] = None
+        self._metrics = metrics
+        if metrics is not None:
+            metrics.requests += 1
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    @property
+    def exceeded(self) -> bool:
+        return self.exceeded_stage is not None
+
+    def check(self, stage: str) -> bool:
+        """Vrai si l'échéance est dépassée ; le dépassement n'est compté qu'une fois, sur la première étape"""
+        if self.exceeded_stage is not None:
+            return True
+        if time.monotonic() < self.expires_at:
+            return False
+        self.exceeded_stage = stage
+        if self._metrics is not None:
+            self._metrics.record_overrun(stage)
+        return True
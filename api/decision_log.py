@@ -0,0 +1,489 @@
+"""Journal binaire des décisions : enregistrements fixes, append-only, rotation
+
+Chaque décision du webhook produit un enregistrement de RECORD.size octets
+(horodatage, hash du wa_id, priorité, type de réponse, escalade, financement,
+délai en jours, temps par étape). `record` empaquette l'enregistrement dans un
+tampon en mémoire, sans I/O ; un worker écrit le tampon par lots toutes les
+`flush_interval` secondes. Au-delà de `max_file_bytes`, le fichier actif est
+renommé avec un horodatage et un nouveau fichier est ouvert ; seuls les
+`max_files` fichiers les plus récents sont conservés.
+
+Format d'un fichier : MAGIC, longueur de l'en-tête (uint32), en-tête JSON
+(champs et tables de codes), complété jusqu'à un multiple de 8 octets, puis les
+enregistrements. Les tables de codes ne font que s'allonger : un code déjà
+attribué garde son sens, les valeurs inconnues sont codées 0 ("OTHER").
+
+Lecture : python -m api.decision_log [FICHIER|RÉPERTOIRE ...] [--since ISO] [--until ISO]
+Les fichiers sont projetés en mémoire (numpy.memmap) et agrégés par opérations
+vectorisées ; numpy n'est requis que pour la lecture.
+"""
+
+import argparse
+import asyncio
+import glob
+import hashlib
+import json
+import logging
+import os
+import struct
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"JAKDLOG\x01"
+HEADER_LENGTH = struct.Struct("<I")
+FORMAT_VERSION = 1
+
+ACTIVE_NAME = "decisions.dlog"
+ROTATED_PATTERN = "decisions-*.dlog"
+
+# Horodatage (ms), hash du wa_id, priorité, type de réponse, drapeaux, financement, délai (jours),
+# temps des étapes contexte / règles / génération / total (µs)
+RECORD = struct.Struct("<qQBBBBi4I")
+FIELDS = [
+    ("ts_ms", "<i8"),
+    ("wa_hash", "<u8"),
+    ("priority", "u1"),
+    ("response_type", "u1"),
+    ("flags", "u1"),
+    ("financing", "u1"),
+    ("delay_days", "<i4"),
+    ("context_us", "<u4"),
+    ("rules_us", "<u4"),
+    ("generation_us", "<u4"),
+    ("total_us", "<u4"),
+]
+STAGES = ("context", "rules", "generation", "total")
+
+# Temps non mesuré (étape non exécutée) ; délai inconnu
+MISSING_US = 0xFFFFFFFF
+UNKNOWN_DELAY = -1
+
+FLAG_ESCALATED = 1
+FLAG_GENERATED = 2
+FLAG_CACHE_HIT = 4
+FLAG_DEADLINE_EXCEEDED = 8
+
+# Tables de codes : ajouter en fin de liste uniquement
+PRIORITIES = (
+    "OTHER", "NONE", "N8N_BLOC_DETECTED", "N8N_BLOC_FALLBACK", "PAIEMENT_FORMATION_BLOC",
+    "CPF_DELAI_DEPASSE_FILTRAGE", "CPF_DELAI_NORMAL", "CPF_BLOQUE_CONFIRME", "CPF_VERIFICATION_ESCALADE",
+    "OPCO_DELAI_DEPASSE", "OPCO_DELAI_NORMAL", "DIRECT_DELAI_DEPASSE", "DIRECT_DELAI_NORMAL",
+    "AFFILIATION_STEPS_REQUEST", "PAIEMENT_CPF_DEMANDE_TIMING", "DEMANDE_DATE_FORMATION", "AGRESSIVITE",
+    "PAIEMENT_SUIVI", "FOLLOW_UP_CONVERSATION", "ESCALADE_AUTO", "PAIEMENT_SANS_BLOC", "FALLBACK_GENERAL",
+    "DEADLINE_FALLBACK", "ERROR",
+)
+RESPONSE_TYPES = (
+    "OTHER", "exact_match_enforced", "n8n_bloc_used", "n8n_bloc_fallback", "cpf_delay_filtering",
+    "cpf_delay_normal", "opco_delay_exceeded", "opco_delay_normal", "direct_delay_exceeded",
+    "direct_delay_normal", "affiliation_steps_provided", "cpf_timing_request", "cpf_blocked_confirmed",
+    "asking_formation_date", "agressivite_detected", "follow_up_ai_handled", "paiement_suivi_ai_handled",
+    "auto_escalade", "paiement_fallback", "ai_contextual_response", "follow_up_ai_generated",
+    "paiement_suivi_ai_generated", "ai_generated_response", "fallback_with_context", "error_fallback",
+    "deadline_exceeded", "shed",
+)
+FINANCING_TYPES = ("OTHER", "NONE", "CPF", "OPCO", "direct")
+
+_PRIORITY_CODES = {name: code for code, name in enumerate(PRIORITIES)}
+_RESPONSE_TYPE_CODES = {name: code for code, name in enumerate(RESPONSE_TYPES)}
+_FINANCING_CODES = {name: code for code, name in enumerate(FINANCING_TYPES)}
+
+
+def make_header() -> bytes:
+    header = json.dumps({
+        "version": FORMAT_VERSION,
+        "record_size": RECORD.size,
+        "fields": FIELDS,
+        "priorities": PRIORITIES,
+        "response_types": RESPONSE_TYPES,
+        "financing_types": FINANCING_TYPES
+    }).encode("utf-8")
+    # Enregistrements alignés sur 8 octets
+    header += b" " * (-(len(MAGIC) + HEADER_LENGTH.size + len(header)) % 8)
+    return MAGIC + HEADER_LENGTH.pack(len(header)) + header
+
+
+def read_header(f) -> Tuple[Dict[str, Any], int]:
+    """En-tête d'un fichier ouvert en binaire et position du premier enregistrement"""
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError("not a decision log file")
+    (length,) = HEADER_LENGTH.unpack(f.read(HEADER_LENGTH.size))
+    header = json.loads(f.read(length))
+    return header, len(MAGIC) + HEADER_LENGTH.size + length
+
+
+def hash_wa_id(wa_id: Any, key: bytes = b"") -> int:
+    """Hash 64 bits du wa_id (clé facultative pour empêcher le rapprochement par dictionnaire)"""
+    return int.from_bytes(hashlib.blake2b(str(wa_id).encode("utf-8"), digest_size=8, key=key).digest(), "little")
+
+
+def to_microseconds(seconds: Optional[float]) -> int:
+    if seconds is None:
+        return MISSING_US
+    return min(max(int(seconds * 1_000_000), 0), MISSING_US - 1)
+
+
+def delay_in_days(signals: Optional[Dict[str, Any]]) -> int:
+    """Délai en jours tel que lu par les règles (jours exacts, sinon mois × 30)"""
+    if not signals:
+        return UNKNOWN_DELAY
+    if signals.get("delay_days"):
+        return int(signals["delay_days"])
+    if signals.get("delay_months"):
+        return int(round(signals["delay_months"] * 30))
+    return UNKNOWN_DELAY
+
+
+def financing_code(signals: Optional[Dict[str, Any]]) -> int:
+    """Code du financement ; NONE si non détecté ou non examiné par les règles"""
+    financing_type = (signals or {}).get("financing_type") or "NONE"
+    return _FINANCING_CODES.get(financing_type, 0)
+
+
+class DecisionLog:
+    """Tampon d'enregistrements + worker d'écriture par lots avec rotation des fichiers"""
+
+    def __init__(self, directory: str, max_file_bytes: int = 64 * 1024 * 1024, max_files: int = 50,
+                 flush_interval: float = 1.0, max_buffer_records: int = 100_000, hash_key: bytes = b""):
+        self.directory = directory
+        self.max_file_bytes = max(max_file_bytes, len(make_header()) + RECORD.size)
+        self.max_files = max_files
+        self.flush_interval = flush_interval
+        self.max_buffer_records = max_buffer_records
+        self.hash_key = hash_key[:64]
+
+        self._buffer = bytearray()
+        self._file = None
+        self._file_bytes = 0
+        self._task: Optional[asyncio.Task] = None
+        self._writing: Optional[asyncio.Task] = None
+        self.recorded = 0
+        self.dropped = 0
+        self.written = 0
+        self.flushes = 0
+        self.rotations = 0
+        self.last_error: Optional[str] = None
+        self.last_flush_seconds: Optional[float] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory)
+
+    @property
+    def active_path(self) -> str:
+        return os.path.join(self.directory, ACTIVE_NAME)
+
+    def start(self):
+        if not self.enabled or self._task is not None:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            self._open()
+        except (OSError, ValueError) as e:
+            self.last_error = f"{type(e).__name__}: {str(e)}"
+            logger.error(f"Error opening decision log: {str(e)}")
+            return
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"🗂️ Journal des décisions : {self.active_path}")
+
+    def record(self, wa_id: Any, priority_detected: str, response_type: str, escalated: bool,
+               signals: Optional[Dict[str, Any]] = None, timings: Optional[Dict[str, float]] = None,
+               generated: bool = False, cache_hit: bool = False, deadline_exceeded: bool = False) -> bool:
+        """Ajoute une décision au tampon (aucune I/O) ; faux si désactivé ou tampon plein"""
+        if self._task is None:
+            return False
+        if len(self._buffer) >= self.max_buffer_records * RECORD.size:
+            self.dropped += 1
+            return False
+        timings = timings or {}
+        flags = (
+            (FLAG_ESCALATED if escalated else 0)
+            | (FLAG_GENERATED if generated else 0)
+            | (FLAG_CACHE_HIT if cache_hit else 0)
+            | (FLAG_DEADLINE_EXCEEDED if deadline_exceeded else 0)
+        )
+        self._buffer += RECORD.pack(
+            int(time.time() * 1000),
+            hash_wa_id(wa_id, self.hash_key),
+            _PRIORITY_CODES.get(priority_detected, 0),
+            _RESPONSE_TYPE_CODES.get(response_type, 0),
+            flags,
+            financing_code(signals),
+            delay_in_days(signals),
+            *(to_microseconds(timings.get(stage)) for stage in STAGES)
+        )
+        self.recorded += 1
+        return True
+
+    def _open(self):
+        """Ouvre le fichier actif en ajout (en-tête vérifié, enregistrement partiel tronqué)"""
+        path = self.active_path
+        header = make_header()
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            try:
+                with open(path, "rb") as f:
+                    existing, offset = read_header(f)
+                compatible = existing["record_size"] == RECORD.size and existing["fields"] == [list(field) for field in FIELDS]
+            except (ValueError, KeyError, struct.error):
+                compatible = False
+            if not compatible:
+                self._rotate_file()
+            else:
+                # Un arrêt brutal peut laisser un enregistrement incomplet en fin de fichier
+                size = os.path.getsize(path)
+                whole = offset + (size - offset) // RECORD.size * RECORD.size
+                if whole != size:
+                    os.truncate(path, whole)
+                self._file = open(path, "ab")
+                self._file_bytes = whole
+                return
+        self._file = open(path, "ab")
+        self._file.write(header)
+        self._file.flush()
+        self._file_bytes = len(header)
+
+    def _rotate_file(self):
+        """Renomme le fichier actif avec un horodatage et supprime les plus anciens"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+        os.replace(self.active_path, os.path.join(self.directory, f"decisions-{stamp}.dlog"))
+        self.rotations += 1
+        rotated = sorted(glob.glob(os.path.join(self.directory, ROTATED_PATTERN)))
+        for path in rotated[:max(0, len(rotated) - self.max_files + 1)]:
+            os.remove(path)
+
+    def _write(self, chunk: bytes):
+        view = memoryview(chunk)
+        while view:
+            if self._file_bytes + RECORD.size > self.max_file_bytes:
+                self._rotate_file()
+                self._open()
+            room = (self.max_file_bytes - self._file_bytes) // RECORD.size * RECORD.size
+            part = view[:room]
+            self._file.write(part)
+            self._file_bytes += len(part)
+            view = view[room:]
+        self._file.flush()
+
+    async def flush(self):
+        """Écrit le tampon courant dans un thread (le tampon est remplacé avant l'écriture)
+
+        L'écriture en cours est protégée de l'annulation : annuler flush() (arrêt du
+        worker) laisse le thread terminer, et le flush suivant l'attend avant d'écrire.
+        """
+        while self._writing is not None and not self._writing.done():
+            await asyncio.shield(self._writing)
+        if not self._buffer or self._file is None:
+            return
+        chunk, self._buffer = self._buffer, bytearray()
+        self._writing = asyncio.create_task(self._write_chunk(chunk))
+        await asyncio.shield(self._writing)
+
+    async def _write_chunk(self, chunk: bytes):
+        start = time.perf_counter()
+        try:
+            await asyncio.to_thread(self._write, chunk)
+        except (OSError, ValueError) as e:
+            self.last_error = f"{type(e).__name__}: {str(e)}"
+            self.dropped += len(chunk) // RECORD.size
+            logger.error(f"Error writing decision log: {str(e)}")
+            return
+        self.written += len(chunk) // RECORD.size
+        self.flushes += 1
+        self.last_flush_seconds = round(time.perf_counter() - start, 4)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def stop(self):
+        """Arrêt gracieux : attend l'écriture en cours, écrit le tampon restant et ferme le fichier"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled and self._task is not None,
+            "path": self.active_path if self.enabled else None,
+            "record_size": RECORD.size,
+            "buffered": len(self._buffer) // RECORD.size,
+            "max_buffer_records": self.max_buffer_records,
+            "recorded": self.recorded,
+            "dropped": self.dropped,
+            "written": self.written,
+            "flushes": self.flushes,
+            "rotations": self.rotations,
+            "file_bytes": self._file_bytes,
+            "max_file_bytes": self.max_file_bytes,
+            "last_error": self.last_error,
+            "last_flush_seconds": self.last_flush_seconds
+        }
+
+
+def log_files(paths: List[str]) -> List[str]:
+    """Fichiers à lire : répertoires développés (rotations puis fichier actif), dans l'ordre"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, ROTATED_PATTERN))))
+            active = os.path.join(path, ACTIVE_NAME)
+            if os.path.exists(active):
+                files.append(active)
+        else:
+            files.append(path)
+    return files
+
+
+def open_log(path: str):
+    """Projection en mémoire des enregistrements complets d'un fichier : (en-tête, tableau structuré)"""
+    import numpy as np
+
+    with open(path, "rb") as f:
+        header, offset = read_header(f)
+    dtype = np.dtype([tuple(field) for field in header["fields"]])
+    count = (os.path.getsize(path) - offset) // dtype.itemsize
+    if count == 0:
+        return header, np.zeros(0, dtype=dtype)
+    return header, np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(count,))
+
+
+def _percentiles(np, values) -> Dict[str, Optional[float]]:
+    if values.size == 0:
+        return {"count": 0, "p50": None, "p95": None, "p99": None}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"count": int(values.size), "p50": round(float(p50), 3), "p95": round(float(p95), 3), "p99": round(float(p99), 3)}
+
+
+def aggregate(paths: List[str], since: Optional[float] = None, until: Optional[float] = None) -> Dict[str, Any]:
+    """Répartition des décisions sur un ou plusieurs fichiers (bornes en secondes epoch)"""
+    import numpy as np
+
+    totals = {"priorities": {}, "response_types": {}, "financing_types": {}, "escalations": {}}
+    delays: Dict[str, List[Any]] = {}
+    timings: Dict[str, List[Any]] = {stage: [] for stage in STAGES}
+    hashes = []
+    flags_total = {"escalated": 0, "generated": 0, "cache_hit": 0, "deadline_exceeded": 0}
+    first_ms = last_ms = None
+    decisions = 0
+
+    def add_counts(target: Dict[str, int], table, codes, weights=None):
+        counts = np.bincount(codes, weights=weights, minlength=len(table))
+        for code in np.flatnonzero(counts):
+            name = table[code] if code < len(table) else "OTHER"
+            target[name] = target.get(name, 0) + int(counts[code])
+
+    files = log_files(paths)
+    for path in files:
+        header, records = open_log(path)
+        if since is not None or until is not None:
+            mask = np.ones(records.shape[0], dtype=bool)
+            if since is not None:
+                mask &= records["ts_ms"] >= int(since * 1000)
+            if until is not None:
+                mask &= records["ts_ms"] < int(until * 1000)
+            records = records[mask]
+        if records.shape[0] == 0:
+            continue
+
+        decisions += int(records.shape[0])
+        ts = records["ts_ms"]
+        first_ms = int(ts.min()) if first_ms is None else min(first_ms, int(ts.min()))
+        last_ms = int(ts.max()) if last_ms is None else max(last_ms, int(ts.max()))
+
+        flags = records["flags"]
+        escalated = (flags & FLAG_ESCALATED) != 0
+        flags_total["escalated"] += int(escalated.sum())
+        flags_total["generated"] += int(((flags & FLAG_GENERATED) != 0).sum())
+        flags_total["cache_hit"] += int(((flags & FLAG_CACHE_HIT) != 0).sum())
+        flags_total["deadline_exceeded"] += int(((flags & FLAG_DEADLINE_EXCEEDED) != 0).sum())
+
+        priorities = records["priority"]
+        add_counts(totals["priorities"], header["priorities"], priorities)
+        add_counts(totals["escalations"], header["priorities"], priorities, weights=escalated.astype(np.float64))
+        add_counts(totals["response_types"], header["response_types"], records["response_type"])
+        add_counts(totals["financing_types"], header["financing_types"], records["financing"])
+
+        financing = records["financing"]
+        delay_days = records["delay_days"]
+        known = delay_days >= 0
+        for code in np.unique(financing[known]):
+            name = header["financing_types"][code] if code < len(header["financing_types"]) else "OTHER"
+            delays.setdefault(name, []).append(np.asarray(delay_days[known & (financing == code)]))
+
+        for stage in STAGES:
+            column = records[f"{stage}_us"]
+            timings[stage].append(np.asarray(column[column != MISSING_US]))
+        hashes.append(np.asarray(records["wa_hash"]))
+
+    def merged(parts):
+        return np.concatenate(parts) if parts else np.zeros(0)
+
+    priorities = totals["priorities"]
+    return {
+        "files": len(files),
+        "decisions": decisions,
+        "first_at": datetime.fromtimestamp(first_ms / 1000, timezone.utc).isoformat() if first_ms is not None else None,
+        "last_at": datetime.fromtimestamp(last_ms / 1000, timezone.utc).isoformat() if last_ms is not None else None,
+        "unique_sessions": int(np.unique(merged(hashes)).size),
+        "flags": flags_total,
+        "escalation_rate": round(flags_total["escalated"] / decisions, 4) if decisions else None,
+        "priorities": dict(sorted(priorities.items(), key=lambda item: -item[1])),
+        "escalation_rate_by_priority": {
+            name: round(totals["escalations"].get(name, 0) / count, 4)
+            for name, count in sorted(priorities.items(), key=lambda item: -item[1])
+        },
+        "response_types": dict(sorted(totals["response_types"].items(), key=lambda item: -item[1])),
+        "financing_types": dict(sorted(totals["financing_types"].items(), key=lambda item: -item[1])),
+        "delay_days_by_financing": {name: _percentiles(np, merged(parts)) for name, parts in sorted(delays.items())},
+        "stage_ms": {
+            stage: {key: (round(value / 1000, 3) if key != "count" and value is not None else value)
+                    for key, value in _percentiles(np, merged(parts)).items()}
+            for stage, parts in timings.items()
+        }
+    }
+
+
+def parse_time(value: str) -> float:
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m api.decision_log", description=__doc__.splitlines()[0])
+    parser.add_argument("paths", nargs="+", help="fichiers .dlog ou répertoires du journal")
+    parser.add_argument("--since", type=parse_time, help="début (ISO 8601, UTC par défaut)")
+    parser.add_argument("--until", type=parse_time, help="fin exclue (ISO 8601, UTC par défaut)")
+    args = parser.parse_args(argv)
+
+    try:
+        summary = aggregate(args.paths, since=args.since, until=args.until)
+    except ImportError:
+        print("numpy is required to read decision logs (pip install numpy)", file=sys.stderr)
+        return 2
+    except (OSError, ValueError) as e:
+        print(f"Error reading decision log: {str(e)}", file=sys.stderr)
+        return 1
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
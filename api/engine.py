@@ -0,0 +1,949 @@
+"""Moteur de décision sans I/O : (historique, message, bloc) -> décision
+
+Toute la logique de routage (contexte de conversation, délais de paiement,
+règles de priorité, type de réponse) vit ici, sans FastAPI, sans client LLM et
+sans OPENAI_API_KEY : un worker n8n ou un traitement par lots peut l'appeler
+en processus, sans passer par HTTP.
+
+    from api.engine import decide
+    decision = decide(history, "cpf il y a 2 semaines", bloc=None)
+
+Le serveur (api.process) utilise les mêmes fonctions avec son RuleRegistry
+rechargé à chaud (set_rule_registry) ; en usage autonome, les règles sont lues
+depuis api/rules.json au premier appel.
+"""
+
+import logging
+import os
+import re
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+from .blocs import Bloc
+from .memory import ChatMessage, ConversationMemory
+from .rules import RuleRegistry, RuleSet
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(__file__), "rules.json")
+
+# Plafonds par défaut des entrées (le serveur les surcharge par variables d'environnement)
+DEFAULT_MAX_MESSAGE_CHARS = 4000
+DEFAULT_MAX_BLOC_CHARS = 8000
+
+# Fenêtre d'historique par défaut : budget de tokens estimés + plafond de messages
+DEFAULT_HISTORY_TOKEN_BUDGET = 2000
+DEFAULT_MAX_MESSAGES_PER_SESSION = 15
+
+# Registre utilisé quand aucun RuleSet n'est passé explicitement
+_rule_registry = RuleRegistry(DEFAULT_RULES_PATH, reload_interval=0)
+
+
+def set_rule_registry(registry: RuleRegistry):
+    """Remplace le registre de règles par défaut (le serveur y branche son registre rechargé à chaud)"""
+    global _rule_registry
+    _rule_registry = registry
+
+
+def current_rules() -> RuleSet:
+    """RuleSet en service dans le registre par défaut (chargé au premier appel)"""
+    return _rule_registry.current
+
+
+# Caractères de contrôle C0/C1 supprimés des entrées (str.translate, sans regex)
+CONTROL_CHARS_TABLE = dict.fromkeys([*range(0x00, 0x20), *range(0x7f, 0xa0)])
+
+
+class ResponseValidator:
+    """Classe pour valider et nettoyer les réponses"""
+    
+    @staticmethod
+    def clean_response(response: str) -> str:
+        """Nettoie et formate la réponse"""
+        if not response:
+            return ""
+        
+        # Supprimer les caractères de contrôle
+        response = response.translate(CONTROL_CHARS_TABLE)
+        
+        # Nettoyer les espaces multiples
+        return " ".join(response.split())
+    
+    @staticmethod
+    def cap_length(text: str, max_chars: int, label: str) -> str:
+        """Tronque une entrée trop longue avant les étapes de détection"""
+        if len(text) <= max_chars:
+            return text
+        logger.warning(f"✂️ {label} tronqué : {len(text)} → {max_chars} caractères")
+        return text[:max_chars]
+    
+    @staticmethod
+    def validate_escalade_keywords(message: str, rules: Optional[RuleSet] = None) -> Optional[str]:
+        """Détecte si le message nécessite une escalade"""
+        rules = rules or current_rules()
+        
+        if rules.matcher("escalade").matches(message.lower()):
+            return "admin"
+        
+        return None
+
+
+SUMMARY_BOT_MESSAGE_CHARS = 300
+
+
+class ConversationContextManager:
+    """Gestionnaire du contexte conversationnel amélioré"""
+    
+    # Nombre de messages récents examinés pour détecter le contexte
+    CONTEXT_WINDOW = 6
+    
+    @staticmethod
+    def scan_history(messages: List[Any], rules: Optional[RuleSet] = None) -> Dict[str, Any]:
+        """Détecte l'état de la conversation dans une fenêtre de messages (du plus récent au plus ancien)"""
+        rules = rules or current_rules()
+        state = {
+            "previous_topic": None,
+            "last_bot_message": "",
+            "awaiting_cpf_info": False,
+            "awaiting_financing_info": False,
+            # NOUVELLE LOGIQUE : Détection du contexte paiement formation
+            "payment_context_detected": False,
+            "financing_question_asked": False,
+            "timing_question_asked": False,
+            # NOUVELLE LOGIQUE : Détection du contexte affiliation
+            "affiliation_context_detected": False,
+            "awaiting_steps_info": False,
+        }
+        
+        for msg in reversed(messages):
+            content = str(msg.content).lower()
+            
+            # DÉTECTION AMÉLIORÉE : Chercher les patterns du bloc paiement formation
+            if rules.matcher("payment_question").matches(content):
+                state["payment_context_detected"] = True
+                state["financing_question_asked"] = True
+                state["last_bot_message"] = str(msg.content)
+            
+            if rules.matcher("timing_question").matches(content):
+                state["payment_context_detected"] = True
+                state["timing_question_asked"] = True
+                state["last_bot_message"] = str(msg.content)
+            
+            # Détecter si on attend des infos spécifiques
+            if rules.matcher("awaiting_financing").matches(content):
+                state["awaiting_financing_info"] = True
+                state["last_bot_message"] = str(msg.content)
+            
+            # Détecter le contexte CPF bloqué
+            if rules.matcher("cpf_blocked_question").matches(content):
+                state["awaiting_cpf_info"] = True
+                state["last_bot_message"] = str(msg.content)
+            
+            # NOUVELLE DÉTECTION : Contexte affiliation
+            if rules.matcher("affiliation").matches(content):
+                state["affiliation_context_detected"] = True
+            
+            if rules.matcher("steps_question").matches(content):
+                state["awaiting_steps_info"] = True
+                state["last_bot_message"] = str(msg.content)
+            
+            # Détecter les sujets principaux (le premier sujet de la liste l'emporte)
+            topic = next((topic for topic, matcher in rules.topics if matcher.matches(content)), None)
+            if topic:
+                state["previous_topic"] = topic
+                break
+        
+        return state
+    
+    @staticmethod
+    def merge_older_state(state: Dict[str, Any], older: Dict[str, Any]) -> Dict[str, Any]:
+        """Complète l'état d'une fenêtre incomplète avec l'état de messages plus anciens"""
+        if state["previous_topic"] is not None:
+            # Le scan s'est arrêté sur un sujet : les messages plus anciens n'auraient pas été lus
+            return state
+        
+        merged = dict(state)
+        for key, value in older.items():
+            if key == "last_bot_message":
+                merged[key] = value or state[key]
+            elif key == "previous_topic":
+                merged[key] = value
+            elif key in merged:
+                merged[key] = state[key] or value
+        return merged
+    
+    @staticmethod
+    def analyze_conversation_context(user_message: str, memory: ConversationMemory,
+                                     rules: Optional[RuleSet] = None) -> Dict[str, Any]:
+        """Analyse le contexte de la conversation pour adapter la réponse"""
+        return ConversationContextManager.analyze_history(
+            user_message, memory.chat_memory.messages, memory.summary, rules
+        )
+    
+    @staticmethod
+    def analyze_history(user_message: str, history: List[Any], summary: Optional[Dict[str, Any]] = None,
+                        rules: Optional[RuleSet] = None) -> Dict[str, Any]:
+        """Analyse du contexte à partir d'une liste de messages (et du résumé des tours compactés)"""
+        rules = rules or current_rules()
+        
+        message_count = len(history)
+        
+        # Analyser si c'est un message de suivi
+        is_follow_up = rules.matcher("follow_up").matches(user_message.lower())
+        
+        # Analyser le sujet précédent dans l'historique (6 derniers messages)
+        window = ConversationContextManager.CONTEXT_WINDOW
+        state = ConversationContextManager.scan_history(history[-window:], rules)
+        
+        # Fenêtre incomplète : les tours compactés dans le résumé complètent le contexte
+        if summary and message_count < window:
+            state = ConversationContextManager.merge_older_state(state, summary["state"])
+        
+        return {
+            "message_count": message_count,
+            "is_follow_up": is_follow_up,
+            "previous_topic": state["previous_topic"],
+            "needs_greeting": message_count == 0,
+            "conversation_flow": "continuing" if message_count > 0 else "starting",
+            "awaiting_cpf_info": state["awaiting_cpf_info"],
+            "awaiting_financing_info": state["awaiting_financing_info"],
+            "last_bot_message": state["last_bot_message"],
+            # NOUVELLES CLÉS CRITIQUES
+            "affiliation_context_detected": state["affiliation_context_detected"],
+            "awaiting_steps_info": state["awaiting_steps_info"],
+            "payment_context_detected": state["payment_context_detected"],
+            "financing_question_asked": state["financing_question_asked"],
+            "timing_question_asked": state["timing_question_asked"]
+        }
+    
+    @staticmethod
+    def summarize_collapsed(collapsed: List[Any], previous_summary: Optional[Dict[str, Any]],
+                            rules: Optional[RuleSet] = None) -> Dict[str, Any]:
+        """Résume des tours retirés de l'historique en un état structuré compact"""
+        window = ConversationContextManager.CONTEXT_WINDOW
+        state = ConversationContextManager.scan_history(collapsed[-window:], rules)
+        if previous_summary and len(collapsed) < window:
+            state = ConversationContextManager.merge_older_state(state, previous_summary["state"])
+        
+        # Le résumé reste compact : seul un extrait du dernier message bot est conservé
+        state["last_bot_message"] = state["last_bot_message"][:SUMMARY_BOT_MESSAGE_CHARS]
+        
+        collapsed_messages = len(collapsed) + (previous_summary or {}).get("collapsed_messages", 0)
+        collapsed_user_messages = sum(1 for m in collapsed if m.type == "human") + \
+            (previous_summary or {}).get("collapsed_user_messages", 0)
+        
+        return {
+            "collapsed_messages": collapsed_messages,
+            "collapsed_user_messages": collapsed_user_messages,
+            "state": state
+        }
+
+
+class PaymentContextProcessor:
+    """Processeur spécialisé pour le contexte paiement formation - VERSION V14 DÉLAIS CORRIGÉS"""
+    
+    @staticmethod
+    def extract_financing_type(message: str, rules: Optional[RuleSet] = None) -> Optional[str]:
+        """Extrait le type de financement du message - VERSION ULTRA RENFORCÉE"""
+        rules = rules or current_rules()
+        message_lower = message.lower()
+        
+        logger.info(f"🔍 ANALYSE FINANCEMENT: '{message}'")
+        
+        # Recherche par patterns (types dans l'ordre de la configuration)
+        for financing_type, matcher in rules.financing:
+            pattern = matcher.search(message_lower)
+            if pattern:
+                logger.info(f"🎯 Financement détecté: '{pattern}' -> {financing_type}")
+                return financing_type
+        
+        # DÉTECTION CONTEXTUELLE RENFORCÉE
+        logger.info("🔍 Recherche contextuelle financement...")
+        
+        # OPCO simple
+        if 'opco' in message_lower:
+            logger.info("✅ OPCO détecté par mot-clé simple")
+            return 'OPCO'
+        
+        # Financement direct contextuel
+        if rules.matcher("direct_verbs").matches(message_lower) and \
+           rules.matcher("direct_qualifiers").matches(message_lower):
+            logger.info("✅ Financement direct détecté par contexte")
+            return 'direct'
+        
+        # Pattern "j'ai" + action
+        if rules.matcher("first_person").matches(message_lower) and \
+           rules.matcher("first_person_verbs").matches(message_lower):
+            logger.info("✅ Financement direct détecté par 'j'ai payé/financé'")
+            return 'direct'
+        
+        logger.warning(f"❌ Aucun financement détecté dans: '{message}'")
+        return None
+    
+    # PATTERNS ULTRA RENFORCÉS
+    # Formes en temps linéaire : un nombre ne commence jamais au milieu d'une suite de chiffres
+    # ((?<!\d), \b ou (?<=\s)), quantificateurs bornés ({1,6} chiffres, {0,10} espaces) et
+    # (?!\d) avant les lookaheads négatifs pour qu'ils ne fassent pas reculer \d.
+    DELAY_PATTERNS = [
+        # Patterns avec préfixes
+        r'(?:il y a|depuis|ça fait|ca fait)\s{0,10}(\d{1,6})\s{0,10}mois',
+        r'(?:il y a|depuis|ça fait|ca fait)\s{0,10}(\d{1,6})\s{0,10}semaines?',
+        r'(?:il y a|depuis|ça fait|ca fait)\s{0,10}(\d{1,6})\s{0,10}jours?',
+        
+        # Patterns terminaison
+        r'terminé\s{1,10}il y a\s{1,10}(\d{1,6})\s{0,10}(mois|semaines?|jours?)',
+        r'fini\s{1,10}il y a\s{1,10}(\d{1,6})\s{0,10}(mois|semaines?|jours?)',
+        
+        # Patterns avec "que"
+        r'(?<!\d)(\d{1,6})\s{0,10}(mois|semaines?|jours?)\s{1,10}que',
+        r'(?<!\d)(\d{1,6})\s{0,10}(mois|semaines?|jours?)\s{0,10}que',
+        
+        # Patterns simples
+        r'fait\s{1,10}(\d{1,6})\s{0,10}(mois|semaines?|jours?)',
+        r'depuis\s{1,10}(\d{1,6})\s{0,10}(mois|semaines?|jours?)',
+        
+        # NOUVEAUX PATTERNS PLUS FLEXIBLES
+        r'(?<!\d)(\d{1,6})\s{0,10}(mois|semaines?|jours?)$',
+        r'\b(\d{1,6})\s{0,10}(mois|semaines?|jours?)\b',
+        r'(?<=\s)(\d{1,6})\s{0,10}(mois|semaines?|jours?)\s',
+        
+        # PATTERNS SANS UNITÉ (assume mois par défaut)
+        r'il y a\s{1,10}(\d{1,6})(?!\d)(?!\s{0,10}(?:mois|semaines?|jours?))',
+        r'ça fait\s{1,10}(\d{1,6})(?!\d)(?!\s{0,10}(?:mois|semaines?|jours?))',
+        r'depuis\s{1,10}(\d{1,6})(?!\d)(?!\s{0,10}(?:mois|semaines?|jours?))'
+    ]
+
+    # Nombre de jours / semaines cité dans le message (recalcul en jours réels)
+    UNIT_COUNT_PATTERNS = {
+        "jour": r'(?<!\d)(\d{1,6})\s{0,10}jours?',
+        "semaine": r'(?<!\d)(\d{1,6})\s{0,10}semaines?'
+    }
+    
+    @staticmethod
+    @lru_cache(maxsize=1)
+    def compiled_delay_patterns() -> List[re.Pattern]:
+        """Compile une seule fois les patterns de délai (appelé au warm-up)"""
+        return [re.compile(pattern) for pattern in PaymentContextProcessor.DELAY_PATTERNS]
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def compiled_unit_pattern(unit: str) -> re.Pattern:
+        return re.compile(PaymentContextProcessor.UNIT_COUNT_PATTERNS[unit])
+    
+    @staticmethod
+    def extract_time_delay(message: str) -> Optional[int]:
+        """Extrait le délai en mois du message - VERSION ULTRA RENFORCÉE"""
+        message_lower = message.lower()
+        
+        logger.info(f"🕐 ANALYSE DÉLAI: '{message}'")
+        
+        for pattern in PaymentContextProcessor.compiled_delay_patterns():
+            match = pattern.search(message_lower)
+            if match:
+                number = int(match.group(1))
+                
+                # Déterminer l'unité
+                unit = "mois"  # défaut
+                if len(match.groups()) > 1 and match.group(2):
+                    unit = match.group(2)
+                
+                # Conversion en mois - CORRECTION CRITIQUE
+                if 'semaine' in unit:
+                    # CORRECTION: Ne pas forcer minimum 1 mois
+                    months = round(number / 4.33, 2)  # Garder les décimales
+                    logger.info(f"🕐 Délai détecté: {number} semaines = {months} mois")
+                elif 'jour' in unit:
+                    # CORRECTION: Ne pas forcer minimum 1 mois
+                    months = round(number / 30.0, 2)  # Garder les décimales  
+                    logger.info(f"🕐 Délai détecté: {number} jours = {months} mois")
+                else:
+                    months = number
+                    logger.info(f"🕐 Délai détecté: {number} mois")
+                
+                return months
+        
+        logger.warning(f"❌ Aucun délai détecté dans: '{message}'")
+        return None
+    
+    @staticmethod
+    def handle_cpf_delay_context(delay_months: int, user_message: str, conversation_context: Dict[str, Any],
+                                 rules: Optional[RuleSet] = None) -> Dict[str, Any]:
+        """Gère le contexte spécifique CPF avec délai"""
+        rules = rules or current_rules()
+        
+        if delay_months >= rules.threshold("cpf_blocked_months"):  # CPF délai dépassé
+            # Vérifier si c'est une réponse à la question de blocage CPF
+            if conversation_context.get("awaiting_cpf_info"):
+                user_lower = user_message.lower()
+                
+                # Si l'utilisateur confirme qu'il était informé du blocage
+                if rules.matcher("cpf_blocked_confirmation").matches(user_lower):
+                    return {
+                        "use_matched_bloc": False,
+                        "priority_detected": "CPF_BLOQUE_CONFIRME",
+                        "response": rules.template("CPF_BLOQUE_CONFIRME"),
+                        "context": conversation_context,
+                        "escalade_type": None
+                    }
+                else:
+                    # Escalade pour vérification
+                    return {
+                        "use_matched_bloc": False,
+                        "priority_detected": "CPF_VERIFICATION_ESCALADE",
+                        "response": rules.template("CPF_VERIFICATION_ESCALADE"),
+                        "context": conversation_context,
+                        "escalade_type": "admin"
+                    }
+            else:
+                # Première fois qu'on détecte un délai CPF dépassé
+                return {
+                    "use_matched_bloc": False,
+                    "priority_detected": "CPF_DELAI_DEPASSE_FILTRAGE",
+                    "response": rules.template("CPF_DELAI_DEPASSE_FILTRAGE"),
+                    "context": conversation_context,
+                    "awaiting_cpf_info": True
+                }
+        
+        return None
+
+
+class MessageProcessor:
+    """Classe principale pour traiter les messages avec contexte"""
+    
+    @staticmethod
+    def is_aggressive(message: str, rules: Optional[RuleSet] = None) -> bool:
+        """Détecte l'agressivité en évitant les faux positifs"""
+        rules = rules or current_rules()
+        
+        message_lower = message.lower()
+        
+        # Vérification spéciale pour "con" - doit être un mot isolé
+        if " con " in f" {message_lower} " or message_lower.startswith("con ") or message_lower.endswith(" con"):
+            # Exclure les mots contenant "con" comme "contacts", "conseil", "condition", etc.
+            if not rules.matcher("aggressive_con_exclusions").matches(message_lower):
+                return True
+        
+        # Vérifier les autres mots agressifs (avec leurs contextes d'exclusion)
+        for aggressive_word, exclusions in rules.aggressive:
+            if aggressive_word in message_lower:
+                # Vérifier que ce n'est pas dans un contexte d'exclusion
+                if not exclusions.matches(message_lower):
+                    return True
+        
+        return False
+    
+    @staticmethod
+    def detect_priority_rules(user_message: str, matched_bloc_response: str, conversation_context: Dict[str, Any],
+                              bloc: Optional[Bloc] = None, rules: Optional[RuleSet] = None,
+                              signals: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Applique les règles de priorité avec prise en compte du contexte - VERSION V14 DÉLAIS CPF CORRIGÉS
+
+        `signals`, s'il est fourni, reçoit le financement et le délai extraits (journal des décisions).
+        """
+        # Un seul RuleSet pour toute la requête, même si un rechargement a lieu entre-temps
+        rules = rules or current_rules()
+        if signals is None:
+            signals = {}
+        
+        message_lower = user_message.lower()
+        
+        logger.info(f"🎯 PRIORITY DETECTION V14 DÉLAIS CPF CORRIGÉS: user_message='{user_message}', has_bloc_response={bool(matched_bloc_response)}")
+        
+        # 🎯 ÉTAPE 0.1: DÉTECTION PRIORITAIRE FINANCEMENT + DÉLAI (TOUS TYPES) - DÉLAIS CPF CORRIGÉS
+        has_financing = rules.matcher("financing_indicators").matches(message_lower)
+        has_delay = rules.matcher("delay_indicators").matches(message_lower)
+        
+        if has_financing and has_delay:
+            financing_type = PaymentContextProcessor.extract_financing_type(user_message, rules)
+            delay_months = PaymentContextProcessor.extract_time_delay(user_message)
+            signals.update(financing_type=financing_type, delay_months=delay_months)
+            
+            logger.info(f"🎯 FINANCEMENT + DÉLAI DÉTECTÉ: {financing_type} / {delay_months} mois équivalent")
+            
+            if financing_type and delay_months is not None:
+                # CPF avec délai - VERSION V14 CORRIGÉE AVEC CALCUL EN JOURS
+                if financing_type == "CPF":
+                    # CALCUL EN JOURS RÉELS, PAS EN MOIS CONVERTIS
+                    delay_days = None
+                    
+                    # Rechercher l'unité originale dans le message
+                    if 'jour' in user_message.lower():
+                        day_match = PaymentContextProcessor.compiled_unit_pattern("jour").search(user_message.lower())
+                        if day_match:
+                            delay_days = int(day_match.group(1))
+                            logger.info(f"📅 CPF: {delay_days} jours détectés")
+                    elif 'semaine' in user_message.lower():
+                        week_match = PaymentContextProcessor.compiled_unit_pattern("semaine").search(user_message.lower())
+                        if week_match:
+                            weeks = int(week_match.group(1))
+                            delay_days = weeks * 7
+                            logger.info(f"📅 CPF: {weeks} semaines = {delay_days} jours")
+                    else:
+                        # Si c'est en mois, convertir (delay_months vient de extract_time_delay)
+                        if delay_months:
+                            delay_days = int(delay_months * 30)
+                            logger.info(f"📅 CPF: {delay_months} mois = {delay_days} jours")
+                    
+                    signals["delay_days"] = delay_days
+                    # SEUIL CPF: 45 jours par défaut (délai minimum officiel)
+                    cpf_days = rules.threshold("cpf_days")
+                    logger.info(f"🎯 CPF SEUIL CHECK: {delay_days} jours vs {cpf_days} jours")
+                    
+                    if delay_days and delay_days >= cpf_days:
+                        # Délai dépassé → Filtrage
+                        logger.info("⚠️ CPF: Délai dépassé - Filtrage bloqué")
+                        return {
+                            "use_matched_bloc": False,
+                            "priority_detected": "CPF_DELAI_DEPASSE_FILTRAGE",
+                            "response": rules.template("CPF_DELAI_DEPASSE_FILTRAGE"),
+                            "context": conversation_context,
+                            "awaiting_cpf_info": True
+                        }
+                    else:
+                        # Délai normal → Rassurer
+                        logger.info("✅ CPF: Délai normal - Pas d'inquiétude")
+                        return {
+                            "use_matched_bloc": False,
+                            "priority_detected": "CPF_DELAI_NORMAL",
+                            "response": rules.template("CPF_DELAI_NORMAL", delay_days=delay_days or 'quelques'),
+                            "context": conversation_context,
+                            "escalade_type": "admin"
+                        }
+                
+                # OPCO avec délai - CORRECTION CRITIQUE
+                elif financing_type == "OPCO":
+                    # CORRECTION: Calculer en jours réels pour OPCO aussi
+                    delay_days = None
+                    
+                    # Recalculer le délai en jours selon l'unité originale
+                    if 'jour' in user_message.lower():
+                        # Extraire directement les jours
+                        day_match = PaymentContextProcessor.compiled_unit_pattern("jour").search(message_lower)
+                        if day_match:
+                            delay_days = int(day_match.group(1))
+                    elif 'semaine' in user_message.lower():
+                        # Extraire les semaines et convertir en jours
+                        week_match = PaymentContextProcessor.compiled_unit_pattern("semaine").search(message_lower)
+                        if week_match:
+                            delay_days = int(week_match.group(1)) * 7
+                    else:
+                        # Pour les mois, convertir en jours
+                        delay_days = delay_months * 30
+                    
+                    signals["delay_days"] = delay_days
+                    # Convertir en mois pour comparaison (seuil OPCO = 2 mois = 60 jours par défaut)
+                    delay_months_real = delay_days / 30 if delay_days else delay_months
+                    opco_months = rules.threshold("opco_months")
+                    
+                    logger.info(f"🕐 CALCUL OPCO: {delay_days} jours = {delay_months_real:.2f} mois (seuil: {opco_months} mois)")
+                    
+                    if delay_months_real >= opco_months:  # Au-delà du seuil = escalade
+                        return {
+                            "use_matched_bloc": False,
+                            "priority_detected": "OPCO_DELAI_DEPASSE",
+                            "response": rules.template("OPCO_DELAI_DEPASSE"),
+                            "context": conversation_context,
+                            "escalade_type": "admin"
+                        }
+                    else:  # Délai normal (sous le seuil)
+                        return {
+                            "use_matched_bloc": False,
+                            "priority_detected": "OPCO_DELAI_NORMAL",
+                            "response": rules.template("OPCO_DELAI_NORMAL"),
+                            "context": conversation_context,
+                            "escalade_type": "admin"
+                        }
+                
+                # Financement direct avec délai - CORRECTION CRITIQUE
+                elif financing_type == "direct":
+                    # CORRECTION: Calculer en jours réels, pas en mois convertis
+                    delay_days = None
+                    
+                    # Recalculer le délai en jours selon l'unité originale
+                    if 'jour' in user_message.lower():
+                        # Extraire directement les jours
+                        day_match = PaymentContextProcessor.compiled_unit_pattern("jour").search(message_lower)
+                        if day_match:
+                            delay_days = int(day_match.group(1))
+                    elif 'semaine' in user_message.lower():
+                        # Extraire les semaines et convertir en jours
+                        week_match = PaymentContextProcessor.compiled_unit_pattern("semaine").search(message_lower)
+                        if week_match:
+                            delay_days = int(week_match.group(1)) * 7
+                    else:
+                        # Pour les mois, convertir en jours
+                        delay_days = delay_months * 30
+                    
+                    signals["delay_days"] = delay_days
+                    direct_days = rules.threshold("direct_days")
+                    logger.info(f"🕐 CALCUL DIRECT: {delay_days} jours (seuil: {direct_days} jours)")
+                    
+                    if delay_days and delay_days > direct_days:  # Au-delà du seuil = anormal
+                        return {
+                            "use_matched_bloc": False,
+                            "priority_detected": "DIRECT_DELAI_DEPASSE",
+                            "response": rules.template("DIRECT_DELAI_DEPASSE"),
+                            "context": conversation_context,
+                            "escalade_type": "admin"
+                        }
+                    else:  # Délai normal (sous le seuil)
+                        return {
+                            "use_matched_bloc": False,
+                            "priority_detected": "DIRECT_DELAI_NORMAL",
+                            "response": rules.template("DIRECT_DELAI_NORMAL"),
+                            "context": conversation_context,
+                            "escalade_type": "admin"
+                        }
+        
+        # ✅ ÉTAPE 0.2: NOUVELLE - Détection des demandes d'étapes ambassadeur
+        if conversation_context.get("awaiting_steps_info") or conversation_context.get("affiliation_context_detected"):
+            if rules.matcher("how_it_works").matches(message_lower):
+                return {
+                    "use_matched_bloc": False,
+                    "priority_detected": "AFFILIATION_STEPS_REQUEST",
+                    "response": rules.template("AFFILIATION_STEPS_REQUEST"),
+                    "context": conversation_context,
+                    "escalade_type": None
+                }
+        
+        # ✅ ÉTAPE 1: PRIORITÉ ABSOLUE - Contexte paiement formation
+        if conversation_context.get("payment_context_detected"):
+            logger.info("🎯 CONTEXTE PAIEMENT DÉTECTÉ - Analyse des réponses contextuelles")
+            
+            # Extraire le type de financement et délai
+            financing_type = PaymentContextProcessor.extract_financing_type(user_message, rules)
+            delay_months = PaymentContextProcessor.extract_time_delay(user_message)
+            signals.update(financing_type=financing_type, delay_months=delay_months)
+            
+            # CAS 1: Réponse "CPF" seule dans le contexte paiement
+            if financing_type == "CPF" and not delay_months:
+                if conversation_context.get("financing_question_asked") and not conversation_context.get("timing_question_asked"):
+                    return {
+                        "use_matched_bloc": False,
+                        "priority_detected": "PAIEMENT_CPF_DEMANDE_TIMING",
+                        "response": rules.template("PAIEMENT_CPF_DEMANDE_TIMING"),
+                        "context": conversation_context,
+                        "awaiting_financing_info": True
+                    }
+            
+            # CAS 2: Réponse avec financement + délai
+            if financing_type and delay_months:
+                if financing_type == "CPF":
+                    cpf_result = PaymentContextProcessor.handle_cpf_delay_context(
+                        delay_months, user_message, conversation_context, rules
+                    )
+                    if cpf_result:
+                        return cpf_result
+                
+                elif financing_type == "OPCO" and delay_months >= rules.threshold("opco_months"):
+                    return {
+                        "use_matched_bloc": False,
+                        "priority_detected": "OPCO_DELAI_DEPASSE",
+                        "response": rules.template("OPCO_DELAI_DEPASSE"),
+                        "context": conversation_context,
+                        "escalade_type": "admin"
+                    }
+        
+        # ✅ ÉTAPE 2: Si n8n a matché un bloc ET qu'on n'est pas dans un contexte spécial, l'utiliser
+        # Caractéristiques du bloc : précalculées pour un bloc du catalogue
+        if bloc is None and matched_bloc_response:
+            bloc = Bloc(matched_bloc_response)
+        
+        if matched_bloc_response and matched_bloc_response.strip():
+            # Vérifier si c'est un vrai bloc (pas un fallback générique)
+            if not bloc.is_fallback and not conversation_context.get("payment_context_detected") and not conversation_context.get("awaiting_steps_info"):
+                logger.info("✅ UTILISATION BLOC N8N - Bloc valide détecté par n8n")
+                return {
+                    "use_matched_bloc": True,
+                    "priority_detected": "N8N_BLOC_DETECTED",
+                    "response": matched_bloc_response,
+                    "context": conversation_context
+                }
+        
+        # ✅ ÉTAPE 3: Traitement des réponses aux questions spécifiques en cours
+        if conversation_context.get("awaiting_financing_info"):
+            financing_type = PaymentContextProcessor.extract_financing_type(user_message, rules)
+            delay_months = PaymentContextProcessor.extract_time_delay(user_message)
+            signals.update(financing_type=financing_type, delay_months=delay_months)
+            
+            if financing_type == "CPF" and delay_months:
+                cpf_result = PaymentContextProcessor.handle_cpf_delay_context(
+                    delay_months, user_message, conversation_context, rules
+                )
+                if cpf_result:
+                    return cpf_result
+            
+            elif financing_type == "OPCO" and delay_months and delay_months >= rules.threshold("opco_months"):
+                return {
+                    "use_matched_bloc": False,
+                    "priority_detected": "OPCO_DELAI_DEPASSE",
+                    "response": rules.template("OPCO_DELAI_DEPASSE"),
+                    "context": conversation_context,
+                    "escalade_type": "admin"
+                }
+            
+            elif financing_type and not delay_months:
+                return {
+                    "use_matched_bloc": False,
+                    "priority_detected": "DEMANDE_DATE_FORMATION",
+                    "response": rules.template("DEMANDE_DATE_FORMATION"),
+                    "context": conversation_context,
+                    "awaiting_financing_info": True
+                }
+        
+        # ✅ ÉTAPE 4: Traitement du contexte CPF bloqué
+        if conversation_context.get("awaiting_cpf_info"):
+            return PaymentContextProcessor.handle_cpf_delay_context(0, user_message, conversation_context, rules)
+        
+        # ✅ ÉTAPE 5: Agressivité (priorité haute pour couper court)
+        if MessageProcessor.is_aggressive(user_message, rules):
+            return {
+                "use_matched_bloc": False,
+                "priority_detected": "AGRESSIVITE",
+                "response": rules.template("AGRESSIVITE"),
+                "context": conversation_context
+            }
+        
+        # ✅ ÉTAPE 6: Détection problème paiement formation (si pas déjà dans le contexte)
+        if not conversation_context.get("payment_context_detected"):
+            if rules.matcher("payment").matches(message_lower):
+                # Si c'est un message de suivi sur le paiement
+                if conversation_context["message_count"] > 0 and conversation_context["is_follow_up"]:
+                    return {
+                        "use_matched_bloc": False,
+                        "priority_detected": "PAIEMENT_SUIVI",
+                        "response": None,  # Laisser l'IA gérer avec contexte
+                        "context": conversation_context,
+                        "use_ai": True
+                    }
+                # Si un bloc est matché pour le paiement, l'utiliser
+                elif matched_bloc_response and bloc.mentions_payment_delay:
+                    return {
+                        "use_matched_bloc": True,
+                        "priority_detected": "PAIEMENT_FORMATION_BLOC",
+                        "response": matched_bloc_response,
+                        "context": conversation_context
+                    }
+                # Sinon, fallback paiement
+                else:
+                    return {
+                        "use_matched_bloc": False,
+                        "priority_detected": "PAIEMENT_SANS_BLOC",
+                        "response": rules.template("PAIEMENT_SANS_BLOC"),
+                        "context": conversation_context,
+                        "escalade_type": "admin"
+                    }
+        
+        # ✅ ÉTAPE 7: Messages de suivi généraux
+        if conversation_context["is_follow_up"] and conversation_context["message_count"] > 0:
+            return {
+                "use_matched_bloc": False,
+                "priority_detected": "FOLLOW_UP_CONVERSATION",
+                "response": None,  # Laisser l'IA gérer
+                "context": conversation_context,
+                "use_ai": True
+            }
+        
+        # ✅ ÉTAPE 8: Escalade automatique
+        escalade_type = ResponseValidator.validate_escalade_keywords(user_message, rules)
+        if escalade_type:
+            return {
+                "use_matched_bloc": False,
+                "priority_detected": "ESCALADE_AUTO",
+                "escalade_type": escalade_type,
+                "response": rules.template("ESCALADE_AUTO"),
+                "context": conversation_context
+            }
+        
+        # ✅ ÉTAPE 9: Si on arrive ici, utiliser le bloc n8n s'il existe (même si générique)
+        if matched_bloc_response and matched_bloc_response.strip():
+            logger.info("✅ UTILISATION BLOC N8N - Fallback sur bloc n8n")
+            return {
+                "use_matched_bloc": True,
+                "priority_detected": "N8N_BLOC_FALLBACK",
+                "response": matched_bloc_response,
+                "context": conversation_context
+            }
+        
+        # ✅ ÉTAPE 10: Fallback général
+        return {
+            "use_matched_bloc": False,
+            "priority_detected": "FALLBACK_GENERAL",
+            "context": conversation_context,
+            "response": None,
+            "use_ai": True
+        }
+
+
+def fallback_response(conversation_context: Dict[str, Any], rules: Optional[RuleSet] = None) -> str:
+    """Réponse de repli adaptée au contexte quand aucune réponse n'a été produite"""
+    rules = rules or current_rules()
+    if conversation_context["needs_greeting"]:
+        return rules.template("FALLBACK_GREETING")
+    return rules.template("FALLBACK_FOLLOW_UP")
+
+
+# Priorité détectée -> (type de réponse, escalade requise, réponse laissée à l'IA)
+# Une priorité absente de la table est traitée comme une réponse contextuelle de l'IA.
+RESPONSE_TYPES = {
+    "N8N_BLOC_DETECTED": ("n8n_bloc_used", False, False),
+    "N8N_BLOC_FALLBACK": ("n8n_bloc_fallback", False, False),
+    "CPF_DELAI_DEPASSE_FILTRAGE": ("cpf_delay_filtering", False, False),
+    "CPF_DELAI_NORMAL": ("cpf_delay_normal", False, False),
+    "OPCO_DELAI_DEPASSE": ("opco_delay_exceeded", True, False),
+    "OPCO_DELAI_NORMAL": ("opco_delay_normal", False, False),
+    "DIRECT_DELAI_DEPASSE": ("direct_delay_exceeded", True, False),
+    "DIRECT_DELAI_NORMAL": ("direct_delay_normal", False, False),
+    "AFFILIATION_STEPS_REQUEST": ("affiliation_steps_provided", False, False),
+    "PAIEMENT_CPF_DEMANDE_TIMING": ("cpf_timing_request", False, False),
+    "CPF_BLOQUE_CONFIRME": ("cpf_blocked_confirmed", False, False),
+    "DEMANDE_DATE_FORMATION": ("asking_formation_date", False, False),
+    "AGRESSIVITE": ("agressivite_detected", False, False),
+    "FOLLOW_UP_CONVERSATION": ("follow_up_ai_handled", False, True),
+    "PAIEMENT_SUIVI": ("paiement_suivi_ai_handled", False, True),
+    "ESCALADE_AUTO": ("auto_escalade", True, False),
+    "PAIEMENT_SANS_BLOC": ("paiement_fallback", True, False),
+}
+
+
+def resolve_priority_response(priority_result: Dict[str, Any]):
+    """Construction de la réponse selon la priorité : (réponse, type de réponse, escalade)"""
+    # Bloc n8n imposé tel quel
+    if priority_result.get("use_matched_bloc") and priority_result.get("response"):
+        return priority_result["response"], "exact_match_enforced", False
+
+    entry = RESPONSE_TYPES.get(priority_result.get("priority_detected"))
+    if entry is None:
+        # Utiliser l'IA pour une réponse contextuelle ou fallback
+        return None, "ai_contextual_response", priority_result.get("use_ai", False)
+
+    response_type, escalade_required, ai_handled = entry
+    return (None if ai_handled else priority_result["response"]), response_type, escalade_required
+
+
+def as_chat_messages(history: Iterable[Any]) -> List[Any]:
+    """Normalise un historique : ChatMessage, {"type"|"role", "content"} ou (rôle, contenu)"""
+    messages = []
+    for item in history or ():
+        if isinstance(item, dict):
+            role, content = item.get("type") or item.get("role"), item.get("content", "")
+        elif isinstance(item, (list, tuple)):
+            role, content = item
+        else:
+            messages.append(item)
+            continue
+        messages.append(ChatMessage("human" if role in ("human", "user") else "ai", str(content)))
+    return messages
+
+
+def as_bloc(bloc: Union[Bloc, str, None], max_chars: int = DEFAULT_MAX_BLOC_CHARS) -> Optional[Bloc]:
+    """Bloc déjà résolu (catalogue) ou texte brut du bloc n8n, nettoyé et plafonné"""
+    if bloc is None or isinstance(bloc, Bloc):
+        return bloc
+    cleaned = ResponseValidator.cap_length(ResponseValidator.clean_response(bloc), max_chars, "Bloc n8n")
+    return Bloc(cleaned) if cleaned else None
+
+
+def decide(history: Iterable[Any], message: str, bloc: Union[Bloc, str, None] = None,
+           summary: Optional[Dict[str, Any]] = None, rules: Optional[RuleSet] = None,
+           max_message_chars: int = DEFAULT_MAX_MESSAGE_CHARS) -> Dict[str, Any]:
+    """Décision de routage pour un message, sans effet de bord
+
+    `history` : messages précédents de la conversation (sans le message courant) ;
+    `summary` : résumé des tours compactés, le cas échéant. Quand la route est
+    confiée à l'IA (`use_ai`), `response` contient la réponse de repli que le
+    serveur enverrait sans LLM.
+    """
+    rules = rules or current_rules()
+    message = ResponseValidator.cap_length(ResponseValidator.clean_response(message), max_message_chars, "Message")
+    bloc = as_bloc(bloc)
+    matched_bloc_response = bloc.text if bloc is not None else ""
+
+    conversation_context = ConversationContextManager.analyze_history(
+        message, as_chat_messages(history), summary, rules
+    )
+    priority_result = MessageProcessor.detect_priority_rules(
+        message, matched_bloc_response, conversation_context, bloc, rules
+    )
+    final_response, response_type, escalade_required = resolve_priority_response(priority_result)
+
+    use_ai = final_response is None and bool(priority_result.get("use_ai"))
+    if final_response is None:
+        final_response = fallback_response(conversation_context, rules)
+        response_type = "fallback_with_context"
+        escalade_required = True
+
+    return {
+        "priority_detected": priority_result.get("priority_detected", "NONE"),
+        "response": final_response,
+        "response_type": response_type,
+        "escalade_required": escalade_required,
+        "escalade_type": priority_result.get("escalade_type", "admin"),
+        "use_ai": use_ai,
+        "use_matched_bloc": bool(priority_result.get("use_matched_bloc")),
+        "matched_bloc_id": bloc.bloc_id if bloc is not None else None,
+        "processed_message": message,
+        "conversation_context": conversation_context,
+        "rules_version": rules.version
+    }
+
+
+def history_window(memory: ConversationMemory, max_messages: int = DEFAULT_MAX_MESSAGES_PER_SESSION,
+                   max_tokens: int = DEFAULT_HISTORY_TOKEN_BUDGET) -> int:
+    """Nombre de messages récents que la fenêtre conserve (tous si l'historique y tient)"""
+    history = memory.chat_memory
+    messages = history.messages
+
+    if len(messages) <= max_messages and history.tokens <= max_tokens:
+        return len(messages)
+
+    # Garder les messages les plus récents tant que le budget le permet (toujours au moins le dernier)
+    kept = 0
+    kept_tokens = 0
+    for message in reversed(messages):
+        if kept >= max_messages or (kept and kept_tokens + message.tokens > max_tokens):
+            break
+        kept += 1
+        kept_tokens += message.tokens
+    return kept
+
+
+def trim_history(memory: ConversationMemory, max_messages: int = DEFAULT_MAX_MESSAGES_PER_SESSION,
+                 max_tokens: int = DEFAULT_HISTORY_TOKEN_BUDGET, rules: Optional[RuleSet] = None) -> int:
+    """Borne l'historique par budget de tokens et compacte les tours anciens dans un résumé
+
+    Retourne le nombre de messages compactés (0 si l'historique tenait dans la fenêtre).
+    """
+    history = memory.chat_memory
+    messages = history.messages
+    kept = history_window(memory, max_messages, max_tokens)
+    if kept == len(messages):
+        return 0
+
+    collapsed = messages[:-kept]
+    memory.summary = ConversationContextManager.summarize_collapsed(collapsed, memory.summary, rules)
+    history.messages = messages[-kept:]
+    return len(collapsed)
+
+
+def decide_turn(memory: ConversationMemory, message: str, bloc: Union[Bloc, str, None] = None,
+                rules: Optional[RuleSet] = None, record_response: bool = True,
+                max_messages: int = DEFAULT_MAX_MESSAGES_PER_SESSION,
+                max_tokens: int = DEFAULT_HISTORY_TOKEN_BUDGET) -> Dict[str, Any]:
+    """Tour complet sur une mémoire de conversation, dans le même ordre que le serveur (sans LLM)
+
+    Le message est ajouté à l'historique, puis la réponse décidée si `record_response`
+    (faux quand les réponses réellement envoyées sont rejouées à part).
+    """
+    rules = rules or current_rules()
+    message = ResponseValidator.cap_length(ResponseValidator.clean_response(message), DEFAULT_MAX_MESSAGE_CHARS, "Message")
+    trim_history(memory, max_messages, max_tokens, rules)
+    try:
+        decision = decide(memory.chat_memory.messages, message, bloc, memory.summary, rules)
+    finally:
+        # Comme le serveur : le message reste dans l'historique même si les règles échouent
+        memory.chat_memory.add_user_message(message)
+    if record_response:
+        memory.chat_memory.add_ai_message(decision["response"])
+    trim_history(memory, max_messages, max_tokens, rules)
+    return decision
@@ -0,0 +1,281 @@
+"""File d'escalades livrées par lots, hors du chemin de la requête
+
+process_message dépose un événement (submit, sans attente) ; un worker en tâche
+de fond regroupe les événements par lots et les livre au sink configuré :
+fichier NDJSON, base SQLite ou endpoint HTTP. Un lot en échec est réessayé avec
+un backoff exponentiel ; si la file est pleine, l'événement est compté comme
+perdu plutôt que de ralentir la réponse à l'utilisateur.
+
+Les événements contiennent le message de l'utilisateur (données personnelles) :
+aucun sink n'est actif par défaut. Le sink fichier est borné : au-delà de
+`max_file_bytes`, le fichier est renommé avec un horodatage et seuls les
+`max_files` fichiers les plus récents (fichier actif compris) sont conservés ;
+la rétention est donc d'au plus max_files × max_file_bytes octets.
+"""
+
+import asyncio
+import glob
+import json
+import logging
+import os
+import random
+import sqlite3
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def make_escalation_event(wa_id: str, escalade_type: Optional[str], priority_detected: str,
+                          response_type: str, user_message: str, response: Optional[str]) -> Dict[str, Any]:
+    return {
+        "escalation_id": uuid.uuid4().hex,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "wa_id": wa_id,
+        "escalade_type": escalade_type or "admin",
+        "priority_detected": priority_detected,
+        "response_type": response_type,
+        "user_message": user_message,
+        "response": response
+    }
+
+
+class FileSink:
+    """Ajoute chaque lot à un fichier NDJSON (un événement par ligne), avec rotation bornée"""
+
+    name = "file"
+
+    def __init__(self, path: str, max_file_bytes: int = 16 * 1024 * 1024, max_files: int = 5):
+        self.path = path
+        self.max_file_bytes = max_file_bytes
+        self.max_files = max(max_files, 1)
+        self.rotations = 0
+
+    def _rotate(self):
+        """Renomme le fichier actif avec un horodatage et supprime les plus anciens"""
+        stem, extension = os.path.splitext(self.path)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+        os.replace(self.path, f"{stem}-{stamp}{extension}")
+        self.rotations += 1
+        rotated = sorted(glob.glob(f"{glob.escape(stem)}-*{extension}"))
+        for path in rotated[:max(0, len(rotated) - self.max_files + 1)]:
+            os.remove(path)
+
+    def _write(self, events: List[Dict[str, Any]]):
+        data = "".join(json.dumps(event, ensure_ascii=False) + "\n" for event in events).encode("utf-8")
+        # Un lot n'est jamais coupé : le fichier dépasse au plus d'un lot la taille maximale
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if size and size + len(data) > self.max_file_bytes:
+            self._rotate()
+        with open(self.path, "ab") as f:
+            f.write(data)
+
+    async def deliver(self, events: List[Dict[str, Any]]):
+        await asyncio.to_thread(self._write, events)
+
+    async def close(self):
+        pass
+
+
+class SQLiteSink:
+    """Insère chaque lot dans une table `escalations` (une transaction par lot)"""
+
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _write(self, events: List[Dict[str, Any]]):
+        connection = sqlite3.connect(self.path)
+        try:
+            with connection:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS escalations ("
+                    "escalation_id TEXT PRIMARY KEY, created_at TEXT, wa_id TEXT, escalade_type TEXT, "
+                    "priority_detected TEXT, response_type TEXT, payload TEXT)"
+                )
+                # OR IGNORE : un lot réessayé après un échec partiel ne crée pas de doublons
+                connection.executemany(
+                    "INSERT OR IGNORE INTO escalations VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (event["escalation_id"], event["created_at"], event["wa_id"], event["escalade_type"],
+                         event["priority_detected"], event["response_type"], json.dumps(event, ensure_ascii=False))
+                        for event in events
+                    ]
+                )
+        finally:
+            connection.close()
+
+    async def deliver(self, events: List[Dict[str, Any]]):
+        await asyncio.to_thread(self._write, events)
+
+    async def close(self):
+        pass
+
+
+class HTTPSink:
+    """POST du lot en JSON ({"escalations": [...]}) vers un endpoint (ticketing, webhook n8n, stub)"""
+
+    name = "http"
+
+    def __init__(self, url: str, timeout: float = 5.0):
+        self.url = url
+        self.timeout = timeout
+        self._client = None
+
+    async def deliver(self, events: List[Dict[str, Any]]):
+        if self._client is None:
+            # Import différé, comme pour le client LLM
+            import httpx
+            self._client = httpx.AsyncClient(timeout=self.timeout)
+        response = await self._client.post(self.url, json={"escalations": events})
+        response.raise_for_status()
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+def make_sink(kind: str, path: str = "", url: str = "", max_file_bytes: int = 16 * 1024 * 1024,
+              max_files: int = 5):
+    """Sink d'après la configuration ("file", "sqlite", "http" ; "none" ou vide = désactivé)"""
+    if kind == "file":
+        return FileSink(path or "escalations.ndjson", max_file_bytes, max_files)
+    if kind == "sqlite":
+        return SQLiteSink(path or "escalations.sqlite3")
+    if kind == "http":
+        if not url:
+            raise ValueError("ESCALATION_URL est requis pour le sink http")
+        return HTTPSink(url)
+    if kind in ("", "none"):
+        return None
+    raise ValueError(f"Sink d'escalade inconnu: {kind}")
+
+
+class EscalationDispatcher:
+    """File bornée + worker de livraison par lots avec réessais"""
+
+    def __init__(self, sink, max_queue: int = 10_000, batch_size: int = 50, flush_interval: float = 1.0,
+                 max_retries: int = 5, backoff_base: float = 0.5, backoff_max: float = 30.0):
+        self.sink = sink
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.submitted = 0
+        self.dropped = 0
+        self.delivered = 0
+        self.batches = 0
+        self.retries = 0
+        self.failed = 0
+        self.last_error: Optional[str] = None
+        self.last_delivery_seconds: Optional[float] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.sink is not None
+
+    def start(self):
+        if self.enabled and self._task is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"🚨 Dispatcher d'escalades démarré (sink {self.sink.name})")
+
+    def submit(self, event: Dict[str, Any]) -> bool:
+        """Dépose un événement sans jamais attendre ; faux si désactivé ou file pleine"""
+        if self._queue is None:
+            return False
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning(f"🚨 File d'escalades pleine, escalade perdue pour {event.get('wa_id')}")
+            return False
+        self.submitted += 1
+        return True
+
+    async def _next_batch(self) -> List[Dict[str, Any]]:
+        """Attend un premier événement puis regroupe ce qui arrive pendant flush_interval"""
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _deliver(self, batch: List[Dict[str, Any]]):
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            try:
+                await self.sink.deliver(batch)
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {str(e)}"
+                if attempt == self.max_retries:
+                    self.failed += len(batch)
+                    logger.error(f"Escalation delivery failed after {attempt + 1} attempts, {len(batch)} events lost: {self.last_error}")
+                    return
+                self.retries += 1
+                # Backoff exponentiel plafonné, avec gigue pour ne pas synchroniser les réessais
+                delay = min(self.backoff_max, self.backoff_base * 2 ** attempt) * random.uniform(0.5, 1.0)
+                logger.warning(f"🚨 Livraison des escalades en échec ({self.last_error}), nouvel essai dans {delay:.2f}s")
+                await asyncio.sleep(delay)
+                continue
+
+            self.delivered += len(batch)
+            self.batches += 1
+            self.last_delivery_seconds = round(time.perf_counter() - start, 4)
+            return
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            try:
+                await self._deliver(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def stop(self, timeout: float = 5.0):
+        """Arrêt gracieux : livre ce qui reste dans la file (dans la limite de `timeout`)"""
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"🚨 {self._queue.qsize()} escalades non livrées à l'arrêt")
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self.sink.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "sink": self.sink.name if self.sink else None,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "max_queue": self.max_queue,
+            "submitted": self.submitted,
+            "dropped": self.dropped,
+            "delivered": self.delivered,
+            "batches": self.batches,
+            "retries": self.retries,
+            "failed": self.failed,
+            "last_error": self.last_error,
+            "last_delivery_seconds": self.last_delivery_seconds
+        }
@@ -0,0 +1,302 @@
+"""Maintenance des sessions en tâche de fond : ordonnanceur de jobs périodiques
+
+Le chemin de requête ne fait que de la tenue de comptes en O(1) (marquer une
+session à compacter) ; le travail proportionnel au nombre de sessions ou à la
+taille des historiques est fait ici, par des jobs périodiques exécutés l'un
+après l'autre par une seule tâche de fond :
+
+- expiration des sessions inactives depuis plus de `ttl_seconds` ;
+- compaction des historiques qui dépassent la fenêtre après un tour ;
+- agrégats d'activité (sessions par ancienneté de dernière interaction) ;
+- checkpoints périodiques du snapshot.
+
+Chaque exécution dispose d'un budget par tranche (`TimeSlice`) : le job rend
+la main à la boucle d'événements dès que la tranche est épuisée, si bien
+qu'aucune requête n'attend plus d'une tranche. Chaque job publie ses
+métriques (exécutions, éléments traités, durée, tranches, dépassements).
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from .memory import ConversationMemory
+
+logger = logging.getLogger(__name__)
+
+
+class TimeSlice:
+    """Budget d'une exécution de job : tranches de `seconds` séparées par un retour à la boucle"""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.slices = 0
+        self.max_slice_seconds = 0.0
+        self.overruns = 0
+        self._start = time.perf_counter()
+
+    def exhausted(self) -> bool:
+        return time.perf_counter() - self._start >= self.seconds
+
+    def _end_slice(self):
+        elapsed = time.perf_counter() - self._start
+        self.slices += 1
+        self.max_slice_seconds = max(self.max_slice_seconds, elapsed)
+        # Un seul élément a pris plus du double du budget
+        if elapsed > 2 * self.seconds:
+            self.overruns += 1
+
+    async def pause(self):
+        self._end_slice()
+        await asyncio.sleep(0)
+        self._start = time.perf_counter()
+
+    async def wait(self, awaitable):
+        """Attente qui ne bloque pas la boucle (I/O dans un thread) : hors budget de tranche"""
+        self._end_slice()
+        try:
+            return await awaitable
+        finally:
+            self._start = time.perf_counter()
+
+    def close(self):
+        self._end_slice()
+
+
+class HousekeepingJob:
+    """Job périodique et ses métriques"""
+
+    def __init__(self, name: str, func: Callable[[TimeSlice], Awaitable[int]], interval: float,
+                 slice_seconds: float):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.slice_seconds = slice_seconds
+        self.next_run = time.monotonic() + interval
+        self.lock = asyncio.Lock()
+        self.runs = 0
+        self.items = 0
+        self.last_items = 0
+        self.last_run_at: Optional[float] = None
+        self.last_duration = 0.0
+        self.total_duration = 0.0
+        self.slices = 0
+        self.max_slice_seconds = 0.0
+        self.overruns = 0
+        self.errors = 0
+        self.last_error: Optional[str] = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "interval_seconds": self.interval,
+            "slice_ms": round(self.slice_seconds * 1000, 3),
+            "running": self.lock.locked(),
+            "runs": self.runs,
+            "items": self.items,
+            "last_items": self.last_items,
+            "last_run_at": datetime.fromtimestamp(self.last_run_at, tz=timezone.utc).isoformat() if self.last_run_at else None,
+            "last_duration_ms": round(self.last_duration * 1000, 3),
+            "total_duration_ms": round(self.total_duration * 1000, 3),
+            "slices": self.slices,
+            "max_slice_ms": round(self.max_slice_seconds * 1000, 3),
+            "overruns": self.overruns,
+            "errors": self.errors,
+            "last_error": self.last_error
+        }
+
+
+class HousekeepingScheduler:
+    """Exécute les jobs à échéance, un à la fois, dans une tâche de fond démarrée avec l'application"""
+
+    def __init__(self, slice_seconds: float = 0.005):
+        self.slice_seconds = slice_seconds
+        self.jobs: Dict[str, HousekeepingJob] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def add(self, name: str, func: Callable[[TimeSlice], Awaitable[int]], interval: float,
+            slice_seconds: Optional[float] = None):
+        """Enregistre un job (ignoré si `interval` <= 0 : job désactivé)"""
+        if interval <= 0:
+            return
+        self.jobs[name] = HousekeepingJob(name, func, interval, slice_seconds or self.slice_seconds)
+
+    async def run_job(self, job: HousekeepingJob) -> int:
+        async with job.lock:
+            time_slice = TimeSlice(job.slice_seconds)
+            start = time.perf_counter()
+            job.runs += 1
+            job.last_run_at = time.time()
+            items = 0
+            try:
+                items = await job.func(time_slice)
+                job.items += items
+                job.last_items = items
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                job.errors += 1
+                job.last_error = f"{type(e).__name__}: {str(e)}"
+                logger.error(f"Error in housekeeping job {job.name}: {str(e)}")
+            finally:
+                time_slice.close()
+                job.last_duration = time.perf_counter() - start
+                job.total_duration += job.last_duration
+                job.slices += time_slice.slices
+                job.max_slice_seconds = max(job.max_slice_seconds, time_slice.max_slice_seconds)
+                job.overruns += time_slice.overruns
+                job.next_run = time.monotonic() + job.interval
+            return items
+
+    async def run_now(self, name: str) -> Optional[Dict[str, Any]]:
+        """Exécute un job immédiatement (endpoint d'administration), None si inconnu"""
+        job = self.jobs.get(name)
+        if job is None:
+            return None
+        await self.run_job(job)
+        return job.stats()
+
+    async def _run(self):
+        while True:
+            job = min(self.jobs.values(), key=lambda job: job.next_run)
+            delay = job.next_run - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            await self.run_job(job)
+
+    def start(self):
+        if self.jobs and self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"🧽 Maintenance en arrière-plan : {', '.join(self.jobs)}")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self._task is not None,
+            "jobs": {name: job.stats() for name, job in self.jobs.items()}
+        }
+
+
+class SessionExpiry:
+    """Efface les sessions sans interaction depuis plus de `ttl_seconds`"""
+
+    def __init__(self, store, ttl_seconds: float):
+        self.store = store
+        self.ttl_seconds = ttl_seconds
+        self.expired = 0
+
+    async def run(self, time_slice: TimeSlice) -> int:
+        expired = 0
+        for wa_id in list(self.store.keys()):
+            if time_slice.exhausted():
+                await time_slice.pause()
+            # Réévalué à chaque session : une session réactivée pendant le passage est conservée
+            last_interaction = self.store.last_interaction(wa_id)
+            if last_interaction is not None and last_interaction < time.time() - self.ttl_seconds:
+                del self.store[wa_id]
+                expired += 1
+        self.expired += expired
+        if expired:
+            logger.info(f"🧽 {expired} sessions expirées (inactives depuis plus de {self.ttl_seconds}s)")
+        return expired
+
+
+class HistoryCompactor:
+    """Compaction différée des historiques qui dépassent la fenêtre après un tour
+
+    Le tour marque la session (O(1)) au lieu de la compacter ; une session qui
+    arrive hors budget (snapshot, réhydratation, transfert) est marquée de même.
+    Une compaction en attente est appliquée avant toute nouvelle modification de
+    l'historique (`take`), si bien que le découpage des tours compactés, et donc
+    le résumé, est exactement celui d'une compaction immédiate. Une session non
+    marquée est déjà dans la fenêtre : le tour ne la parcourt pas.
+    """
+
+    def __init__(self, store, trim: Callable[[ConversationMemory], Any], max_messages: int, max_tokens: int):
+        self.store = store
+        self.trim = trim
+        self.max_messages = max_messages
+        self.max_tokens = max_tokens
+        self._pending: "OrderedDict[str, ConversationMemory]" = OrderedDict()
+        self.compacted = 0
+
+    def mark(self, wa_id: str, memory: ConversationMemory):
+        history = memory.chat_memory
+        if len(history.messages) > self.max_messages or history.tokens > self.max_tokens:
+            self._pending[wa_id] = memory
+
+    def take(self, wa_id: str) -> bool:
+        """Retire la session des compactions en attente ; vrai si l'appelant doit compacter"""
+        return self._pending.pop(wa_id, None) is not None
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    async def run(self, time_slice: TimeSlice) -> int:
+        compacted = 0
+        while self._pending:
+            if time_slice.exhausted():
+                await time_slice.pause()
+                continue
+            wa_id, memory = self._pending.popitem(last=False)
+            # Session effacée, remplacée ou passée au niveau froid : marquée à nouveau à son retour
+            if self.store.peek(wa_id) is memory:
+                self.trim(memory)
+                compacted += 1
+        self.compacted += compacted
+        return compacted
+
+
+# Bornes des tranches d'inactivité publiées par ActivityStats (secondes, libellé)
+ACTIVITY_BUCKETS: List[Tuple[float, str]] = [
+    (300, "under_5m"),
+    (3600, "under_1h"),
+    (86400, "under_24h"),
+    (7 * 86400, "under_7d"),
+]
+
+
+class ActivityStats:
+    """Agrégats d'activité recalculés en tâche de fond (servis tels quels par les endpoints)"""
+
+    def __init__(self, store):
+        self.store = store
+        self.snapshot: Optional[Dict[str, Any]] = None
+
+    async def run(self, time_slice: TimeSlice) -> int:
+        now = time.time()
+        counts = {label: 0 for _, label in ACTIVITY_BUCKETS}
+        counts["over_7d"] = 0
+        oldest = None
+        scanned = 0
+        for wa_id in list(self.store.keys()):
+            if time_slice.exhausted():
+                await time_slice.pause()
+            last_interaction = self.store.last_interaction(wa_id)
+            if last_interaction is None:
+                continue
+            scanned += 1
+            idle = now - last_interaction
+            label = next((label for limit, label in ACTIVITY_BUCKETS if idle < limit), "over_7d")
+            counts[label] += 1
+            oldest = last_interaction if oldest is None else min(oldest, last_interaction)
+        self.snapshot = {
+            "sessions": scanned,
+            "idle": counts,
+            "oldest_interaction": datetime.fromtimestamp(oldest, tz=timezone.utc).isoformat() if oldest else None,
+            "computed_at": datetime.fromtimestamp(now, tz=timezone.utc).isoformat()
+        }
+        return scanned
@@ -0,0 +1,251 @@
+"""Génération de réponses par LLM (API compatible OpenAI) pour les routes use_ai
+
+Client HTTP asynchrone mutualisé (keep-alive), concurrence bornée et budget de
+latence strict : en cas de dépassement ou d'erreur, generate() retourne None et
+l'appelant utilise la réponse de repli habituelle. stream() émet les tokens au fil
+de l'eau (SSE de l'API OpenAI) sous le même budget.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+ROLE_BY_MESSAGE_TYPE = {"human": "user", "ai": "assistant"}
+
+
+class LLMSettings:
+    """Configuration du client LLM (variables d'environnement)"""
+
+    def __init__(self):
+        self.enabled = os.getenv("LLM_ENABLED", "true").lower() in ("1", "true", "yes")
+        self.api_key = os.getenv("OPENAI_API_KEY", "")
+        self.base_url = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/")
+        self.model = os.getenv("LLM_MODEL", "gpt-4o-mini")
+        self.temperature = float(os.getenv("LLM_TEMPERATURE", "0.3"))
+        self.max_tokens = int(os.getenv("LLM_MAX_TOKENS", "300"))
+        self.max_concurrency = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+        self.max_connections = int(os.getenv("LLM_MAX_CONNECTIONS", "16"))
+        self.keepalive_expiry = float(os.getenv("LLM_KEEPALIVE_EXPIRY_SECONDS", "30"))
+        self.connect_timeout = float(os.getenv("LLM_CONNECT_TIMEOUT_SECONDS", "2"))
+        self.read_timeout = float(os.getenv("LLM_READ_TIMEOUT_SECONDS", "8"))
+        self.latency_budget = float(os.getenv("LLM_LATENCY_BUDGET_SECONDS", "6"))
+
+
+class LLMMetrics:
+    """Compteurs de la génération LLM"""
+
+    def __init__(self):
+        self.requests = 0
+        self.successes = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.empty = 0
+        self.in_flight = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def record_latency(self, latency: float):
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "successes": self.successes,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+            "empty": self.empty,
+            "in_flight": self.in_flight,
+            "avg_latency_ms": round(self.total_latency / self.successes * 1000, 1) if self.successes else None,
+            "max_latency_ms": round(self.max_latency * 1000, 1)
+        }
+
+
+class LLMGenerator:
+    """Étape de génération asynchrone avec repli garanti dans le budget de latence"""
+
+    def __init__(self, settings: Optional[LLMSettings] = None):
+        self.settings = settings or LLMSettings()
+        self.metrics = LLMMetrics()
+        self._client = None
+        self._semaphore = asyncio.Semaphore(self.settings.max_concurrency)
+
+    @property
+    def available(self) -> bool:
+        return self.settings.enabled and self._client is not None
+
+    async def start(self):
+        """Crée le client HTTP mutualisé (appelé au démarrage de l'application)"""
+        if not self.settings.enabled or self._client is not None:
+            return
+        # Import différé : httpx n'est chargé que si la génération est active
+        import httpx
+
+        self._client = httpx.AsyncClient(
+            base_url=self.settings.base_url,
+            headers={"Authorization": f"Bearer {self.settings.api_key}"},
+            timeout=httpx.Timeout(
+                self.settings.read_timeout,
+                connect=self.settings.connect_timeout,
+                pool=self.settings.connect_timeout
+            ),
+            limits=httpx.Limits(
+                max_connections=self.settings.max_connections,
+                max_keepalive_connections=self.settings.max_connections,
+                keepalive_expiry=self.settings.keepalive_expiry
+            )
+        )
+        logger.info(f"🤖 Client LLM prêt ({self.settings.model} via {self.settings.base_url})")
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def build_messages(self, system_prompt: str, history: List[Any], conversation_context: Dict[str, Any],
+                       priority_detected: str, summary: Optional[Dict[str, Any]] = None) -> List[Dict[str, str]]:
+        """Construit le prompt : consignes (texte LLM_SYSTEM_PROMPT des règles), état détecté puis historique"""
+        state_lines = [
+            f"Situation détectée : {priority_detected}",
+            f"Sujet précédent : {conversation_context.get('previous_topic') or 'inconnu'}"
+        ]
+        if summary:
+            flags = [name for name, value in summary["state"].items() if value is True]
+            state_lines.append(
+                f"{summary['collapsed_messages']} messages plus anciens résumés, état : {', '.join(flags) or 'aucun'}"
+            )
+
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "system", "content": "\n".join(state_lines)}
+        ]
+        for message in history:
+            role = ROLE_BY_MESSAGE_TYPE.get(message.type)
+            if role:
+                messages.append({"role": role, "content": str(message.content)})
+        return messages
+
+    def _payload(self, messages: List[Dict[str, str]], stream: bool = False) -> Dict[str, Any]:
+        return {
+            "model": self.settings.model,
+            "messages": messages,
+            "temperature": self.settings.temperature,
+            "max_tokens": self.settings.max_tokens,
+            "stream": stream
+        }
+
+    async def _complete(self, messages: List[Dict[str, str]]) -> Optional[str]:
+        async with self._semaphore:
+            self.metrics.in_flight += 1
+            try:
+                response = await self._client.post("/chat/completions", json=self._payload(messages))
+                response.raise_for_status()
+                data = response.json()
+                return (data["choices"][0]["message"].get("content") or "").strip()
+            finally:
+                self.metrics.in_flight -= 1
+
+    async def generate(self, messages: List[Dict[str, str]], budget: Optional[float] = None) -> Optional[str]:
+        """Retourne la réponse générée, ou None si indisponible, en erreur ou hors budget"""
+        if not self.available:
+            return None
+
+        budget = self.settings.latency_budget if budget is None else min(budget, self.settings.latency_budget)
+        self.metrics.requests += 1
+        start = time.perf_counter()
+        try:
+            # Le budget couvre l'attente d'un slot de concurrence et l'appel HTTP
+            text = await asyncio.wait_for(self._complete(messages), timeout=max(budget, 0))
+        except asyncio.TimeoutError:
+            self.metrics.timeouts += 1
+            logger.warning(f"⏱️ Génération LLM hors budget ({budget}s), réponse de repli")
+            return None
+        except Exception as e:
+            self.metrics.errors += 1
+            logger.error(f"LLM generation error: {type(e).__name__}: {str(e)}")
+            return None
+
+        if not text:
+            self.metrics.empty += 1
+            return None
+
+        self.metrics.successes += 1
+        self.metrics.record_latency(time.perf_counter() - start)
+        return text
+
+    async def stream(self, messages: List[Dict[str, str]], budget: Optional[float] = None) -> AsyncIterator[Optional[str]]:
+        """Émet les fragments de texte au fil de l'eau ; émet None puis s'arrête en cas d'erreur ou hors budget"""
+        if not self.available:
+            yield None
+            return
+
+        budget = self.settings.latency_budget if budget is None else min(budget, self.settings.latency_budget)
+        deadline = time.monotonic() + max(budget, 0)
+        self.metrics.requests += 1
+        start = time.perf_counter()
+        produced = False
+
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=max(deadline - time.monotonic(), 0))
+        except asyncio.TimeoutError:
+            self.metrics.timeouts += 1
+            yield None
+            return
+
+        self.metrics.in_flight += 1
+        response = None
+        try:
+            # L'attente des en-têtes de réponse compte aussi dans le budget
+            request = self._client.build_request("POST", "/chat/completions", json=self._payload(messages, stream=True))
+            response = await asyncio.wait_for(
+                self._client.send(request, stream=True),
+                timeout=max(deadline - time.monotonic(), 0)
+            )
+            response.raise_for_status()
+            lines = response.aiter_lines()
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                try:
+                    line = await asyncio.wait_for(lines.__anext__(), timeout=remaining)
+                except StopAsyncIteration:
+                    break
+
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                delta = json.loads(data)["choices"][0].get("delta", {}).get("content")
+                if delta:
+                    produced = True
+                    yield delta
+        except asyncio.TimeoutError:
+            self.metrics.timeouts += 1
+            logger.warning(f"⏱️ Streaming LLM hors budget ({budget}s)")
+            yield None
+            return
+        except Exception as e:
+            self.metrics.errors += 1
+            logger.error(f"LLM streaming error: {type(e).__name__}: {str(e)}")
+            yield None
+            return
+        finally:
+            if response is not None:
+                await response.aclose()
+            self.metrics.in_flight -= 1
+            self._semaphore.release()
+
+        if not produced:
+            self.metrics.empty += 1
+            yield None
+            return
+
+        self.metrics.successes += 1
+        self.metrics.record_latency(time.perf_counter() - start)
@@ -0,0 +1,224 @@
+"""Mémoire conversationnelle légère (remplace ConversationBufferMemory de LangChain)"""
+
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+
+# Approximation du nombre de tokens : ~4 octets UTF-8 par token pour du français
+BYTES_PER_TOKEN = 4
+
+
+def estimate_tokens(size: int) -> int:
+    """Estime le nombre de tokens d'un contenu à partir de sa taille en octets"""
+    return max(1, (size + BYTES_PER_TOKEN - 1) // BYTES_PER_TOKEN)
+
+
+class ChatMessage:
+    """Message de conversation minimal, compatible avec l'usage de langchain"""
+
+    __slots__ = ("type", "content", "size", "tokens")
+
+    def __init__(self, type: str, content: str):
+        self.type = type
+        self.content = content
+        # Taille en octets et tokens estimés calculés une seule fois à l'insertion
+        self.size = len(content.encode("utf-8"))
+        self.tokens = estimate_tokens(self.size)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"type": self.type, "content": self.content}
+
+    def __repr__(self) -> str:
+        return f"ChatMessage(type={self.type!r}, content={self.content[:30]!r})"
+
+
+class MemoryStats:
+    """Agrégats globaux maintenus incrémentalement (lecture en O(1))"""
+
+    __slots__ = ("sessions", "messages", "user_messages", "ai_messages", "chars", "bytes")
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.sessions = 0
+        self.messages = 0
+        self.user_messages = 0
+        self.ai_messages = 0
+        self.chars = 0
+        self.bytes = 0
+
+    def apply(self, sign: int, messages: int, user_messages: int, ai_messages: int, chars: int, size: int):
+        self.messages += sign * messages
+        self.user_messages += sign * user_messages
+        self.ai_messages += sign * ai_messages
+        self.chars += sign * chars
+        self.bytes += sign * size
+
+    def to_dict(self) -> Dict[str, int]:
+        return {
+            "active_sessions": self.sessions,
+            "total_messages": self.messages,
+            "user_messages": self.user_messages,
+            "ai_messages": self.ai_messages,
+            "total_memory_size_chars": self.chars,
+            "total_memory_size_bytes": self.bytes
+        }
+
+
+class ChatMessageHistory:
+    """Historique des messages d'une session, avec compteurs tenus à jour"""
+
+    __slots__ = ("_messages", "user_messages", "ai_messages", "chars", "bytes", "tokens", "_stats")
+
+    def __init__(self):
+        self._messages: List[ChatMessage] = []
+        self.user_messages = 0
+        self.ai_messages = 0
+        self.chars = 0
+        self.bytes = 0
+        self.tokens = 0
+        self._stats: Optional[MemoryStats] = None
+
+    def _counts(self) -> Tuple[int, int, int, int, int]:
+        return len(self._messages), self.user_messages, self.ai_messages, self.chars, self.bytes
+
+    def _account(self, message: ChatMessage, sign: int):
+        user = 1 if message.type == "human" else 0
+        ai = 1 if message.type == "ai" else 0
+        chars = len(message.content)
+        self.user_messages += sign * user
+        self.ai_messages += sign * ai
+        self.chars += sign * chars
+        self.bytes += sign * message.size
+        self.tokens += sign * message.tokens
+        if self._stats is not None:
+            self._stats.apply(sign, 1, user, ai, chars, message.size)
+
+    @property
+    def messages(self) -> List[ChatMessage]:
+        return self._messages
+
+    @messages.setter
+    def messages(self, messages: List[ChatMessage]):
+        # Remplacement complet (trim, restauration) : on recalcule les compteurs de la session
+        for message in self._messages:
+            self._account(message, -1)
+        self._messages = list(messages)
+        for message in self._messages:
+            self._account(message, 1)
+
+    def add_message(self, message: ChatMessage):
+        self._messages.append(message)
+        self._account(message, 1)
+
+    def add_user_message(self, content: str):
+        self.add_message(ChatMessage("human", content))
+
+    def add_ai_message(self, content: str):
+        self.add_message(ChatMessage("ai", content))
+
+    def attach(self, stats: MemoryStats):
+        """Rattache la session aux agrégats globaux du store"""
+        self._stats = stats
+        stats.sessions += 1
+        stats.apply(1, *self._counts())
+
+    def detach(self):
+        """Retire la contribution de la session des agrégats globaux"""
+        if self._stats is not None:
+            self._stats.sessions -= 1
+            self._stats.apply(-1, *self._counts())
+            self._stats = None
+
+
+class ConversationMemory:
+    """Équivalent de ConversationBufferMemory sans l'arbre de dépendances LangChain"""
+
+    __slots__ = ("memory_key", "return_messages", "chat_memory", "last_interaction", "summary")
+
+    def __init__(self, memory_key: str = "history", return_messages: bool = True):
+        self.memory_key = memory_key
+        self.return_messages = return_messages
+        self.chat_memory = ChatMessageHistory()
+        self.last_interaction = time.time()
+        # Résumé structuré des tours anciens retirés de l'historique
+        self.summary: Optional[Dict[str, Any]] = None
+
+    def touch(self):
+        """Met à jour l'horodatage de dernière interaction"""
+        self.last_interaction = time.time()
+
+    def load_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        """Retourne l'historique au format attendu par les clients de l'API"""
+        messages = self.chat_memory.messages
+        if self.return_messages:
+            return {self.memory_key: [m.to_dict() for m in messages]}
+
+        prefixes = {"human": "Human", "ai": "AI"}
+        buffer = "\n".join(f"{prefixes.get(m.type, m.type)}: {m.content}" for m in messages)
+        return {self.memory_key: buffer}
+
+
+class SessionStore:
+    """Store des sessions par wa_id, avec agrégats globaux en O(1)"""
+
+    def __init__(self):
+        self._sessions: Dict[str, ConversationMemory] = {}
+        self.stats = MemoryStats()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __contains__(self, wa_id: str) -> bool:
+        return wa_id in self._sessions
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._sessions)
+
+    def __getitem__(self, wa_id: str) -> ConversationMemory:
+        return self._sessions[wa_id]
+
+    def __setitem__(self, wa_id: str, memory: ConversationMemory):
+        previous = self._sessions.get(wa_id)
+        if previous is not None:
+            previous.chat_memory.detach()
+        memory.chat_memory.attach(self.stats)
+        self._sessions[wa_id] = memory
+
+    def __delitem__(self, wa_id: str):
+        self._sessions.pop(wa_id).chat_memory.detach()
+
+    def get(self, wa_id: str, default: Optional[ConversationMemory] = None) -> Optional[ConversationMemory]:
+        return self._sessions.get(wa_id, default)
+
+    def peek(self, wa_id: str) -> Optional[ConversationMemory]:
+        """Lecture sans effet de bord (les endpoints d'administration ne réveillent pas les sessions)"""
+        return self._sessions.get(wa_id)
+
+    def last_interaction(self, wa_id: str) -> Optional[float]:
+        """Horodatage de dernière interaction, None si la session n'existe pas"""
+        memory = self._sessions.get(wa_id)
+        return memory.last_interaction if memory is not None else None
+
+    def pop(self, wa_id: str, *default):
+        if wa_id not in self._sessions and default:
+            return default[0]
+        memory = self._sessions.pop(wa_id)
+        memory.chat_memory.detach()
+        return memory
+
+    def keys(self):
+        return self._sessions.keys()
+
+    def values(self):
+        return self._sessions.values()
+
+    def items(self):
+        return self._sessions.items()
+
+    def clear(self):
+        for memory in self._sessions.values():
+            memory.chat_memory._stats = None
+        self._sessions.clear()
+        self.stats.reset()
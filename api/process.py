@@ -1,17 +1,254 @@
 import os
+import asyncio
 import logging
-from typing import Dict, Any, Optional
-from fastapi import FastAPI, HTTPException, Request
+import time
+from contextlib import aclosing, asynccontextmanager
+from typing import Dict, Any, List, Optional
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from langchain.memory import ConversationBufferMemory
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+from datetime import datetime, timezone
+from itertools import islice
+import hmac
+import io
 import json
-import re
+import math
+import zlib
+
+from .accounting import TracemallocProbe, estimated_session_bytes, store_report
+from .admission import AdmissionController
+from .blocs import Bloc, BlocCatalog
+from .bulk import BulkOperations, SessionSelector
+from .cache import ResponseCache, history_digest, make_cache_key
+from .decision_log import DecisionLog
+from .deadline import DEADLINE_HEADER, DeadlineMetrics, RequestDeadline, resolve_budget
+from .engine import (
+    DEFAULT_HISTORY_TOKEN_BUDGET,
+    DEFAULT_MAX_BLOC_CHARS,
+    DEFAULT_MAX_MESSAGE_CHARS,
+    DEFAULT_MAX_MESSAGES_PER_SESSION,
+    ConversationContextManager,
+    MessageProcessor,
+    PaymentContextProcessor,
+    ResponseValidator,
+    fallback_response,
+    history_window,
+    resolve_priority_response,
+    set_rule_registry,
+    trim_history,
+)
+from .escalation import EscalationDispatcher, make_escalation_event, make_sink
+from .housekeeping import ActivityStats, HistoryCompactor, HousekeepingScheduler, SessionExpiry, TimeSlice
+from .llm import LLMGenerator
+from .memory import ConversationMemory
+from .rules import RuleRegistry
+from .shadow import ShadowEvaluator
+from .sharding import CLUSTER_TOKEN_HEADER, DEFAULT_VNODES, HashRing
+from .snapshot import (
+    SnapshotError,
+    SnapshotRestorer,
+    build_memory,
+    checkpoint_snapshot,
+    dump_sessions,
+    iter_snapshot,
+    save_snapshot,
+)
+from .tiering import TieredSessionStore, make_cold_tier
 
 # Configuration du logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="JAK Company AI Agent API", version="14.0")
+class ReadinessState:
+    """État de préparation du service (warm-up terminé ou non)"""
+
+    def __init__(self):
+        self.ready = False
+        self.started_at = time.monotonic()
+        self.warmup_seconds: Optional[float] = None
+        self.steps: Dict[str, float] = {}
+
+readiness = ReadinessState()
+
+def warm_up():
+    """Préchauffe le service avant d'accepter du trafic"""
+    for name, step in WARMUP_STEPS:
+        step_start = time.perf_counter()
+        step()
+        readiness.steps[name] = round(time.perf_counter() - step_start, 4)
+        logger.info(f"🔥 Warm-up '{name}' terminé en {readiness.steps[name]}s")
+
+# Snapshot des sessions (chemin vide = désactivé)
+SESSION_SNAPSHOT_PATH = os.getenv("SESSION_SNAPSHOT_PATH", "sessions.snapshot")
+SNAPSHOT_RESTORE_BUDGET_SECONDS = float(os.getenv("SNAPSHOT_RESTORE_BUDGET_SECONDS", "5"))
+# Attente maximale d'un message dont la session n'est pas encore restaurée (au-delà : fusion à la restauration)
+SNAPSHOT_RESTORE_WAIT_SECONDS = float(os.getenv("SNAPSHOT_RESTORE_WAIT_SECONDS", "2"))
+
+snapshot_restorer = SnapshotRestorer()
+
+# Génération LLM pour les routes use_ai (repli sur les réponses habituelles)
+llm_generator = LLMGenerator()
+
+# Escalades livrées par lots en arrière-plan (ESCALATION_SINK : file, sqlite, http ou none).
+# Désactivé par défaut : les événements contiennent les messages des utilisateurs. Le sink fichier garde
+# au plus ESCALATION_MAX_FILES fichiers de ESCALATION_MAX_FILE_BYTES octets (disque éphémère sur Render).
+escalation_dispatcher = EscalationDispatcher(
+    make_sink(
+        os.getenv("ESCALATION_SINK", "none"),
+        path=os.getenv("ESCALATION_PATH", ""),
+        url=os.getenv("ESCALATION_URL", ""),
+        max_file_bytes=int(os.getenv("ESCALATION_MAX_FILE_BYTES", str(16 * 1024 * 1024))),
+        max_files=int(os.getenv("ESCALATION_MAX_FILES", "5"))
+    ),
+    max_queue=int(os.getenv("ESCALATION_QUEUE_SIZE", "10000")),
+    batch_size=int(os.getenv("ESCALATION_BATCH_SIZE", "50")),
+    flush_interval=float(os.getenv("ESCALATION_FLUSH_INTERVAL_SECONDS", "1")),
+    max_retries=int(os.getenv("ESCALATION_MAX_RETRIES", "5")),
+    backoff_base=float(os.getenv("ESCALATION_BACKOFF_SECONDS", "0.5"))
+)
+
+# Règles, seuils et textes (fichier JSON rechargé à chaud)
+RULES_CONFIG_PATH = os.getenv("RULES_CONFIG_PATH", os.path.join(os.path.dirname(__file__), "rules.json"))
+rule_registry = RuleRegistry(
+    RULES_CONFIG_PATH,
+    reload_interval=float(os.getenv("RULES_RELOAD_INTERVAL_SECONDS", "2"))
+)
+# Les fonctions du moteur appelées sans RuleSet explicite utilisent aussi ce registre
+set_rule_registry(rule_registry)
+
+# Évaluation shadow des règles candidates sur un échantillon du trafic (chemin vide = désactivée)
+SHADOW_RULES_PATH = os.getenv("SHADOW_RULES_PATH", "")
+shadow_evaluator = ShadowEvaluator(
+    RuleRegistry(SHADOW_RULES_PATH, reload_interval=rule_registry.reload_interval) if SHADOW_RULES_PATH else None,
+    sample_rate=float(os.getenv("SHADOW_SAMPLE_RATE", "0.1")),
+    max_queue=int(os.getenv("SHADOW_QUEUE_SIZE", "256")),
+    cpu_share=float(os.getenv("SHADOW_CPU_SHARE", "0.05")),
+    max_disagreements=int(os.getenv("SHADOW_MAX_DISAGREEMENTS", "100"))
+)
+
+# Journal binaire des décisions, lu par python -m api.decision_log (répertoire vide = désactivé)
+decision_log = DecisionLog(
+    os.getenv("DECISION_LOG_DIR", "decision_logs"),
+    max_file_bytes=int(os.getenv("DECISION_LOG_MAX_FILE_BYTES", str(64 * 1024 * 1024))),
+    max_files=int(os.getenv("DECISION_LOG_MAX_FILES", "50")),
+    flush_interval=float(os.getenv("DECISION_LOG_FLUSH_INTERVAL_SECONDS", "1")),
+    max_buffer_records=int(os.getenv("DECISION_LOG_MAX_BUFFER_RECORDS", "100000")),
+    hash_key=os.getenv("DECISION_LOG_HASH_KEY", "").encode("utf-8")
+)
+
+# Catalogue des blocs n8n, à côté de rules.json (chargé au warm-up ; fichier absent ou invalide = signalé par
+# /ready). Livré vide : les textes des blocs appartiennent à n8n, sans catalogue il envoie le texte complet.
+BLOC_CATALOG_PATH = os.getenv("BLOC_CATALOG_PATH", os.path.join(os.path.dirname(__file__), "blocs.json"))
+bloc_catalog = BlocCatalog()
+bloc_catalog_error: Optional[str] = None
+
+# Contrôle d'admission : concurrence globale, seau de jetons par wa_id, délestage
+admission_controller = AdmissionController(
+    max_concurrency=int(os.getenv("ADMISSION_MAX_CONCURRENCY", "32")),
+    max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", "64")),
+    queue_timeout=float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", "2")),
+    rate_per_minute=float(os.getenv("RATE_LIMIT_PER_WA_ID_PER_MINUTE", "20")),
+    burst=float(os.getenv("RATE_LIMIT_BURST", "5"))
+)
+
+# Échéance par requête (surchargeable par l'appelant via X-Request-Deadline-Ms, plafonnée)
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "10"))
+REQUEST_DEADLINE_MAX_SECONDS = float(os.getenv("REQUEST_DEADLINE_MAX_SECONDS", "30"))
+deadline_metrics = DeadlineMetrics(REQUEST_DEADLINE_SECONDS, REQUEST_DEADLINE_MAX_SECONDS)
+
+# Plafonds des entrées : corps de requête (octets), message et bloc n8n après nettoyage (caractères)
+MAX_REQUEST_BODY_BYTES = int(os.getenv("MAX_REQUEST_BODY_BYTES", "65536"))
+MAX_MESSAGE_CHARS = int(os.getenv("MAX_MESSAGE_CHARS", str(DEFAULT_MAX_MESSAGE_CHARS)))
+MAX_BLOC_CHARS = int(os.getenv("MAX_BLOC_CHARS", str(DEFAULT_MAX_BLOC_CHARS)))
+
+# Cache des réponses générées (LRU + TTL), désactivable par route
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_DISABLED_ROUTES = {
+    route.strip() for route in os.getenv("RESPONSE_CACHE_DISABLED_ROUTES", "").split(",") if route.strip()
+}
+response_cache = ResponseCache(
+    max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "2048")),
+    ttl_seconds=float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600"))
+)
+
+# Types de réponse quand le LLM a généré la réponse d'une route use_ai
+AI_RESPONSE_TYPES = {
+    "FOLLOW_UP_CONVERSATION": "follow_up_ai_generated",
+    "PAIEMENT_SUIVI": "paiement_suivi_ai_generated",
+    "FALLBACK_GENERAL": "ai_generated_response"
+}
+
+async def restore_sessions_snapshot():
+    """Restaure le snapshot sans bloquer la disponibilité au-delà du budget"""
+    if not SESSION_SNAPSHOT_PATH:
+        return None
+
+    restore_task = snapshot_restorer.start(memory_store, SESSION_SNAPSHOT_PATH)
+    done, _ = await asyncio.wait({restore_task}, timeout=SNAPSHOT_RESTORE_BUDGET_SECONDS)
+    if not done:
+        logger.warning(f"💾 Restauration du snapshot > {SNAPSHOT_RESTORE_BUDGET_SECONDS}s, poursuite en arrière-plan")
+    return restore_task
+
+def save_sessions_snapshot():
+    """Sauvegarde toutes les sessions lors de l'arrêt gracieux"""
+    if not SESSION_SNAPSHOT_PATH:
+        return
+    try:
+        start = time.perf_counter()
+        count = save_snapshot(memory_store, SESSION_SNAPSHOT_PATH)
+        logger.info(f"💾 Snapshot sauvegardé: {count} sessions en {time.perf_counter() - start:.3f}s")
+    except Exception as e:
+        logger.error(f"Error saving session snapshot: {str(e)}")
+
+async def run_shutdown_step(name: str, step):
+    """Exécute une étape d'arrêt ; son échec n'empêche pas les suivantes (files d'escalade, journal...)"""
+    try:
+        result = step()
+        if asyncio.iscoroutine(result):
+            await result
+    except Exception as e:
+        logger.error(f"Error during shutdown step {name}: {str(e)}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Cycle de vie de l'application : warm-up au démarrage, snapshot à l'arrêt"""
+    warm_up()
+    restore_step_start = time.perf_counter()
+    restore_task = await restore_sessions_snapshot()
+    readiness.steps["snapshot_restore"] = round(time.perf_counter() - restore_step_start, 4)
+    await llm_generator.start()
+    rule_registry.start()
+    shadow_evaluator.start()
+    escalation_dispatcher.start()
+    decision_log.start()
+    memory_store.start()
+    housekeeping.start()
+
+    readiness.ready = True
+    readiness.warmup_seconds = round(time.monotonic() - readiness.started_at, 4)
+    logger.info(f"✅ Service prêt en {readiness.warmup_seconds}s")
+    yield
+    readiness.ready = False
+
+    if restore_task and not restore_task.done():
+        # Ne pas écraser le snapshot avec une restauration partielle
+        await restore_task
+    for name, step in (
+        ("bulk_operations", bulk_operations.stop),
+        ("housekeeping", housekeeping.stop),
+        ("session_tiers", memory_store.stop),
+        ("snapshot", save_sessions_snapshot),
+        ("cold_tier", memory_store.close),
+        ("escalations", escalation_dispatcher.stop),
+        ("decision_log", decision_log.stop),
+        ("shadow", shadow_evaluator.stop),
+        ("rules", rule_registry.stop),
+        ("llm", llm_generator.close),
+    ):
+        await run_shutdown_step(name, step)
+
+app = FastAPI(title="JAK Company AI Agent API", version="14.0", lifespan=lifespan)
 
 # Configuration CORS pour permettre les tests locaux
 app.add_middleware(
@@ -27,32 +264,91 @@ os.environ["OPENAI_API_KEY"] = os.getenv("OPENAI_API_KEY")
 if not os.environ.get("OPENAI_API_KEY"):
     raise ValueError("OPENAI_API_KEY is not set in environment variables")
 
-# Store pour la mémoire des conversations
-memory_store: Dict[str, ConversationBufferMemory] = {}
+# Store pour la mémoire des conversations : sessions inactives compressées dans un niveau froid
+# (SESSION_COLD_TIER : memory, file ou none) et réhydratées au message suivant
+memory_store = TieredSessionStore(
+    make_cold_tier(os.getenv("SESSION_COLD_TIER", "memory"), os.getenv("SESSION_COLD_PATH", "sessions.cold.sqlite3")),
+    idle_seconds=float(os.getenv("SESSION_IDLE_SECONDS", "1800")),
+    sweep_interval=float(os.getenv("SESSION_TIER_SWEEP_INTERVAL_SECONDS", "60")),
+    compression_level=int(os.getenv("SESSION_COLD_COMPRESSION_LEVEL", "6"))
+)
+
+# Fenêtre d'historique : budget de tokens estimés + plafond de messages
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", str(DEFAULT_HISTORY_TOKEN_BUDGET)))
+MAX_MESSAGES_PER_SESSION = int(os.getenv("MAX_MESSAGES_PER_SESSION", str(DEFAULT_MAX_MESSAGES_PER_SESSION)))
 
 class MemoryManager:
     """Gestionnaire de mémoire optimisé pour limiter la taille"""
     
     @staticmethod
-    def trim_memory(memory: ConversationBufferMemory, max_messages: int = 15):
-        """Limite la mémoire aux N derniers messages pour économiser les tokens"""
-        messages = memory.chat_memory.messages
-        
-        if len(messages) > max_messages:
-            # Garder seulement les max_messages derniers
-            memory.chat_memory.messages = messages[-max_messages:]
-            logger.info(f"Memory trimmed to {max_messages} messages")
+    def trim_memory(memory: ConversationMemory, max_messages: int = MAX_MESSAGES_PER_SESSION,
+                    max_tokens: int = HISTORY_TOKEN_BUDGET):
+        """Borne l'historique par budget de tokens et compacte les tours anciens dans un résumé"""
+        collapsed = trim_history(memory, max_messages, max_tokens)
+        if collapsed:
+            history = memory.chat_memory
+            logger.info(f"Memory trimmed to {len(history.messages)} messages (~{history.tokens} tokens), {collapsed} collapsed into summary")
     
     @staticmethod
-    def get_memory_summary(memory: ConversationBufferMemory) -> Dict[str, Any]:
-        """Retourne un résumé de la mémoire"""
-        messages = memory.chat_memory.messages
+    def get_memory_summary(memory: ConversationMemory) -> Dict[str, Any]:
+        """Retourne un résumé de la mémoire (compteurs maintenus à l'écriture)"""
+        history = memory.chat_memory
+        return {
+            "total_messages": len(history.messages),
+            "user_messages": history.user_messages,
+            "ai_messages": history.ai_messages,
+            "memory_size_chars": history.chars
+        }
+    
+    @staticmethod
+    def get_session_status(wa_id: str, memory: ConversationMemory) -> Dict[str, Any]:
+        """Résumé d'une session pour les endpoints de statut"""
         return {
-            "total_messages": len(messages),
-            "user_messages": len([m for m in messages if hasattr(m, 'type') and m.type == 'human']),
-            "ai_messages": len([m for m in messages if hasattr(m, 'type') and m.type == 'ai']),
-            "memory_size_chars": sum(len(str(m.content)) for m in messages)
+            "wa_id": wa_id,
+            **MemoryManager.get_memory_summary(memory),
+            "memory_size_bytes": memory.chat_memory.bytes,
+            "estimated_bytes": estimated_session_bytes(memory),
+            "estimated_tokens": memory.chat_memory.tokens,
+            "collapsed_messages": memory.summary["collapsed_messages"] if memory.summary else 0,
+            "last_interaction": datetime.fromtimestamp(memory.last_interaction, tz=timezone.utc).isoformat()
         }
+    
+    @staticmethod
+    def visible_history(memory: ConversationMemory) -> List[Dict[str, Any]]:
+        """Historique renvoyé au client : la fenêtre telle qu'elle sera une fois compactée"""
+        messages = memory.chat_memory.messages
+        kept = history_window(memory, MAX_MESSAGES_PER_SESSION, HISTORY_TOKEN_BUDGET)
+        return [message.to_dict() for message in messages[len(messages) - kept:]]
+
+# Maintenance en arrière-plan : expiration, compaction des historiques, agrégats d'activité, checkpoints.
+# Un intervalle à 0 désactive le job ; chaque job rend la main toutes les HOUSEKEEPING_SLICE_MS millisecondes.
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", str(30 * 86400)))
+SNAPSHOT_CHECKPOINT_INTERVAL_SECONDS = float(os.getenv("SNAPSHOT_CHECKPOINT_INTERVAL_SECONDS", "300"))
+
+housekeeping = HousekeepingScheduler(slice_seconds=float(os.getenv("HOUSEKEEPING_SLICE_MS", "5")) / 1000)
+history_compactor = HistoryCompactor(memory_store, MemoryManager.trim_memory, MAX_MESSAGES_PER_SESSION, HISTORY_TOKEN_BUDGET)
+# Sessions arrivées hors budget (snapshot, niveau froid) : compactées avant leur prochain tour
+snapshot_restorer.on_restored = history_compactor.mark
+memory_store.on_rehydrate = history_compactor.mark
+session_expiry = SessionExpiry(memory_store, SESSION_TTL_SECONDS)
+activity_stats = ActivityStats(memory_store)
+
+async def checkpoint_sessions_snapshot(time_slice: TimeSlice) -> int:
+    """Checkpoint périodique : un arrêt brutal ne perd que les échanges depuis le dernier checkpoint"""
+    if not snapshot_restorer.complete:
+        # Ne pas écraser le snapshot avec une restauration partielle
+        return 0
+    count = await checkpoint_snapshot(memory_store, SESSION_SNAPSHOT_PATH, time_slice)
+    logger.info(f"💾 Checkpoint du snapshot: {count} sessions")
+    return count
+
+housekeeping.add("history_compaction", history_compactor.run,
+                 float(os.getenv("HISTORY_COMPACTION_INTERVAL_SECONDS", "1")))
+if SESSION_TTL_SECONDS > 0:
+    housekeeping.add("session_expiry", session_expiry.run, float(os.getenv("SESSION_EXPIRY_INTERVAL_SECONDS", "300")))
+housekeeping.add("activity_stats", activity_stats.run, float(os.getenv("ACTIVITY_STATS_INTERVAL_SECONDS", "60")))
+if SESSION_SNAPSHOT_PATH:
+    housekeeping.add("snapshot_checkpoint", checkpoint_sessions_snapshot, SNAPSHOT_CHECKPOINT_INTERVAL_SECONDS)
 
 @app.post("/clear_memory/{wa_id}")
 async def clear_memory(wa_id: str):
@@ -72,7 +368,6 @@ async def clear_memory(wa_id: str):
 async def clear_all_memory():
     """Efface toute la mémoire"""
     try:
-        global memory_store
         session_count = len(memory_store)
         memory_store.clear()
         logger.info(f"All memory cleared ({session_count} sessions)")
@@ -81,33 +376,157 @@ async def clear_all_memory():
         logger.error(f"Error clearing all memory: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+MEMORY_STATUS_MAX_PAGE_SIZE = 1000
+MEMORY_STATUS_STREAM_BATCH = 500
+
 @app.get("/memory_status")
-async def memory_status():
-    """Retourne le statut de la mémoire avec optimisations"""
+async def memory_status(offset: int = 0, limit: int = 100):
+    """Retourne les agrégats mémoire (O(1)) et une page de sessions"""
     try:
+        offset = max(offset, 0)
+        limit = min(max(limit, 0), MEMORY_STATUS_MAX_PAGE_SIZE)
+        # Page prise sur les clés (actives puis froides) : seules les sessions de la page sont décodées
         sessions = {}
-        total_memory_chars = 0
-        
-        for wa_id, memory in memory_store.items():
-            memory_summary = MemoryManager.get_memory_summary(memory)
-            sessions[wa_id] = {
-                **memory_summary,
-                "last_interaction": "recent"  # Pourrait être enrichi avec timestamp
-            }
-            total_memory_chars += memory_summary["memory_size_chars"]
+        for wa_id in islice(memory_store.keys(), offset, offset + limit):
+            memory = memory_store.peek(wa_id)
+            if memory is not None:
+                sessions[wa_id] = MemoryManager.get_session_status(wa_id, memory)
+        next_offset = offset + limit if limit and offset + limit < len(memory_store) else None
         
         return {
-            "active_sessions": len(memory_store),
-            "memory_type": "ConversationBufferMemory (Optimized)",
-            "max_messages_per_session": 15,
+            **memory_store.stats.to_dict(),
+            "tiers": memory_store.tier_stats(),
+            "activity": activity_stats.snapshot,
+            "memory_type": "ConversationMemory (Optimized)",
+            "max_messages_per_session": MAX_MESSAGES_PER_SESSION,
+            "history_token_budget": HISTORY_TOKEN_BUDGET,
             "sessions": sessions,
-            "total_memory_size_chars": total_memory_chars,
-            "optimization": "Auto-trim to 15 messages"
+            "offset": offset,
+            "limit": limit,
+            "next_offset": next_offset,
+            "optimization": "Token-budget window with state summary"
         }
     except Exception as e:
         logger.error(f"Error getting memory status: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/memory_status/stream")
+async def memory_status_stream():
+    """Liste toutes les sessions en NDJSON, sans bloquer la boucle d'événements"""
+    async def generate():
+        wa_ids = list(memory_store.keys())
+        for index, wa_id in enumerate(wa_ids, start=1):
+            memory = memory_store.peek(wa_id)
+            if memory is not None:
+                yield json.dumps(MemoryManager.get_session_status(wa_id, memory), ensure_ascii=False) + "\n"
+            if index % MEMORY_STATUS_STREAM_BATCH == 0:
+                await asyncio.sleep(0)
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+# Opérations de masse : tranches de BULK_SLICE_MS millisecondes entre deux retours à la boucle
+bulk_operations = BulkOperations(
+    memory_store,
+    slice_seconds=float(os.getenv("BULK_SLICE_MS", "5")) / 1000,
+    max_jobs=int(os.getenv("BULK_MAX_JOBS", "50"))
+)
+
+def parse_session_selector(wa_ids: Any = None, prefix: Any = None, idle_seconds: Any = None) -> SessionSelector:
+    """Valide les critères de sélection (400 si invalides)"""
+    if wa_ids is not None and not isinstance(wa_ids, list):
+        raise HTTPException(status_code=400, detail="wa_ids must be a list")
+    if prefix is not None and not isinstance(prefix, str):
+        raise HTTPException(status_code=400, detail="prefix must be a string")
+    if idle_seconds is not None:
+        try:
+            idle_seconds = float(idle_seconds)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="idle_seconds must be a number")
+        if not math.isfinite(idle_seconds) or idle_seconds < 0:
+            raise HTTPException(status_code=400, detail="idle_seconds must be a positive number")
+    return SessionSelector(wa_ids, prefix, idle_seconds)
+
+def export_session(wa_id: str, memory: ConversationMemory, include_messages: bool) -> Dict[str, Any]:
+    """Session complète pour l'export (support) : statut, résumé et historique"""
+    exported = MemoryManager.get_session_status(wa_id, memory)
+    exported["summary"] = memory.summary
+    if include_messages:
+        exported["messages"] = [message.to_dict() for message in memory.chat_memory.messages]
+    return exported
+
+@app.post("/sessions/clear", status_code=202)
+async def bulk_clear_sessions(request: Request):
+    """Efface en tâche de fond les sessions sélectionnées par liste de wa_id, préfixe et/ou inactivité"""
+    body = await parse_request_body(request)
+    if not isinstance(body, dict):
+        raise HTTPException(status_code=400, detail="Body must be a JSON object")
+    selector = parse_session_selector(body.get("wa_ids"), body.get("prefix"), body.get("idle_seconds"))
+    if selector.empty:
+        # Tout effacer reste explicite : /clear_all_memory
+        raise HTTPException(status_code=400, detail="At least one of wa_ids, prefix or idle_seconds is required")
+    job = bulk_operations.submit_clear(selector, dry_run=bool(body.get("dry_run", False)))
+    logger.info(f"🧹 Job d'effacement {job.id} démarré : {selector.to_dict()}")
+    return job.to_dict()
+
+@app.get("/sessions/jobs")
+async def bulk_jobs():
+    """Jobs de masse récents (en cours et terminés)"""
+    return {
+        **bulk_operations.stats(),
+        "jobs": [job.to_dict() for job in reversed(bulk_operations.jobs.values())]
+    }
+
+@app.get("/sessions/jobs/{job_id}")
+async def bulk_job_status(job_id: int):
+    job = bulk_operations.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"No job {job_id}")
+    return job.to_dict()
+
+@app.delete("/sessions/jobs/{job_id}")
+async def bulk_job_cancel(job_id: int):
+    """Annule un job en cours (les sessions déjà effacées le restent)"""
+    job = bulk_operations.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"No job {job_id}")
+    if job.task is not None and not job.done:
+        await asyncio.gather(job.task, return_exceptions=True)
+    return job.to_dict()
+
+@app.get("/sessions/export")
+async def export_sessions(wa_id: Optional[List[str]] = Query(None), prefix: Optional[str] = None,
+                          idle_seconds: Optional[float] = None, messages: bool = True):
+    """Exporte les sessions sélectionnées (toutes par défaut) en NDJSON, au rythme du client"""
+    selector = parse_session_selector(wa_id, prefix, idle_seconds)
+    lines = bulk_operations.export(selector, lambda key, memory: export_session(key, memory, messages))
+    return StreamingResponse(lines, media_type="application/x-ndjson")
+
+tracemalloc_probe = TracemallocProbe(frames=int(os.getenv("TRACEMALLOC_FRAMES", "1")))
+if os.getenv("TRACEMALLOC_ENABLED", "").lower() in ("1", "true", "yes"):
+    tracemalloc_probe.start()
+
+@app.get("/memory_accounting")
+async def memory_accounting(sample: int = 200, top: int = 10):
+    """Mémoire estimée par session, taille du store et plus grosses sessions"""
+    try:
+        report = store_report(memory_store, sample_size=min(max(sample, 0), 5000), top=min(max(top, 0), 100))
+        report["tracemalloc"] = tracemalloc_probe.report(top=top)
+        return report
+    except Exception as e:
+        logger.error(f"Error computing memory accounting: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/memory_accounting/tracemalloc/{action}")
+async def memory_accounting_tracemalloc(action: str):
+    """Active ou désactive le traçage tracemalloc à la demande"""
+    if action == "start":
+        tracemalloc_probe.start()
+    elif action == "stop":
+        tracemalloc_probe.stop()
+    else:
+        raise HTTPException(status_code=400, detail="action must be 'start' or 'stop'")
+    return {"status": "success", "tracemalloc_active": tracemalloc_probe.active}
+
 @app.get("/health")
 async def health_check():
     """Endpoint de santé pour vérifier que l'API fonctionne"""
@@ -115,9 +534,10 @@ async def health_check():
         "status": "healthy",
         "version": "14.0",
         "openai_configured": bool(os.environ.get("OPENAI_API_KEY")),
-        "active_sessions": len(memory_store),
-        "memory_type": "ConversationBufferMemory (Optimized)",
-        "memory_optimization": "Auto-trim to 15 messages",
+        "active_sessions": memory_store.stats.sessions,
+        "bloc_catalog": bloc_catalog_status(),
+        "memory_type": "ConversationMemory (Optimized)",
+        "memory_optimization": f"Token-budget window ({HISTORY_TOKEN_BUDGET} tokens, max {MAX_MESSAGES_PER_SESSION} messages) with state summary",
         "improvements": [
             "VERSION 14: FIX CRITIQUE DÉLAIS CPF - CALCUL EN JOURS RÉELS",
             "NOUVEAU: Seuil CPF correct (45 jours, pas 60)",
@@ -130,849 +550,631 @@ async def health_check():
         ]
     }
 
-class ResponseValidator:
-    """Classe pour valider et nettoyer les réponses"""
-    
-    @staticmethod
-    def clean_response(response: str) -> str:
-        """Nettoie et formate la réponse"""
-        if not response:
-            return ""
-        
-        # Supprimer les caractères de contrôle
-        response = re.sub(r'[\x00-\x1f\x7f-\x9f]', '', response)
-        
-        # Nettoyer les espaces multiples
-        response = re.sub(r'\s+', ' ', response.strip())
-        
-        return response
-    
-    @staticmethod
-    def validate_escalade_keywords(message: str) -> Optional[str]:
-        """Détecte si le message nécessite une escalade"""
-        escalade_keywords = [
-            "retard anormal", "paiement bloqué", "problème grave",
-            "urgence", "plainte", "avocat", "tribunal"
-        ]
-        
-        message_lower = message.lower()
-        for keyword in escalade_keywords:
-            if keyword in message_lower:
-                return "admin"
-        
-        return None
+@app.get("/metrics")
+async def metrics():
+    """Métriques internes du service"""
+    return {
+        "llm": {
+            "enabled": llm_generator.settings.enabled,
+            "model": llm_generator.settings.model,
+            **llm_generator.metrics.to_dict()
+        },
+        "admission": admission_controller.stats(),
+        "session_tiers": memory_store.tier_stats(),
+        "housekeeping": {
+            **housekeeping.stats(),
+            "compaction_pending": history_compactor.pending,
+            "sessions_compacted": history_compactor.compacted,
+            "sessions_expired": session_expiry.expired
+        },
+        "bulk_operations": bulk_operations.stats(),
+        "bloc_catalog": bloc_catalog_status(),
+        "rules": rule_registry.stats(),
+        "escalations": escalation_dispatcher.stats(),
+        "decision_log": decision_log.stats(),
+        "shadow": {key: value for key, value in shadow_evaluator.stats().items() if key != "transitions"},
+        "deadline": deadline_metrics.to_dict(),
+        "response_cache": {
+            "enabled": RESPONSE_CACHE_ENABLED,
+            "disabled_routes": sorted(RESPONSE_CACHE_DISABLED_ROUTES),
+            **response_cache.stats()
+        }
+    }
 
-class ConversationContextManager:
-    """Gestionnaire du contexte conversationnel amélioré"""
-    
-    @staticmethod
-    def analyze_conversation_context(user_message: str, memory: ConversationBufferMemory) -> Dict[str, Any]:
-        """Analyse le contexte de la conversation pour adapter la réponse"""
-        
-        # Récupérer l'historique
-        history = memory.chat_memory.messages
-        message_count = len(history)
-        
-        # Analyser si c'est un message de suivi
-        follow_up_indicators = [
-            "comment", "pourquoi", "vous pouvez", "tu peux", "aide", "démarrer",
-            "oui", "ok", "d'accord", "et après", "ensuite", "comment faire",
-            "vous pouvez m'aider", "tu peux m'aider", "comment ça marche",
-            "ça marche comment", "pour les contacts"
-        ]
-        
-        is_follow_up = any(indicator in user_message.lower() for indicator in follow_up_indicators)
-        
-        # Analyser le sujet précédent dans l'historique
-        previous_topic = None
-        last_bot_message = ""
-        awaiting_cpf_info = False
-        awaiting_financing_info = False
-        
-        # NOUVELLE LOGIQUE : Détection du contexte paiement formation
-        payment_context_detected = False
-        financing_question_asked = False
-        timing_question_asked = False
-        
-        # NOUVELLE LOGIQUE : Détection du contexte affiliation
-        affiliation_context_detected = False
-        awaiting_steps_info = False
-        
-        if message_count > 0:
-            # Chercher dans les derniers messages
-            for msg in reversed(history[-6:]):  # Regarder les 6 derniers messages
-                content = str(msg.content).lower()
-                
-                # DÉTECTION AMÉLIORÉE : Chercher les patterns du bloc paiement formation
-                payment_patterns = [
-                    "comment la formation a été financée",
-                    "comment la formation a-t-elle été financée",
-                    "cpf, opco, ou paiement direct",
-                    "et environ quand la formation s'est-elle terminée",
-                    "pour t'aider au mieux, peux-tu me dire comment"
-                ]
-                
-                if any(pattern in content for pattern in payment_patterns):
-                    payment_context_detected = True
-                    financing_question_asked = True
-                    last_bot_message = str(msg.content)
-                
-                if "environ quand la formation s'est terminée" in content or "environ quand la formation s'est-elle terminée" in content:
-                    payment_context_detected = True
-                    timing_question_asked = True
-                    last_bot_message = str(msg.content)
-                
-                # Détecter si on attend des infos spécifiques
-                if "comment la formation a été financée" in content:
-                    awaiting_financing_info = True
-                    last_bot_message = str(msg.content)
-                
-                if "environ quand la formation s'est terminée" in content:
-                    awaiting_financing_info = True
-                    last_bot_message = str(msg.content)
-                
-                # Détecter le contexte CPF bloqué
-                if "dossier cpf faisait partie des quelques cas bloqués" in content:
-                    awaiting_cpf_info = True
-                    last_bot_message = str(msg.content)
-                
-                # NOUVELLE DÉTECTION : Contexte affiliation
-                if "ancien apprenant" in content or "programme d'affiliation privilégié" in content:
-                    affiliation_context_detected = True
-                
-                if "tu as déjà des contacts en tête ou tu veux d'abord voir comment ça marche" in content:
-                    awaiting_steps_info = True
-                    last_bot_message = str(msg.content)
-                
-                # Détecter les sujets principaux
-                if "ambassadeur" in content or "commission" in content:
-                    previous_topic = "ambassadeur"
-                    break
-                elif "paiement" in content or "formation" in content:
-                    previous_topic = "paiement"
-                    break
-                elif "cpf" in content:
-                    previous_topic = "cpf"
-                    break
-        
+@app.get("/housekeeping")
+async def housekeeping_status():
+    """Jobs de maintenance en arrière-plan et leurs métriques"""
+    return {
+        **housekeeping.stats(),
+        "compaction_pending": history_compactor.pending,
+        "sessions_compacted": history_compactor.compacted,
+        "sessions_expired": session_expiry.expired,
+        "session_ttl_seconds": SESSION_TTL_SECONDS,
+        "activity": activity_stats.snapshot
+    }
+
+@app.post("/housekeeping/{job}/run")
+async def housekeeping_run(job: str):
+    """Exécute immédiatement un job de maintenance (par exemple un checkpoint avant déploiement)"""
+    stats = await housekeeping.run_now(job)
+    if stats is None:
+        raise HTTPException(status_code=404, detail=f"Unknown housekeeping job: {job}")
+    return {"status": "success", "job": job, **stats}
+
+@app.post("/rules/reload")
+async def reload_rules():
+    """Recharge immédiatement la configuration des règles (sans attendre la surveillance du fichier)"""
+    reloaded = await rule_registry.reload(force=True)
+    return {
+        "status": "reloaded" if reloaded else "error",
+        **rule_registry.stats()
+    }
+
+@app.post("/blocs/reload")
+async def reload_bloc_catalog():
+    """Recharge le catalogue des blocs (déploiement d'une nouvelle version côté n8n)"""
+    reloaded = await asyncio.to_thread(load_bloc_catalog)
+    return {
+        "status": "reloaded" if reloaded else "error",
+        **bloc_catalog_status()
+    }
+
+@app.get("/shadow")
+async def shadow_report():
+    """Évaluation shadow : compteurs, transitions et désaccords récents avec les règles candidates"""
+    return {
+        **shadow_evaluator.stats(),
+        "disagreements": list(shadow_evaluator.disagreements)
+    }
+
+# Mode cluster (python -m api.cluster) : numéro du worker et jeton des endpoints /_cluster/*
+CLUSTER_WORKER_ID = os.getenv("CLUSTER_WORKER_ID", "")
+CLUSTER_TOKEN = os.getenv("CLUSTER_TOKEN", "")
+
+def check_cluster_token(request: Request):
+    """Endpoints internes du cluster : inexistants (404) hors cluster ou sans le bon jeton"""
+    token = request.headers.get(CLUSTER_TOKEN_HEADER, "")
+    if not CLUSTER_TOKEN or not CLUSTER_WORKER_ID or not hmac.compare_digest(token, CLUSTER_TOKEN):
+        raise HTTPException(status_code=404, detail="Not Found")
+
+def sessions_owned_by(target: int, workers: int, vnodes: int) -> List[str]:
+    """Sessions locales qui appartiennent à un autre worker `target` sur l'anneau à `workers` workers"""
+    if target == int(CLUSTER_WORKER_ID):
+        return []
+    ring = HashRing(range(workers), vnodes)
+    return [wa_id for wa_id in list(memory_store.keys()) if ring.owner(wa_id) == target]
+
+@app.post("/_cluster/export")
+async def cluster_export(request: Request, target: int, workers: int, vnodes: int = DEFAULT_VNODES):
+    """Copie (sans les retirer) les sessions à transférer vers `target`, au format snapshot"""
+    check_cluster_token(request)
+    wa_ids = sessions_owned_by(target, workers, vnodes)
+    data, count = dump_sessions((wa_id, memory_store.peek(wa_id)) for wa_id in wa_ids if wa_id in memory_store)
+    return Response(content=data, media_type="application/octet-stream", headers={"X-Session-Count": str(count)})
+
+@app.post("/_cluster/import")
+async def cluster_import(request: Request):
+    """Ajoute des sessions transférées ; une session locale plus récente est conservée"""
+    check_cluster_token(request)
+    body = await request.body()
+    imported = kept = 0
+    try:
+        for wa_id, last_interaction, summary, messages in iter_snapshot(io.BytesIO(body)):
+            existing = memory_store.peek(wa_id)
+            if existing is not None and existing.last_interaction >= last_interaction:
+                kept += 1
+                continue
+            memory = build_memory(last_interaction, summary, messages)
+            memory_store[wa_id] = memory
+            history_compactor.mark(wa_id, memory)
+            imported += 1
+    except (OSError, EOFError, zlib.error, SnapshotError, UnicodeDecodeError, ValueError, KeyError) as e:
+        logger.error(f"Error importing cluster sessions: {str(e)}")
+        raise HTTPException(status_code=400, detail=f"Invalid session transfer: {str(e)}")
+    logger.info(f"🔀 {imported} sessions reçues ({kept} versions locales plus récentes conservées)")
+    return {"imported": imported, "kept": kept, "sessions": len(memory_store)}
+
+@app.post("/_cluster/forget")
+async def cluster_forget(request: Request, target: int, workers: int, vnodes: int = DEFAULT_VNODES):
+    """Retire les sessions transférées vers `target` (après un import réussi)"""
+    check_cluster_token(request)
+    wa_ids = sessions_owned_by(target, workers, vnodes)
+    for wa_id in wa_ids:
+        memory_store.pop(wa_id, None)
+    return {"forgotten": len(wa_ids), "sessions": len(memory_store)}
+
+@app.get("/ready")
+async def readiness_check():
+    """Endpoint de disponibilité : 503 tant que le warm-up n'est pas terminé"""
+    if not readiness.ready:
+        return JSONResponse(status_code=503, content={"status": "warming_up", "steps": readiness.steps})
+    return {
+        "status": "ready",
+        "warmup_seconds": readiness.warmup_seconds,
+        "steps": readiness.steps,
+        "snapshot": snapshot_restorer.status(),
+        "bloc_catalog": bloc_catalog_status()
+    }
+
+async def read_request_body(request: Request) -> bytes:
+    """Lit le corps de la requête en refusant (413) au-delà de MAX_REQUEST_BODY_BYTES"""
+    declared = request.headers.get("content-length", "")
+    if declared.isdigit() and int(declared) > MAX_REQUEST_BODY_BYTES:
+        raise HTTPException(status_code=413, detail=f"Request body too large (max {MAX_REQUEST_BODY_BYTES} bytes)")
+
+    chunks = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > MAX_REQUEST_BODY_BYTES:
+            raise HTTPException(status_code=413, detail=f"Request body too large (max {MAX_REQUEST_BODY_BYTES} bytes)")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+async def parse_request_body(request: Request) -> Any:
+    """Gestion robuste du parsing JSON"""
+    raw_body = await read_request_body(request)
+    try:
+        return json.loads(raw_body)
+    except json.JSONDecodeError as e:
+        logger.error(f"JSON decode error: {str(e)}, raw body: {raw_body[:500].decode('utf-8', errors='replace')}")
+        try:
+            clean_body = raw_body.decode('utf-8').strip()
+            return json.loads(clean_body)
+        except:
+            raise HTTPException(status_code=400, detail=f"Invalid JSON format: {str(e)}")
+
+def deadline_priority_result(matched_bloc_response: str, conversation_context: Dict[str, Any]) -> Dict[str, Any]:
+    """Résultat de priorité quand l'échéance tombe avant les règles : bloc n8n s'il existe, sinon repli"""
+    if matched_bloc_response and matched_bloc_response.strip():
         return {
-            "message_count": message_count,
-            "is_follow_up": is_follow_up,
-            "previous_topic": previous_topic,
-            "needs_greeting": message_count == 0,
-            "conversation_flow": "continuing" if message_count > 0 else "starting",
-            "awaiting_cpf_info": awaiting_cpf_info,
-            "awaiting_financing_info": awaiting_financing_info,
-            "last_bot_message": last_bot_message,
-            # NOUVELLES CLÉS CRITIQUES
-            "affiliation_context_detected": affiliation_context_detected,
-            "awaiting_steps_info": awaiting_steps_info,
-            "payment_context_detected": payment_context_detected,
-            "financing_question_asked": financing_question_asked,
-            "timing_question_asked": timing_question_asked
+            "use_matched_bloc": True,
+            "priority_detected": "N8N_BLOC_FALLBACK",
+            "response": matched_bloc_response,
+            "context": conversation_context
         }
+    return {
+        "use_matched_bloc": False,
+        "priority_detected": "DEADLINE_FALLBACK",
+        "response": None,
+        "context": conversation_context
+    }
 
-class PaymentContextProcessor:
-    """Processeur spécialisé pour le contexte paiement formation - VERSION V14 DÉLAIS CORRIGÉS"""
-    
-    @staticmethod
-    def extract_financing_type(message: str) -> Optional[str]:
-        """Extrait le type de financement du message - VERSION ULTRA RENFORCÉE"""
-        message_lower = message.lower()
-        
-        logger.info(f"🔍 ANALYSE FINANCEMENT: '{message}'")
-        
-        # NOUVELLE MAP ULTRA RENFORCÉE
-        financing_patterns = {
-            # CPF
-            'CPF': [
-                'cpf', 'compte personnel', 'compte personnel formation'
-            ],
-            # OPCO - PATTERNS ULTRA RENFORCÉS  
-            'OPCO': [
-                'opco', 'operateur', 'opérateur', 'opco entreprise',
-                'organisme paritaire', 'formation opco', 'financé par opco',
-                'finance par opco', 'financement opco', 'via opco',
-                'avec opco', 'par opco', 'opco formation', 'formation via opco',
-                'formation avec opco', 'formation par opco', 'grâce opco',
-                'grace opco', 'opco paie', 'opco paye', 'opco a payé',
-                'opco a paye', 'pris en charge opco', 'prise en charge opco',
-                'remboursé opco', 'rembourse opco'
-            ],
-            # FINANCEMENT DIRECT - PATTERNS ULTRA RENFORCÉS
-            'direct': [
-                'en direct', 'financé en direct', 'finance en direct',
-                'financement direct', 'direct', 'entreprise', 'particulier',
-                'patron', "j'ai financé", 'jai finance', 'j ai finance',
-                'financé moi', 'finance moi', 'payé moi', 'paye moi',
-                'moi même', 'moi meme', "j'ai payé", 'jai paye', 'j ai paye',
-                'payé par moi', 'paye par moi', 'financé par moi',
-                'finance par moi', 'sur mes fonds', 'fonds propres',
-                'personnellement', 'directement', 'par mon entreprise',
-                'par la société', 'par ma société', 'financement personnel',
-                'auto-financement', 'auto financement', 'tout seul',
-                'payé tout seul', 'paye tout seul', 'financé seul',
-                'finance seul', 'de ma poche', 'par moi même',
-                'par moi meme', 'avec mes deniers', 'société directement',
-                'entreprise directement', 'payé directement',
-                'paye directement', 'financé directement',
-                'finance directement', 'moi qui ai payé',
-                'moi qui ai paye', "c'est moi qui ai payé",
-                "c'est moi qui ai paye", 'payé de ma poche',
-                'paye de ma poche', 'sortie de ma poche',
-                'mes propres fonds', 'argent personnel', 'personnel'
-            ]
-        }
-        
-        # Recherche par patterns
-        for financing_type, patterns in financing_patterns.items():
-            for pattern in patterns:
-                if pattern in message_lower:
-                    logger.info(f"🎯 Financement détecté: '{pattern}' -> {financing_type}")
-                    return financing_type
-        
-        # DÉTECTION CONTEXTUELLE RENFORCÉE
-        logger.info("🔍 Recherche contextuelle financement...")
-        
-        # OPCO simple
-        if 'opco' in message_lower:
-            logger.info("✅ OPCO détecté par mot-clé simple")
-            return 'OPCO'
-        
-        # Financement direct contextuel
-        if any(word in message_lower for word in ['financé', 'finance', 'payé', 'paye']) and \
-           any(word in message_lower for word in ['direct', 'moi', 'personnel', 'entreprise', 'seul', 'même', 'meme', 'poche', 'propre']):
-            logger.info("✅ Financement direct détecté par contexte")
-            return 'direct'
-        
-        # Pattern "j'ai" + action
-        if any(word in message_lower for word in ["j'ai", 'jai', 'j ai']) and \
-           any(word in message_lower for word in ['payé', 'paye', 'financé', 'finance']):
-            logger.info("✅ Financement direct détecté par 'j'ai payé/financé'")
-            return 'direct'
-        
-        logger.warning(f"❌ Aucun financement détecté dans: '{message}'")
+def resolve_matched_bloc(bloc_id: Any, bloc_text: Any) -> Optional[Bloc]:
+    """Bloc du catalogue par id, sinon texte complet envoyé par n8n (nettoyé une fois)"""
+    if bloc_id:
+        bloc = bloc_catalog.get(str(bloc_id))
+        if bloc is not None:
+            return bloc
+        logger.warning(f"Bloc inconnu du catalogue {bloc_catalog.version}: {bloc_id}")
+
+    if not bloc_text:
         return None
-    
-    @staticmethod
-    def extract_time_delay(message: str) -> Optional[int]:
-        """Extrait le délai en mois du message - VERSION ULTRA RENFORCÉE"""
-        message_lower = message.lower()
-        
-        logger.info(f"🕐 ANALYSE DÉLAI: '{message}'")
-        
-        # PATTERNS ULTRA RENFORCÉS
-        delay_patterns = [
-            # Patterns avec préfixes
-            r'(?:il y a|depuis|ça fait|ca fait)\s*(\d+)\s*mois',
-            r'(?:il y a|depuis|ça fait|ca fait)\s*(\d+)\s*semaines?',
-            r'(?:il y a|depuis|ça fait|ca fait)\s*(\d+)\s*jours?',
-            
-            # Patterns terminaison
-            r'terminé\s+il y a\s+(\d+)\s*(mois|semaines?|jours?)',
-            r'fini\s+il y a\s+(\d+)\s*(mois|semaines?|jours?)',
-            
-            # Patterns avec "que"
-            r'(\d+)\s*(mois|semaines?|jours?)\s+que',
-            r'(\d+)\s*(mois|semaines?|jours?)\s*que',
-            
-            # Patterns simples
-            r'fait\s+(\d+)\s*(mois|semaines?|jours?)',
-            r'depuis\s+(\d+)\s*(mois|semaines?|jours?)',
-            
-            # NOUVEAUX PATTERNS PLUS FLEXIBLES
-            r'(\d+)\s*(mois|semaines?|jours?)$',
-            r'\b(\d+)\s*(mois|semaines?|jours?)\b',
-            r'\s+(\d+)\s*(mois|semaines?|jours?)\s',
-            
-            # PATTERNS SANS UNITÉ (assume mois par défaut)
-            r'il y a\s+(\d+)(?!\s*(?:mois|semaines?|jours?))',
-            r'ça fait\s+(\d+)(?!\s*(?:mois|semaines?|jours?))',
-            r'depuis\s+(\d+)(?!\s*(?:mois|semaines?|jours?))'
-        ]
-        
-        for pattern in delay_patterns:
-            match = re.search(pattern, message_lower)
-            if match:
-                number = int(match.group(1))
-                
-                # Déterminer l'unité
-                unit = "mois"  # défaut
-                if len(match.groups()) > 1 and match.group(2):
-                    unit = match.group(2)
-                
-                # Conversion en mois - CORRECTION CRITIQUE
-                if 'semaine' in unit:
-                    # CORRECTION: Ne pas forcer minimum 1 mois
-                    months = round(number / 4.33, 2)  # Garder les décimales
-                    logger.info(f"🕐 Délai détecté: {number} semaines = {months} mois")
-                elif 'jour' in unit:
-                    # CORRECTION: Ne pas forcer minimum 1 mois
-                    months = round(number / 30.0, 2)  # Garder les décimales  
-                    logger.info(f"🕐 Délai détecté: {number} jours = {months} mois")
-                else:
-                    months = number
-                    logger.info(f"🕐 Délai détecté: {number} mois")
-                
-                return months
-        
-        logger.warning(f"❌ Aucun délai détecté dans: '{message}'")
+    cleaned = ResponseValidator.cap_length(ResponseValidator.clean_response(bloc_text), MAX_BLOC_CHARS, "Bloc n8n")
+    return bloc_catalog.match_text(cleaned) if cleaned else None
+
+def prepare_turn(wa_id: str, user_message: str, bloc: Optional[Bloc],
+                 deadline: Optional[RequestDeadline] = None) -> Dict[str, Any]:
+    """Mémoire, contexte et règles de priorité pour un message (avant génération éventuelle)"""
+    matched_bloc_response = bloc.text if bloc is not None else ""
+
+    # Gestion de la mémoire conversation
+    if wa_id not in memory_store:
+        memory_store[wa_id] = ConversationMemory(
+            memory_key="history",
+            return_messages=True
+        )
+        snapshot_restorer.note_created(wa_id)
+
+    memory = memory_store[wa_id]
+    memory.touch()
+
+    # Règles en service pour toute la durée du tour (un rechargement n'affecte que les tours suivants)
+    rules = rule_registry.current
+
+    # Compaction laissée en attente (tour précédent, restauration, réhydratation) : appliquée avant l'analyse
+    if history_compactor.take(wa_id):
+        MemoryManager.trim_memory(memory)
+
+    # Échantillon shadow : historique copié avant l'ajout du message (il est modifié ensuite)
+    shadow_inputs = (list(memory.chat_memory.messages), memory.summary) if shadow_evaluator.sample() else None
+
+    # Analyser le contexte de conversation avec le nouveau manager
+    context_start = time.perf_counter()
+    conversation_context = ConversationContextManager.analyze_conversation_context(user_message, memory, rules)
+    context_seconds = time.perf_counter() - context_start
+
+    # Résumé mémoire pour logs
+    memory_summary = MemoryManager.get_memory_summary(memory)
+
+    logger.info(f"[{wa_id}] Conversation context: {conversation_context}")
+    logger.info(f"[{wa_id}] Memory summary: {memory_summary}")
+
+    # Ajouter le message utilisateur à la mémoire
+    memory.chat_memory.add_user_message(user_message)
+
+    # Financement et délai extraits par les règles, temps par étape : pour le journal des décisions
+    signals: Dict[str, Any] = {}
+    timings = {"context": context_seconds}
+
+    # Application des règles de priorité avec contexte (sauf si l'échéance est déjà dépassée)
+    if deadline is not None and deadline.check("context"):
+        logger.warning(f"[{wa_id}] Échéance dépassée avant les règles, réponse de repli")
+        priority_result = deadline_priority_result(matched_bloc_response, conversation_context)
+        shadow_inputs = None
+    else:
+        rules_start = time.perf_counter()
+        priority_result = MessageProcessor.detect_priority_rules(
+            user_message,
+            matched_bloc_response,
+            conversation_context,
+            bloc,
+            rules,
+            signals
+        )
+        rules_seconds = time.perf_counter() - rules_start
+        timings["rules"] = rules_seconds
+        if deadline is not None:
+            deadline.check("rules")
+
+    final_response, response_type, escalade_required = resolve_priority_response(priority_result)
+
+    # Échantillon shadow déposé à l'enregistrement du tour (abandonné si l'échéance est alors dépassée)
+    shadow_sample = None
+    if shadow_inputs is not None:
+        shadow_sample = (
+            wa_id, user_message, bloc, *shadow_inputs,
+            {
+                "priority_detected": priority_result.get("priority_detected", "NONE"),
+                "escalade_required": escalade_required,
+                "response_type": response_type,
+                "rules_version": rules.version
+            },
+            context_seconds + rules_seconds
+        )
+
+    return {
+        "wa_id": wa_id,
+        "memory": memory,
+        "user_message": user_message,
+        "conversation_context": conversation_context,
+        "memory_summary": memory_summary,
+        "priority_result": priority_result,
+        "final_response": final_response,
+        "response_type": response_type,
+        "escalade_required": escalade_required,
+        "bloc_id": bloc.bloc_id if bloc is not None else None,
+        "rules": rules,
+        "signals": signals,
+        "timings": timings,
+        "shadow_sample": shadow_sample,
+        "deadline": deadline
+    }
+
+def generation_budget(turn: Dict[str, Any]) -> Optional[float]:
+    """Temps laissé à la génération : le reste de l'échéance de la requête"""
+    deadline = turn.get("deadline")
+    return deadline.remaining() if deadline is not None else None
+
+def deadline_allows_generation(turn: Dict[str, Any]) -> bool:
+    deadline = turn.get("deadline")
+    return deadline is None or not deadline.check("generation")
+
+def check_generation_deadline(turn: Dict[str, Any]):
+    """Compte un dépassement survenu pendant la génération (le LLM a rendu la main sur timeout)"""
+    deadline = turn.get("deadline")
+    if deadline is not None:
+        deadline.check("generation")
+
+def needs_generation(turn: Dict[str, Any]) -> bool:
+    """Vrai si la réponse doit être générée par le LLM (routes use_ai)"""
+    return turn["final_response"] is None and bool(turn["priority_result"].get("use_ai")) and llm_generator.available
+
+def build_llm_messages(turn: Dict[str, Any]) -> List[Dict[str, str]]:
+    memory = turn["memory"]
+    return llm_generator.build_messages(
+        turn["rules"].template("LLM_SYSTEM_PROMPT"),
+        memory.chat_memory.messages,
+        turn["conversation_context"],
+        turn["priority_result"].get("priority_detected", "NONE"),
+        memory.summary
+    )
+
+def response_cache_key(turn: Dict[str, Any], allow_cache: bool = True):
+    """Clé de cache de la réponse générée, ou None si le cache est désactivé pour cette route"""
+    priority_detected = turn["priority_result"].get("priority_detected", "NONE")
+    if not RESPONSE_CACHE_ENABLED or not allow_cache or priority_detected in RESPONSE_CACHE_DISABLED_ROUTES:
         return None
-    
-    @staticmethod
-    def handle_cpf_delay_context(delay_months: int, user_message: str, conversation_context: Dict[str, Any]) -> Dict[str, Any]:
-        """Gère le contexte spécifique CPF avec délai"""
-        
-        if delay_months >= 2:  # CPF délai dépassé
-            # Vérifier si c'est une réponse à la question de blocage CPF
-            if conversation_context.get("awaiting_cpf_info"):
-                user_lower = user_message.lower()
-                
-                # Si l'utilisateur confirme qu'il était informé du blocage
-                if any(word in user_lower for word in ['oui', 'yes', 'informé', 'dit', 'déjà', 'je sais']):
-                    return {
-                        "use_matched_bloc": False,
-                        "priority_detected": "CPF_BLOQUE_CONFIRME",
-                        "response": """On comprend parfaitement ta frustration. Ce dossier fait partie des quelques cas (moins de 50 sur plus de 2500) bloqués depuis la réforme CPF de février 2025. Même nous n'avons pas été payés. Le blocage est purement administratif, et les délais sont impossibles à prévoir. On te tiendra informé dès qu'on a du nouveau. Inutile de relancer entre-temps 🙏
-
-Tous les éléments nécessaires ont bien été transmis à l'organisme de contrôle 📋🔍
-Mais le problème, c'est que la Caisse des Dépôts demande des documents que le centre de formation envoie sous une semaine...
-Et ensuite, ils prennent parfois jusqu'à 2 mois pour demander un nouveau document, sans donner de réponse entre-temps.
-
-✅ On accompagne au maximum le centre de formation pour que tout rentre dans l'ordre.
-⚠️ On est aussi impactés financièrement : chaque formation a un coût pour nous.
-🤞 On garde confiance et on espère une issue favorable.
-🗣️ Et surtout, on s'engage à revenir vers chaque personne concernée dès qu'on a du nouveau.""",
-                        "context": conversation_context,
-                        "escalade_type": None
-                    }
-                else:
-                    # Escalade pour vérification
-                    return {
-                        "use_matched_bloc": False,
-                        "priority_detected": "CPF_VERIFICATION_ESCALADE",
-                        "response": """Parfait, je vais faire suivre ta demande à notre équipe ! 😊
-
-🕐 Notre équipe est disponible du lundi au vendredi, de 9h à 17h. On te tiendra informé dès que possible ✅
-
-🔄 ESCALADE AGENT ADMIN""",
-                        "context": conversation_context,
-                        "escalade_type": "admin"
-                    }
-            else:
-                # Première fois qu'on détecte un délai CPF dépassé
-                return {
-                    "use_matched_bloc": False,
-                    "priority_detected": "CPF_DELAI_DEPASSE_FILTRAGE",
-                    "response": """Juste avant que je transmette ta demande 🙏
-
-Est-ce que tu as déjà été informé par l'équipe que ton dossier CPF faisait partie des quelques cas bloqués par la Caisse des Dépôts ?
-
-👉 Si oui, je te donne directement toutes les infos liées à ce blocage.
-Sinon, je fais remonter ta demande à notre équipe pour vérification ✅""",
-                    "context": conversation_context,
-                    "awaiting_cpf_info": True
-                }
-        
+    # Dernier tour de l'assistant et état résumé : une réponse n'est pas servie après une autre réplique
+    memory = turn["memory"]
+    return make_cache_key(
+        priority_detected, turn["user_message"], turn["conversation_context"], turn["rules"].version,
+        history_digest(memory.chat_memory.messages, memory.summary)
+    )
+
+def cached_generated_response(turn: Dict[str, Any]) -> Optional[str]:
+    key = turn.get("cache_key")
+    if key is None:
         return None
+    cached = response_cache.get(key)
+    turn["response_cache"] = "hit" if cached else "miss"
+    return cached
+
+def store_generated_response(turn: Dict[str, Any], generated: str):
+    if turn.get("cache_key") is not None:
+        response_cache.put(turn["cache_key"], generated)
+
+async def generate_response(turn: Dict[str, Any]):
+    """Étape de génération : cache puis LLM dans le budget de latence"""
+    cached = cached_generated_response(turn)
+    if cached:
+        accept_generated_response(turn, cached)
+        return
+
+    if not deadline_allows_generation(turn):
+        return
+
+    generation_start = time.perf_counter()
+    generated = await llm_generator.generate(build_llm_messages(turn), budget=generation_budget(turn))
+    turn["timings"]["generation"] = time.perf_counter() - generation_start
+    check_generation_deadline(turn)
+    if generated:
+        accept_generated_response(turn, generated)
+        store_generated_response(turn, generated)
+
+def accept_generated_response(turn: Dict[str, Any], generated: str):
+    turn["final_response"] = generated
+    turn["response_type"] = AI_RESPONSE_TYPES.get(turn["priority_result"].get("priority_detected"), "ai_generated_response")
+    turn["escalade_required"] = False
+
+def apply_fallback(turn: Dict[str, Any]):
+    """Si pas de réponse finale, utiliser un fallback"""
+    if turn["final_response"] is None:
+        turn["final_response"] = fallback_response(turn["conversation_context"], turn["rules"])
+        turn["response_type"] = "fallback_with_context"
+        turn["escalade_required"] = True
+
+def commit_turn(turn: Dict[str, Any]) -> Dict[str, Any]:
+    """Enregistre la réponse en mémoire et construit la réponse de l'API"""
+    memory = turn["memory"]
+    final_response = turn["final_response"]
+    priority_result = turn["priority_result"]
+    deadline = turn.get("deadline")
+
+    # Échéance dépassée : la réponse et la mémoire sont enregistrées, le travail accessoire est abandonné
+    late = deadline is not None and deadline.check("commit")
+    if turn.get("shadow_sample") is not None:
+        if late:
+            shadow_evaluator.skip()
+        else:
+            shadow_evaluator.submit(*turn["shadow_sample"])
+
+    # Compaction encore en attente (tour concurrent) : appliquée avant de modifier l'historique
+    if history_compactor.take(turn["wa_id"]):
+        MemoryManager.trim_memory(memory)
+
+    # Ajout à la mémoire seulement si on a une réponse finale
+    if final_response:
+        memory.chat_memory.add_ai_message(final_response)
+
+    # Compaction après ajout confiée à la maintenance en arrière-plan (marquage en O(1))
+    history_compactor.mark(turn["wa_id"], memory)
+
+    # Construction de la réponse finale avec contexte
+    response_data = {
+        "matched_bloc_response": final_response,
+        "memory": MemoryManager.visible_history(memory),
+        "escalade_required": turn["escalade_required"],
+        "escalade_type": priority_result.get("escalade_type", "admin"),
+        "status": turn["response_type"],
+        "priority_detected": priority_result.get("priority_detected", "NONE"),
+        "processed_message": turn["user_message"],
+        "response_length": len(final_response) if final_response else 0,
+        "session_id": turn["wa_id"],
+        "conversation_context": turn["conversation_context"],
+        "memory_summary": turn["memory_summary"]
+    }
+    if "response_cache" in turn:
+        response_data["response_cache"] = turn["response_cache"]
+    if turn.get("bloc_id"):
+        response_data["matched_bloc_id"] = turn["bloc_id"]
+        response_data["bloc_catalog_version"] = bloc_catalog.version
+
+    # Escalade déposée dans la file (livrée en arrière-plan, sans attendre)
+    if turn["escalade_required"]:
+        escalation_id = queue_escalation(
+            turn["wa_id"], response_data["escalade_type"], response_data["priority_detected"],
+            turn["response_type"], turn["user_message"], final_response
+        )
+        if escalation_id:
+            response_data["escalation_id"] = escalation_id
+    if deadline is not None and deadline.exceeded:
+        response_data["deadline_exceeded"] = deadline.exceeded_stage
+
+    # Le journal des décisions est conservé (ajout en O(1) au tampon) : il sert à diagnostiquer les dépassements
+    log_decision(turn)
+    if not late:
+        logger.info(f"[{turn['wa_id']}] Response generated: type={turn['response_type']}, escalade={turn['escalade_required']}, memory={turn['memory_summary']}")
+
+    return response_data
+
+def log_decision(turn: Dict[str, Any]):
+    """Ajoute la décision du tour au journal binaire (tampon en mémoire, écrit par lots)"""
+    deadline = turn.get("deadline")
+    decision_log.record(
+        turn["wa_id"],
+        turn["priority_result"].get("priority_detected", "NONE"),
+        turn["response_type"],
+        turn["escalade_required"],
+        turn.get("signals"),
+        {**turn.get("timings", {}), "total": deadline.elapsed() if deadline is not None else None},
+        generated=turn["response_type"] in AI_RESPONSE_TYPES.values(),
+        cache_hit=turn.get("response_cache") == "hit",
+        deadline_exceeded=deadline is not None and deadline.exceeded
+    )
+
+def log_degraded_decision(wa_id: Any, response_data: Dict[str, Any], deadline: Optional[RequestDeadline] = None):
+    """Journalise une réponse dégradée (erreur, échéance, délestage) sans tour de conversation"""
+    decision_log.record(
+        wa_id, response_data["priority_detected"], response_data["status"], response_data["escalade_required"],
+        timings={"total": deadline.elapsed() if deadline is not None else None},
+        deadline_exceeded=deadline is not None and deadline.exceeded
+    )
+
+def queue_escalation(wa_id: str, escalade_type: Optional[str], priority_detected: str,
+                     response_type: str, user_message: str, response: Optional[str]) -> Optional[str]:
+    """Dépose un événement d'escalade ; retourne son identifiant s'il a été accepté"""
+    event = make_escalation_event(wa_id, escalade_type, priority_detected, response_type, user_message, response)
+    return event["escalation_id"] if escalation_dispatcher.submit(event) else None
+
+def error_fallback_response() -> Dict[str, Any]:
+    """Réponse de fallback au lieu d'une erreur"""
+    return {
+        "matched_bloc_response": """Salut 😊
 
-class MessageProcessor:
-    """Classe principale pour traiter les messages avec contexte"""
-    
-    @staticmethod
-    def is_aggressive(message: str) -> bool:
-        """Détecte l'agressivité en évitant les faux positifs"""
-        
-        message_lower = message.lower()
-        
-        # Liste des mots agressifs avec leurs contextes d'exclusion
-        aggressive_patterns = [
-            ("merde", []),  # Pas d'exclusion
-            ("nul", ["nul part", "nulle part"]),  # Exclure "nul part"
-            ("énervez", []),
-            ("batards", []),
-            ("putain", []),
-            ("chier", [])
-        ]
-        
-        # Vérification spéciale pour "con" - doit être un mot isolé
-        if " con " in f" {message_lower} " or message_lower.startswith("con ") or message_lower.endswith(" con"):
-            # Exclure les mots contenant "con" comme "contacts", "conseil", "condition", etc.
-            exclusions = [
-                "contacts", "contact", "conseil", "conseils", "condition", "conditions",
-                "concernant", "concerne", "construction", "consultation", "considère",
-                "consommation", "consommer", "constitue", "contenu", "contexte",
-                "contrôle", "contraire", "confiance", "confirmation", "conformité"
-            ]
-            
-            # Vérifier qu'il n'y a pas ces mots dans le message
-            if not any(exclusion in message_lower for exclusion in exclusions):
-                return True
-        
-        # Vérifier les autres mots agressifs
-        for aggressive_word, exclusions in aggressive_patterns:
-            if aggressive_word in message_lower:
-                # Vérifier que ce n'est pas dans un contexte d'exclusion
-                if not any(exclusion in message_lower for exclusion in exclusions):
-                    return True
-        
-        return False
-    
-    @staticmethod
-    def detect_priority_rules(user_message: str, matched_bloc_response: str, conversation_context: Dict[str, Any]) -> Dict[str, Any]:
-        """Applique les règles de priorité avec prise en compte du contexte - VERSION V14 DÉLAIS CPF CORRIGÉS"""
-        
-        message_lower = user_message.lower()
-        
-        logger.info(f"🎯 PRIORITY DETECTION V14 DÉLAIS CPF CORRIGÉS: user_message='{user_message}', has_bloc_response={bool(matched_bloc_response)}")
-        
-        # 🎯 ÉTAPE 0.1: DÉTECTION PRIORITAIRE FINANCEMENT + DÉLAI (TOUS TYPES) - DÉLAIS CPF CORRIGÉS
-        financing_indicators = ["cpf", "opco", "direct", "financé", "finance", "financement", "payé", "paye", "entreprise", "personnel", "seul"]
-        delay_indicators = ["mois", "semaines", "jours", "il y a", "ça fait", "ca fait", "depuis", "terminé", "fini", "fait"]
-        
-        has_financing = any(word in message_lower for word in financing_indicators)
-        has_delay = any(word in message_lower for word in delay_indicators)
-        
-        if has_financing and has_delay:
-            financing_type = PaymentContextProcessor.extract_financing_type(user_message)
-            delay_months = PaymentContextProcessor.extract_time_delay(user_message)
-            
-            logger.info(f"🎯 FINANCEMENT + DÉLAI DÉTECTÉ: {financing_type} / {delay_months} mois équivalent")
-            
-            if financing_type and delay_months is not None:
-                # CPF avec délai - VERSION V14 CORRIGÉE AVEC CALCUL EN JOURS
-                if financing_type == "CPF":
-                    # CALCUL EN JOURS RÉELS, PAS EN MOIS CONVERTIS
-                    delay_days = None
-                    
-                    # Rechercher l'unité originale dans le message
-                    if 'jour' in user_message.lower():
-                        day_match = re.search(r'(\d+)\s*jours?', user_message.lower())
-                        if day_match:
-                            delay_days = int(day_match.group(1))
-                            logger.info(f"📅 CPF: {delay_days} jours détectés")
-                    elif 'semaine' in user_message.lower():
-                        week_match = re.search(r'(\d+)\s*semaines?', user_message.lower())
-                        if week_match:
-                            weeks = int(week_match.group(1))
-                            delay_days = weeks * 7
-                            logger.info(f"📅 CPF: {weeks} semaines = {delay_days} jours")
-                    else:
-                        # Si c'est en mois, convertir (delay_months vient de extract_time_delay)
-                        if delay_months:
-                            delay_days = int(delay_months * 30)
-                            logger.info(f"📅 CPF: {delay_months} mois = {delay_days} jours")
-                    
-                    # SEUIL CPF: 45 jours (délai minimum officiel)
-                    logger.info(f"🎯 CPF SEUIL CHECK: {delay_days} jours vs 45 jours")
-                    
-                    if delay_days and delay_days >= 45:
-                        # Délai dépassé → Filtrage
-                        logger.info("⚠️ CPF: Délai dépassé - Filtrage bloqué")
-                        return {
-                            "use_matched_bloc": False,
-                            "priority_detected": "CPF_DELAI_DEPASSE_FILTRAGE",
-                            "response": """Juste avant que je transmette ta demande 🙏
-
-Est-ce que tu as déjà été informé par l'équipe que ton dossier CPF faisait partie des quelques cas bloqués par la Caisse des Dépôts ?
-
-👉 Si oui, je te donne directement toutes les infos liées à ce blocage.
-Sinon, je fais remonter ta demande à notre équipe pour vérification ✅""",
-                            "context": conversation_context,
-                            "awaiting_cpf_info": True
-                        }
-                    else:
-                        # Délai normal → Rassurer
-                        logger.info("✅ CPF: Délai normal - Pas d'inquiétude")
-                        return {
-                            "use_matched_bloc": False,
-                            "priority_detected": "CPF_DELAI_NORMAL",
-                            "response": f"""Pour un financement CPF, le délai minimum est de 45 jours après réception des feuilles d'émargement signées 📅
-
-Ton dossier est encore dans les délais normaux ⏰ (tu en es à environ {delay_days or 'quelques'} jours)
-
-Si tu as des questions spécifiques sur ton dossier, je peux faire suivre à notre équipe pour vérification ✅
-
-Tu veux que je transmette ta demande ? 😊""",
-                            "context": conversation_context,
-                            "escalade_type": "admin"
-                        }
-                
-                # OPCO avec délai - CORRECTION CRITIQUE
-                elif financing_type == "OPCO":
-                    # CORRECTION: Calculer en jours réels pour OPCO aussi
-                    delay_days = None
-                    
-                    # Recalculer le délai en jours selon l'unité originale
-                    if 'jour' in user_message.lower():
-                        # Extraire directement les jours
-                        day_match = re.search(r'(\d+)\s*jours?', message_lower)
-                        if day_match:
-                            delay_days = int(day_match.group(1))
-                    elif 'semaine' in user_message.lower():
-                        # Extraire les semaines et convertir en jours
-                        week_match = re.search(r'(\d+)\s*semaines?', message_lower)
-                        if week_match:
-                            delay_days = int(week_match.group(1)) * 7
-                    else:
-                        # Pour les mois, convertir en jours
-                        delay_days = delay_months * 30
-                    
-                    # Convertir en mois pour comparaison (seuil OPCO = 2 mois = 60 jours)
-                    delay_months_real = delay_days / 30 if delay_days else delay_months
-                    
-                    logger.info(f"🕐 CALCUL OPCO: {delay_days} jours = {delay_months_real:.2f} mois (seuil: 2 mois)")
-                    
-                    if delay_months_real >= 2:  # Plus de 2 mois = escalade
-                        return {
-                            "use_matched_bloc": False,
-                            "priority_detected": "OPCO_DELAI_DEPASSE",
-                            "response": """Merci pour ta réponse 🙏
-
-Pour un financement via un OPCO, le délai moyen est de 2 mois. Certains dossiers peuvent aller jusqu'à 6 mois ⏳
-
-Mais vu que cela fait plus de 2 mois, on préfère ne pas te faire attendre plus longtemps sans retour.
-
-👉 Je vais transmettre ta demande à notre équipe pour qu'on vérifie ton dossier dès maintenant 📋
-
-🔄 ESCALADE AGENT ADMIN
-
-🕐 Notre équipe traite les demandes du lundi au vendredi, de 9h à 17h (hors pause déjeuner).
-On te tiendra informé dès qu'on a une réponse ✅""",
-                            "context": conversation_context,
-                            "escalade_type": "admin"
-                        }
-                    else:  # Délai normal (< 2 mois)
-                        return {
-                            "use_matched_bloc": False,
-                            "priority_detected": "OPCO_DELAI_NORMAL",
-                            "response": """Pour un financement OPCO, le délai moyen est de 2 mois après la fin de formation 📋
-
-Ton dossier est encore dans les délais normaux ⏰
-
-Certains dossiers peuvent prendre jusqu'à 6 mois selon l'organisme.
-
-Si tu as des questions spécifiques, je peux faire suivre à notre équipe ✅
-
-Tu veux que je transmette ta demande pour vérification ? 😊""",
-                            "context": conversation_context,
-                            "escalade_type": "admin"
-                        }
-                
-                # Financement direct avec délai - CORRECTION CRITIQUE
-                elif financing_type == "direct":
-                    # CORRECTION: Calculer en jours réels, pas en mois convertis
-                    delay_days = None
-                    
-                    # Recalculer le délai en jours selon l'unité originale
-                    if 'jour' in user_message.lower():
-                        # Extraire directement les jours
-                        day_match = re.search(r'(\d+)\s*jours?', message_lower)
-                        if day_match:
-                            delay_days = int(day_match.group(1))
-                    elif 'semaine' in user_message.lower():
-                        # Extraire les semaines et convertir en jours
-                        week_match = re.search(r'(\d+)\s*semaines?', message_lower)
-                        if week_match:
-                            delay_days = int(week_match.group(1)) * 7
-                    else:
-                        # Pour les mois, convertir en jours
-                        delay_days = delay_months * 30
-                    
-                    logger.info(f"🕐 CALCUL DIRECT: {delay_days} jours (seuil: 7 jours)")
-                    
-                    if delay_days and delay_days > 7:  # Plus de 7 jours = anormal
-                        return {
-                            "use_matched_bloc": False,
-                            "priority_detected": "DIRECT_DELAI_DEPASSE",
-                            "response": """Merci pour ta réponse 🙏
-
-Pour un financement direct, le délai normal est de 7 jours après fin de formation + réception du dossier complet 📋
-
-Vu que cela fait plus que le délai habituel, je vais faire suivre ta demande à notre équipe pour vérification immédiate.
-
-👉 Je transmets ton dossier dès maintenant 📋
-
-🔄 ESCALADE AGENT ADMIN
-
-🕐 Notre équipe traite les demandes du lundi au vendredi, de 9h à 17h (hors pause déjeuner).
-On te tiendra informé rapidement ✅""",
-                            "context": conversation_context,
-                            "escalade_type": "admin"
-                        }
-                    else:  # Délai normal (≤ 7 jours)
-                        return {
-                            "use_matched_bloc": False,
-                            "priority_detected": "DIRECT_DELAI_NORMAL",
-                            "response": """Pour un financement direct, le délai normal est de 7 jours après la fin de formation et réception du dossier complet 📋
-
-Ton dossier est encore dans les délais normaux ⏰
-
-Si tu as des questions spécifiques sur ton dossier, je peux faire suivre à notre équipe ✅
-
-Tu veux que je transmette ta demande ? 😊""",
-                            "context": conversation_context,
-                            "escalade_type": "admin"
-                        }
-        
-        # ✅ ÉTAPE 0.2: NOUVELLE - Détection des demandes d'étapes ambassadeur
-        if conversation_context.get("awaiting_steps_info") or conversation_context.get("affiliation_context_detected"):
-            how_it_works_patterns = [
-                "comment ça marche", "comment ca marche", "comment faire", "les étapes",
-                "comment démarrer", "comment commencer", "comment s'y prendre",
-                "voir comment ça marche", "voir comment ca marche", "étapes à suivre"
-            ]
-            
-            if any(pattern in message_lower for pattern in how_it_works_patterns):
-                return {
-                    "use_matched_bloc": False,
-                    "priority_detected": "AFFILIATION_STEPS_REQUEST",
-                    "response": """Parfait ! 😊
-
-Tu veux devenir ambassadeur et commencer à gagner de l'argent avec nous ? C'est super simple 👇
-
-✅ Étape 1 : Tu t'abonnes à nos réseaux
-📱 Insta : https://hi.switchy.io/InstagramWeiWei
-📱 Snap : https://hi.switchy.io/SnapChatWeiWei
-
-✅ Étape 2 : Tu créé ton code d'affiliation via le lien suivant (tout en bas) :
-🔗 https://swiy.co/jakpro
-⬆️ Retrouve plein de vidéos 📹 et de conseils sur ce lien 💡
-
-✅ Étape 3 : Tu nous envoies une liste de contacts intéressés (nom, prénom, téléphone ou email).
-➕ Si c'est une entreprise ou un pro, le SIRET est un petit bonus 😊
-🔗 Formulaire ici : https://mrqz.to/AffiliationPromotion
-
-✅ Étape 4 : Si un dossier est validé, tu touches une commission jusqu'à 60 % 💰
-Et tu peux même être payé sur ton compte perso (jusqu'à 3000 €/an et 3 virements)
-
-Tu veux qu'on t'aide à démarrer ou tu envoies ta première liste ? 📝""",
-                    "context": conversation_context,
-                    "escalade_type": None
-                }
-        
-        # ✅ ÉTAPE 1: PRIORITÉ ABSOLUE - Contexte paiement formation
-        if conversation_context.get("payment_context_detected"):
-            logger.info("🎯 CONTEXTE PAIEMENT DÉTECTÉ - Analyse des réponses contextuelles")
-            
-            # Extraire le type de financement et délai
-            financing_type = PaymentContextProcessor.extract_financing_type(user_message)
-            delay_months = PaymentContextProcessor.extract_time_delay(user_message)
-            
-            # CAS 1: Réponse "CPF" seule dans le contexte paiement
-            if financing_type == "CPF" and not delay_months:
-                if conversation_context.get("financing_question_asked") and not conversation_context.get("timing_question_asked"):
-                    return {
-                        "use_matched_bloc": False,
-                        "priority_detected": "PAIEMENT_CPF_DEMANDE_TIMING",
-                        "response": "Et environ quand la formation s'est-elle terminée ? 📅",
-                        "context": conversation_context,
-                        "awaiting_financing_info": True
-                    }
-            
-            # CAS 2: Réponse avec financement + délai
-            if financing_type and delay_months:
-                if financing_type == "CPF":
-                    cpf_result = PaymentContextProcessor.handle_cpf_delay_context(
-                        delay_months, user_message, conversation_context
-                    )
-                    if cpf_result:
-                        return cpf_result
-                
-                elif financing_type == "OPCO" and delay_months >= 2:
-                    return {
-                        "use_matched_bloc": False,
-                        "priority_detected": "OPCO_DELAI_DEPASSE",
-                        "response": """Merci pour ta réponse 🙏
-
-Pour un financement via un OPCO, le délai moyen est de 2 mois. Certains dossiers peuvent aller jusqu'à 6 mois ⏳
-
-Mais vu que cela fait plus de 2 mois, on préfère ne pas te faire attendre plus longtemps sans retour.
-
-👉 Je vais transmettre ta demande à notre équipe pour qu'on vérifie ton dossier dès maintenant 📋
-
-🔄 ESCALADE AGENT ADMIN
-
-🕐 Notre équipe traite les demandes du lundi au vendredi, de 9h à 17h (hors pause déjeuner).
-On te tiendra informé dès qu'on a une réponse ✅""",
-                        "context": conversation_context,
-                        "escalade_type": "admin"
-                    }
-        
-        # ✅ ÉTAPE 2: Si n8n a matché un bloc ET qu'on n'est pas dans un contexte spécial, l'utiliser
-        if matched_bloc_response and matched_bloc_response.strip():
-            # Vérifier si c'est un vrai bloc (pas un fallback générique)
-            fallback_indicators = [
-                "je vais faire suivre ta demande à notre équipe",
-                "notre équipe est disponible du lundi au vendredi",
-                "on te tiendra informé dès que possible"
-            ]
-            
-            is_fallback = any(indicator in matched_bloc_response.lower() for indicator in fallback_indicators)
-            
-            if not is_fallback and not conversation_context.get("payment_context_detected") and not conversation_context.get("awaiting_steps_info"):
-                logger.info("✅ UTILISATION BLOC N8N - Bloc valide détecté par n8n")
-                return {
-                    "use_matched_bloc": True,
-                    "priority_detected": "N8N_BLOC_DETECTED",
-                    "response": matched_bloc_response,
-                    "context": conversation_context
-                }
-        
-        # ✅ ÉTAPE 3: Traitement des réponses aux questions spécifiques en cours
-        if conversation_context.get("awaiting_financing_info"):
-            financing_type = PaymentContextProcessor.extract_financing_type(user_message)
-            delay_months = PaymentContextProcessor.extract_time_delay(user_message)
-            
-            if financing_type == "CPF" and delay_months:
-                cpf_result = PaymentContextProcessor.handle_cpf_delay_context(
-                    delay_months, user_message, conversation_context
-                )
-                if cpf_result:
-                    return cpf_result
-            
-            elif financing_type == "OPCO" and delay_months and delay_months >= 2:
-                return {
-                    "use_matched_bloc": False,
-                    "priority_detected": "OPCO_DELAI_DEPASSE",
-                    "response": """Merci pour ta réponse 🙏
-
-Pour un financement via un OPCO, le délai moyen est de 2 mois. Certains dossiers peuvent aller jusqu'à 6 mois ⏳
-
-Mais vu que cela fait plus de 2 mois, on préfère ne pas te faire attendre plus longtemps sans retour.
-
-👉 Je vais transmettre ta demande à notre équipe pour qu'on vérifie ton dossier dès maintenant 📋
-
-🔄 ESCALADE AGENT ADMIN
-
-🕐 Notre équipe traite les demandes du lundi au vendredi, de 9h à 17h (hors pause déjeuner).
-On te tiendra informé dès qu'on a une réponse ✅""",
-                    "context": conversation_context,
-                    "escalade_type": "admin"
-                }
-            
-            elif financing_type and not delay_months:
-                return {
-                    "use_matched_bloc": False,
-                    "priority_detected": "DEMANDE_DATE_FORMATION",
-                    "response": "Et environ quand la formation s'est-elle terminée ?",
-                    "context": conversation_context,
-                    "awaiting_financing_info": True
-                }
-        
-        # ✅ ÉTAPE 4: Traitement du contexte CPF bloqué
-        if conversation_context.get("awaiting_cpf_info"):
-            return PaymentContextProcessor.handle_cpf_delay_context(0, user_message, conversation_context)
-        
-        # ✅ ÉTAPE 5: Agressivité (priorité haute pour couper court)
-        if MessageProcessor.is_aggressive(user_message):
-            return {
-                "use_matched_bloc": False,
-                "priority_detected": "AGRESSIVITE",
-                "response": "Être impoli ne fera pas avancer la situation plus vite. Bien au contraire. Souhaites-tu que je te propose un poème ou une chanson d'amour pour apaiser ton cœur ? 💌",
-                "context": conversation_context
-            }
-        
-        # ✅ ÉTAPE 6: Détection problème paiement formation (si pas déjà dans le contexte)
-        if not conversation_context.get("payment_context_detected"):
-            payment_keywords = [
-                "pas été payé", "rien reçu", "virement", "attends",
-                "paiement", "argent", "retard", "promesse", "veux être payé",
-                "payé pour ma formation", "être payé pour"
-            ]
-            
-            if any(keyword in message_lower for keyword in payment_keywords):
-                # Si c'est un message de suivi sur le paiement
-                if conversation_context["message_count"] > 0 and conversation_context["is_follow_up"]:
-                    return {
-                        "use_matched_bloc": False,
-                        "priority_detected": "PAIEMENT_SUIVI",
-                        "response": None,  # Laisser l'IA gérer avec contexte
-                        "context": conversation_context,
-                        "use_ai": True
-                    }
-                # Si un bloc est matché pour le paiement, l'utiliser
-                elif matched_bloc_response and ("paiement" in matched_bloc_response.lower() or "délai" in matched_bloc_response.lower()):
-                    return {
-                        "use_matched_bloc": True,
-                        "priority_detected": "PAIEMENT_FORMATION_BLOC",
-                        "response": matched_bloc_response,
-                        "context": conversation_context
-                    }
-                # Sinon, fallback paiement
-                else:
-                    return {
-                        "use_matched_bloc": False,
-                        "priority_detected": "PAIEMENT_SANS_BLOC",
-                        "response": """Salut 👋
+Je rencontre un petit problème technique. Notre équipe va regarder ça et te recontacter rapidement ! 😊
+
+🕐 Horaires : Lundi-Vendredi, 9h-17h""",
+        "memory": "",
+        "escalade_required": True,
+        "escalade_type": "technique",
+        "status": "error_fallback",
+        "priority_detected": "ERROR",
+        "processed_message": "error_occurred",
+        "response_length": 150,
+        "session_id": "error_session",
+        "conversation_context": {"message_count": 0, "is_follow_up": False, "needs_greeting": True},
+        "memory_summary": {"total_messages": 0, "user_messages": 0, "ai_messages": 0, "memory_size_chars": 0}
+    }
 
-Je comprends que tu aies des questions sur le paiement 💰
+def deadline_response(wa_id: str, deadline: RequestDeadline) -> Dict[str, Any]:
+    """Réponse dégradée quand l'échéance tombe avant qu'un tour de conversation ait commencé"""
+    content = error_fallback_response()
+    content.update({
+        "status": "deadline_exceeded",
+        "deadline_exceeded": deadline.exceeded_stage,
+        "session_id": wa_id
+    })
+    log_degraded_decision(wa_id, content, deadline)
+    logger.warning(f"[{wa_id}] Échéance de {deadline.budget}s dépassée à l'étape {deadline.exceeded_stage}")
+    return content
+
+def shed_response(wa_id: str, reason: str, retry_after: float,
+                  deadline: Optional[RequestDeadline] = None) -> JSONResponse:
+    """Réponse dégradée immédiate pour une requête délestée, avec indication de réessai"""
+    content = error_fallback_response()
+    content.update({
+        "status": "shed",
+        "shed_reason": reason,
+        "retry_after_seconds": retry_after,
+        "session_id": wa_id
+    })
+    log_degraded_decision(wa_id, content, deadline)
+    logger.warning(f"[{wa_id}] Requête délestée ({reason}), réessai dans {retry_after}s")
+    return JSONResponse(content=content, headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+def wants_stream(request: Request, body: Any) -> Optional[str]:
+    """Mode streaming demandé : "sse", "ndjson" ou None"""
+    accept = request.headers.get("accept", "")
+    if "text/event-stream" in accept:
+        return "sse"
+    if "application/x-ndjson" in accept:
+        return "ndjson"
+    requested = request.query_params.get("stream")
+    if requested is None and isinstance(body, dict):
+        requested = body.get("stream")
+    if requested in (True, "true", "1", "ndjson"):
+        return "ndjson"
+    if requested == "sse":
+        return "sse"
+    return None
+
+def format_stream_event(stream_format: str, event: str, data: Dict[str, Any]) -> str:
+    payload = json.dumps(data, ensure_ascii=False, default=str)
+    if stream_format == "sse":
+        return f"event: {event}\ndata: {payload}\n\n"
+    return json.dumps({"event": event, **data}, ensure_ascii=False, default=str) + "\n"
+
+async def stream_turn(turn: Dict[str, Any], stream_format: str):
+    """Émet les métadonnées, puis les tokens, puis la réponse complète après commit en mémoire"""
+    generate = needs_generation(turn)
+    priority_result = turn["priority_result"]
+    committed = False
+    streamed_parts: List[str] = []
 
-Je vais faire suivre ta demande à notre équipe spécialisée qui te recontactera rapidement ✅
+    try:
+        yield format_stream_event(stream_format, "metadata", {
+            "priority_detected": priority_result.get("priority_detected", "NONE"),
+            "escalade_required": turn["escalade_required"] if not generate else False,
+            "escalade_type": priority_result.get("escalade_type", "admin"),
+            "status": turn["response_type"],
+            "ai_generation": generate,
+            "session_id": turn["wa_id"]
+        })
+
+        cached = cached_generated_response(turn) if generate else None
+        if generate and not cached and not deadline_allows_generation(turn):
+            generate = False
+
+        if cached:
+            accept_generated_response(turn, cached)
+            streamed_parts.append(cached)
+            yield format_stream_event(stream_format, "token", {"text": cached})
+
+        elif generate:
+            completed = False
+            generation_start = time.perf_counter()
+            # aclosing : libère le slot de concurrence même si on quitte le flux en cours de route
+            async with aclosing(llm_generator.stream(build_llm_messages(turn), budget=generation_budget(turn))) as deltas:
+                async for delta in deltas:
+                    if delta is None:
+                        break
+                    streamed_parts.append(delta)
+                    yield format_stream_event(stream_format, "token", {"text": delta})
+                else:
+                    completed = bool(streamed_parts)
+            turn["timings"]["generation"] = time.perf_counter() - generation_start
+            check_generation_deadline(turn)
+
+            if completed:
+                accept_generated_response(turn, "".join(streamed_parts).strip())
+                store_generated_response(turn, turn["final_response"])
+            elif streamed_parts:
+                # Flux interrompu : la réponse complète (événement done) remplace le texte partiel
+                turn["stream_aborted"] = True
+
+        apply_fallback(turn)
+        if not streamed_parts or turn.get("stream_aborted"):
+            yield format_stream_event(stream_format, "token", {"text": turn["final_response"]})
+
+        response_data = commit_turn(turn)
+        committed = True
+        if turn.get("stream_aborted"):
+            response_data["stream_aborted"] = True
+        yield format_stream_event(stream_format, "done", response_data)
 
-🕐 Horaires : Lundi-Vendredi, 9h-17h""",
-                        "context": conversation_context,
-                        "escalade_type": "admin"
-                    }
-        
-        # ✅ ÉTAPE 7: Messages de suivi généraux
-        if conversation_context["is_follow_up"] and conversation_context["message_count"] > 0:
-            return {
-                "use_matched_bloc": False,
-                "priority_detected": "FOLLOW_UP_CONVERSATION",
-                "response": None,  # Laisser l'IA gérer
-                "context": conversation_context,
-                "use_ai": True
-            }
-        
-        # ✅ ÉTAPE 8: Escalade automatique
-        escalade_type = ResponseValidator.validate_escalade_keywords(user_message)
-        if escalade_type:
-            return {
-                "use_matched_bloc": False,
-                "priority_detected": "ESCALADE_AUTO",
-                "escalade_type": escalade_type,
-                "response": """🔄 ESCALADE AGENT ADMIN
-
-🕐 Notre équipe traite les demandes du lundi au vendredi, de 9h à 17h (hors pause déjeuner).
-👋 On te tiendra informé dès qu'on a du nouveau ✅""",
-                "context": conversation_context
-            }
-        
-        # ✅ ÉTAPE 9: Si on arrive ici, utiliser le bloc n8n s'il existe (même si générique)
-        if matched_bloc_response and matched_bloc_response.strip():
-            logger.info("✅ UTILISATION BLOC N8N - Fallback sur bloc n8n")
-            return {
-                "use_matched_bloc": True,
-                "priority_detected": "N8N_BLOC_FALLBACK",
-                "response": matched_bloc_response,
-                "context": conversation_context
-            }
-        
-        # ✅ ÉTAPE 10: Fallback général
-        return {
-            "use_matched_bloc": False,
-            "priority_detected": "FALLBACK_GENERAL",
-            "context": conversation_context,
-            "response": None,
-            "use_ai": True
-        }
+    except Exception as e:
+        logger.error(f"Unexpected error while streaming: {str(e)}")
+        log_degraded_decision(turn["wa_id"], error_fallback_response(), turn.get("deadline"))
+        yield format_stream_event(stream_format, "error", error_fallback_response())
+
+    finally:
+        if not committed and turn["final_response"] is None:
+            # Client déconnecté en cours de flux : conserver la conversation cohérente
+            apply_fallback(turn)
+            commit_turn(turn)
 
 @app.post("/")
 async def process_message(request: Request):
     """Point d'entrée principal pour traiter les messages avec contexte - VERSION V14"""
+    deadline = RequestDeadline(
+        resolve_budget(request.headers.get(DEADLINE_HEADER), REQUEST_DEADLINE_SECONDS, REQUEST_DEADLINE_MAX_SECONDS),
+        deadline_metrics
+    )
+    wa_id = None
+    user_message = ""
     try:
-        # Gestion robuste du parsing JSON
-        try:
-            body = await request.json()
-        except json.JSONDecodeError as e:
-            raw_body = await request.body()
-            logger.error(f"JSON decode error: {str(e)}, raw body: {raw_body.decode('utf-8')[:500]}")
-            try:
-                clean_body = raw_body.decode('utf-8').strip()
-                body = json.loads(clean_body)
-            except:
-                raise HTTPException(status_code=400, detail=f"Invalid JSON format: {str(e)}")
+        body = await parse_request_body(request)
 
         # Logging amélioré pour debug
         logger.info(f"Received body type: {type(body)}")
@@ -982,200 +1184,67 @@ async def process_message(request: Request):
         if isinstance(body, dict):
             user_message = body.get("message_original", body.get("message", ""))
             matched_bloc_response = body.get("matched_bloc_response", "")
-            wa_id = body.get("wa_id", "default_wa_id")
+            matched_bloc_id = body.get("matched_bloc_id")
+            # Clé de session toujours textuelle (un wa_id envoyé en nombre JSON est accepté)
+            wa_id = str(body.get("wa_id", "default_wa_id"))
         else:
             user_message = str(body) if body else ""
             matched_bloc_response = ""
+            matched_bloc_id = None
             wa_id = "fallback_wa_id"
 
-        logger.info(f"[{wa_id}] Processing: message='{user_message[:50]}...', has_bloc={bool(matched_bloc_response)}")
+        logger.info(f"[{wa_id}] Processing: message='{user_message[:50]}...', has_bloc={bool(matched_bloc_response or matched_bloc_id)}")
 
         # Validation des entrées
         if not user_message or not user_message.strip():
             raise HTTPException(status_code=400, detail="Message is required")
 
-        # Nettoyage des données
-        user_message = ResponseValidator.clean_response(user_message)
-        matched_bloc_response = ResponseValidator.clean_response(matched_bloc_response)
+        if deadline.check("parse"):
+            return deadline_response(wa_id, deadline)
 
-        # Gestion de la mémoire conversation
-        if wa_id not in memory_store:
-            memory_store[wa_id] = ConversationBufferMemory(
-                memory_key="history",
-                return_messages=True
+        # Restauration du snapshot en cours : attendre (brièvement) la session plutôt que d'en ouvrir une vide
+        if snapshot_restorer.running:
+            await snapshot_restorer.wait_for(
+                memory_store, wa_id, min(SNAPSHOT_RESTORE_WAIT_SECONDS, deadline.remaining())
             )
 
-        memory = memory_store[wa_id]
-
-        # Optimiser la mémoire en limitant la taille
-        MemoryManager.trim_memory(memory, max_messages=15)
-
-        # Analyser le contexte de conversation avec le nouveau manager
-        conversation_context = ConversationContextManager.analyze_conversation_context(user_message, memory)
-
-        # Résumé mémoire pour logs
-        memory_summary = MemoryManager.get_memory_summary(memory)
-
-        logger.info(f"[{wa_id}] Conversation context: {conversation_context}")
-        logger.info(f"[{wa_id}] Memory summary: {memory_summary}")
-
-        # Ajouter le message utilisateur à la mémoire
-        memory.chat_memory.add_user_message(user_message)
-
-        # Application des règles de priorité avec contexte
-        priority_result = MessageProcessor.detect_priority_rules(
-            user_message,
-            matched_bloc_response,
-            conversation_context
-        )
-
-        # Construction de la réponse selon la priorité et le contexte
-        final_response = None
-        response_type = "unknown"
-        escalade_required = False
-
-        if priority_result.get("use_matched_bloc") and priority_result.get("response"):
-            final_response = priority_result["response"]
-            response_type = "exact_match_enforced"
-            escalade_required = False
-
-        elif priority_result.get("priority_detected") == "N8N_BLOC_DETECTED":
-            final_response = priority_result["response"]
-            response_type = "n8n_bloc_used"
-            escalade_required = False
-
-        elif priority_result.get("priority_detected") == "N8N_BLOC_FALLBACK":
-            final_response = priority_result["response"]
-            response_type = "n8n_bloc_fallback"
-            escalade_required = False
-
-        elif priority_result.get("priority_detected") == "CPF_DELAI_DEPASSE_FILTRAGE":
-            final_response = priority_result["response"]
-            response_type = "cpf_delay_filtering"
-            escalade_required = False
-
-        elif priority_result.get("priority_detected") == "CPF_DELAI_NORMAL":
-            final_response = priority_result["response"]
-            response_type = "cpf_delay_normal"
-            escalade_required = False
-
-        elif priority_result.get("priority_detected") == "OPCO_DELAI_DEPASSE":
-            final_response = priority_result["response"]
-            response_type = "opco_delay_exceeded"
-            escalade_required = True
-
-        elif priority_result.get("priority_detected") == "OPCO_DELAI_NORMAL":
-            final_response = priority_result["response"]
-            response_type = "opco_delay_normal"
-            escalade_required = False
-
-        elif priority_result.get("priority_detected") == "DIRECT_DELAI_DEPASSE":
-            final_response = priority_result["response"]
-            response_type = "direct_delay_exceeded"
-            escalade_required = True
-
-        elif priority_result.get("priority_detected") == "DIRECT_DELAI_NORMAL":
-            final_response = priority_result["response"]
-            response_type = "direct_delay_normal"
-            escalade_required = False
-
-        elif priority_result.get("priority_detected") == "AFFILIATION_STEPS_REQUEST":
-            final_response = priority_result["response"]
-            response_type = "affiliation_steps_provided"
-            escalade_required = False
-
-        elif priority_result.get("priority_detected") == "PAIEMENT_CPF_DEMANDE_TIMING":
-            final_response = priority_result["response"]
-            response_type = "cpf_timing_request"
-            escalade_required = False
-
-        elif priority_result.get("priority_detected") == "CPF_BLOQUE_CONFIRME":
-            final_response = priority_result["response"]
-            response_type = "cpf_blocked_confirmed"
-            escalade_required = False
-
-        elif priority_result.get("priority_detected") == "DEMANDE_DATE_FORMATION":
-            final_response = priority_result["response"]
-            response_type = "asking_formation_date"
-            escalade_required = False
-
-        elif priority_result.get("priority_detected") == "AGRESSIVITE":
-            final_response = priority_result["response"]
-            response_type = "agressivite_detected"
-            escalade_required = False
-
-        elif priority_result.get("priority_detected") == "FOLLOW_UP_CONVERSATION":
-            final_response = None  # Sera géré par l'IA
-            response_type = "follow_up_ai_handled"
-            escalade_required = False
-
-        elif priority_result.get("priority_detected") == "PAIEMENT_SUIVI":
-            final_response = None  # Sera géré par l'IA
-            response_type = "paiement_suivi_ai_handled"
-            escalade_required = False
-
-        elif priority_result.get("priority_detected") == "ESCALADE_AUTO":
-            final_response = priority_result["response"]
-            response_type = "auto_escalade"
-            escalade_required = True
-
-        elif priority_result.get("priority_detected") == "PAIEMENT_SANS_BLOC":
-            final_response = priority_result["response"]
-            response_type = "paiement_fallback"
-            escalade_required = True
-
-        else:
-            # Utiliser l'IA pour une réponse contextuelle ou fallback
-            final_response = None
-            response_type = "ai_contextual_response"
-            escalade_required = priority_result.get("use_ai", False)
-
-        # Si pas de réponse finale, utiliser un fallback
-        if final_response is None:
-            # Adapter le fallback selon le contexte
-            if conversation_context["needs_greeting"]:
-                final_response = """Salut 👋
-
-Je vais faire suivre ta demande à notre équipe pour qu'elle puisse t'aider au mieux 😊
-
-🕐 Notre équipe est disponible du lundi au vendredi, de 9h à 17h (hors pause déjeuner).
-On te tiendra informé dès que possible ✅
-
-En attendant, peux-tu me préciser un peu plus ce que tu recherches ?"""
-            else:
-                final_response = """Parfait, je vais faire suivre ta demande à notre équipe ! 😊
-
-🕐 Notre équipe est disponible du lundi au vendredi, de 9h à 17h.
-On te tiendra informé dès que possible ✅"""
-
-            response_type = "fallback_with_context"
-            escalade_required = True
+        # Contrôle d'admission : délester immédiatement plutôt que laisser la latence grimper
+        admission = await admission_controller.acquire(wa_id, timeout=deadline.remaining())
+        if not admission.admitted:
+            deadline.check("admission")
+            return shed_response(wa_id, admission.reason, admission.retry_after, deadline)
 
-        # Ajout à la mémoire seulement si on a une réponse finale
-        if final_response:
-            memory.chat_memory.add_ai_message(final_response)
-
-        # Optimiser la mémoire après ajout
-        MemoryManager.trim_memory(memory, max_messages=15)
-
-        # Construction de la réponse finale avec contexte
-        response_data = {
-            "matched_bloc_response": final_response,
-            "memory": memory.load_memory_variables({}).get("history", ""),
-            "escalade_required": escalade_required,
-            "escalade_type": priority_result.get("escalade_type", "admin"),
-            "status": response_type,
-            "priority_detected": priority_result.get("priority_detected", "NONE"),
-            "processed_message": user_message,
-            "response_length": len(final_response) if final_response else 0,
-            "session_id": wa_id,
-            "conversation_context": conversation_context,
-            "memory_summary": memory_summary
-        }
+        release_after_stream = False
+        try:
+            # Nettoyage des données
+            user_message = ResponseValidator.cap_length(
+                ResponseValidator.clean_response(user_message), MAX_MESSAGE_CHARS, "Message"
+            )
+            bloc = resolve_matched_bloc(matched_bloc_id, matched_bloc_response)
+
+            turn = prepare_turn(wa_id, user_message, bloc, deadline)
+            turn["cache_key"] = response_cache_key(turn, allow_cache=not (isinstance(body, dict) and body.get("cache") is False))
+
+            stream_format = wants_stream(request, body)
+            if stream_format:
+                media_type = "text/event-stream" if stream_format == "sse" else "application/x-ndjson"
+                # Le slot d'admission est libéré une fois le flux terminé (ou le client déconnecté)
+                release_after_stream = True
+                return StreamingResponse(
+                    stream_turn(turn, stream_format),
+                    media_type=media_type,
+                    background=BackgroundTask(admission_controller.release)
+                )
 
-        logger.info(f"[{wa_id}] Response generated: type={response_type}, escalade={escalade_required}, memory={memory_summary}")
+            # Routes use_ai : génération (cache puis LLM) dans le budget de latence
+            if needs_generation(turn):
+                await generate_response(turn)
 
-        return response_data
+            apply_fallback(turn)
+            return commit_turn(turn)
+        finally:
+            if not release_after_stream:
+                admission_controller.release()
 
     except HTTPException:
         # Re-raise HTTP exceptions
@@ -1186,23 +1255,69 @@ On te tiendra informé dès que possible ✅"""
         logger.error(f"Error type: {type(e)}")
 
         # Retourner une réponse de fallback au lieu d'une erreur
-        return {
-            "matched_bloc_response": """Salut 😊
+        response_data = error_fallback_response()
+        log_degraded_decision(wa_id or "unknown", response_data, deadline)
+        if wa_id:
+            escalation_id = queue_escalation(
+                str(wa_id), response_data["escalade_type"], response_data["priority_detected"],
+                response_data["status"], str(user_message), response_data["matched_bloc_response"]
+            )
+            if escalation_id:
+                response_data["escalation_id"] = escalation_id
+        return response_data
 
-Je rencontre un petit problème technique. Notre équipe va regarder ça et te recontacter rapidement ! 😊
+WARMUP_SAMPLE_MESSAGES = [
+    "cpf il y a 2 semaines",
+    "financé par opco depuis 3 mois",
+    "j'ai payé moi même il y a 10 jours",
+    "comment ça marche ?"
+]
+
+def warm_up_patterns():
+    """Compile les patterns et exécute les règles sur des messages types"""
+    PaymentContextProcessor.compiled_delay_patterns()
+    for sample in WARMUP_SAMPLE_MESSAGES:
+        context = ConversationContextManager.analyze_conversation_context(sample, ConversationMemory())
+        MessageProcessor.detect_priority_rules(sample, "", context)
+
+def load_rules():
+    """Charge et compile les règles (configuration invalide au démarrage = échec du démarrage)"""
+    rule_registry.load()
+
+def load_bloc_catalog() -> bool:
+    """Charge le catalogue des blocs n8n (texte nettoyé et caractéristiques précalculées)
+
+    En cas d'échec, le catalogue en place est conservé et l'erreur est publiée par /ready.
+    """
+    global bloc_catalog, bloc_catalog_error
+    if not BLOC_CATALOG_PATH or not os.path.exists(BLOC_CATALOG_PATH):
+        bloc_catalog_error = f"Bloc catalog not found: {BLOC_CATALOG_PATH}"
+        logger.warning(f"📚 Pas de catalogue de blocs ({BLOC_CATALOG_PATH}) : n8n doit envoyer le texte complet")
+        return False
+    try:
+        bloc_catalog = BlocCatalog.load(BLOC_CATALOG_PATH, ResponseValidator.clean_response)
+        bloc_catalog_error = None
+        logger.info(f"📚 Catalogue de blocs {bloc_catalog.version} chargé : {len(bloc_catalog)} blocs")
+        return True
+    except (OSError, ValueError, KeyError, AttributeError) as e:
+        bloc_catalog_error = f"{type(e).__name__}: {str(e)}"
+        logger.error(f"Error loading bloc catalog: {str(e)}")
+        return False
 
-🕐 Horaires : Lundi-Vendredi, 9h-17h""",
-            "memory": "",
-            "escalade_required": True,
-            "escalade_type": "technique",
-            "status": "error_fallback",
-            "priority_detected": "ERROR",
-            "processed_message": "error_occurred",
-            "response_length": 150,
-            "session_id": "error_session",
-            "conversation_context": {"message_count": 0, "is_follow_up": False, "needs_greeting": True},
-            "memory_summary": {"total_messages": 0, "user_messages": 0, "ai_messages": 0, "memory_size_chars": 0}
-        }
+def bloc_catalog_status() -> Dict[str, Any]:
+    return {
+        "path": BLOC_CATALOG_PATH,
+        "loaded": bloc_catalog_error is None and bloc_catalog.version is not None,
+        "error": bloc_catalog_error,
+        **bloc_catalog.stats()
+    }
+
+# Étapes de warm-up exécutées dans l'ordre avant de déclarer le service prêt
+WARMUP_STEPS = [
+    ("rules", load_rules),
+    ("bloc_catalog", load_bloc_catalog),
+    ("patterns", warm_up_patterns),
+]
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,230 @@
+"""Règles, seuils et textes de réponse chargés depuis un fichier de configuration
+
+Le fichier JSON (RULES_CONFIG_PATH, par défaut api/rules.json) est compilé en un
+RuleSet immuable : listes de mots-clés transformées en matchers, textes validés.
+Le RuleRegistry surveille le fichier ; à chaque modification, le nouveau RuleSet
+est construit dans un thread puis remplace l'ancien en une seule affectation.
+Une requête récupère `registry.current` une fois et garde ce RuleSet jusqu'au
+bout : elle ne voit jamais un mélange de deux versions. Une configuration
+invalide est refusée et l'ancienne reste en service.
+"""
+
+import json
+import logging
+import os
+import re
+import time
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    import asyncio
+
+logger = logging.getLogger(__name__)
+
+REQUIRED_THRESHOLDS = ("cpf_days", "opco_months", "direct_days", "cpf_blocked_months")
+
+REQUIRED_KEYWORDS = (
+    "financing_indicators", "delay_indicators", "direct_verbs", "direct_qualifiers",
+    "first_person", "first_person_verbs", "how_it_works", "payment", "escalade",
+    "follow_up", "cpf_blocked_confirmation", "aggressive_con_exclusions"
+)
+
+REQUIRED_CONTEXT_MARKERS = (
+    "payment_question", "timing_question", "awaiting_financing", "cpf_blocked_question",
+    "affiliation", "steps_question"
+)
+
+REQUIRED_TEMPLATES = (
+    "CPF_DELAI_DEPASSE_FILTRAGE", "CPF_DELAI_NORMAL", "CPF_BLOQUE_CONFIRME", "CPF_VERIFICATION_ESCALADE",
+    "OPCO_DELAI_DEPASSE", "OPCO_DELAI_NORMAL", "DIRECT_DELAI_DEPASSE", "DIRECT_DELAI_NORMAL",
+    "AFFILIATION_STEPS_REQUEST", "PAIEMENT_CPF_DEMANDE_TIMING", "DEMANDE_DATE_FORMATION", "AGRESSIVITE",
+    "PAIEMENT_SANS_BLOC", "ESCALADE_AUTO", "FALLBACK_GREETING", "FALLBACK_FOLLOW_UP", "LLM_SYSTEM_PROMPT"
+)
+
+# Paramètres fournis au rendu en plus des seuils (valeurs d'exemple pour la validation)
+TEMPLATE_SAMPLE_PARAMS = {"delay_days": 0}
+
+
+class RulesError(Exception):
+    """Configuration de règles invalide"""
+
+
+class KeywordMatcher:
+    """Recherche de sous-chaînes compilée en une alternance de littéraux (temps linéaire)"""
+
+    __slots__ = ("keywords", "_pattern")
+
+    def __init__(self, keywords: List[str]):
+        self.keywords = tuple(str(keyword).lower() for keyword in keywords if keyword)
+        # Les plus longs d'abord : le mot-clé rapporté est le plus spécifique à une position donnée
+        alternatives = sorted(set(self.keywords), key=len, reverse=True)
+        self._pattern = re.compile("|".join(map(re.escape, alternatives))) if alternatives else None
+
+    def search(self, text: str) -> Optional[str]:
+        """Premier mot-clé trouvé dans `text` (déjà en minuscules), ou None"""
+        if self._pattern is None:
+            return None
+        match = self._pattern.search(text)
+        return match.group(0) if match else None
+
+    def matches(self, text: str) -> bool:
+        return self._pattern is not None and self._pattern.search(text) is not None
+
+
+class RuleSet:
+    """Version compilée et validée d'une configuration de règles (ne change plus après construction)"""
+
+    def __init__(self, config: Dict[str, Any], source: str = "<memory>"):
+        try:
+            self.version = str(config.get("version", "unversioned"))
+            self.thresholds = {name: float(config["thresholds"][name]) for name in REQUIRED_THRESHOLDS}
+            keywords = config["keywords"]
+            markers = config["context_markers"]
+            self.templates = {name: str(config["templates"][name]) for name in REQUIRED_TEMPLATES}
+
+            self.matchers = {name: KeywordMatcher(keywords[name]) for name in REQUIRED_KEYWORDS}
+            self.matchers.update({name: KeywordMatcher(markers[name]) for name in REQUIRED_CONTEXT_MARKERS})
+            # Ordre significatif : premier type de financement / premier sujet qui correspond
+            self.financing: List[Tuple[str, KeywordMatcher]] = [
+                (financing_type, KeywordMatcher(patterns)) for financing_type, patterns in keywords["financing"].items()
+            ]
+            self.topics: List[Tuple[str, KeywordMatcher]] = [
+                (topic, KeywordMatcher(patterns)) for topic, patterns in markers["topics"]
+            ]
+            self.aggressive: List[Tuple[str, KeywordMatcher]] = [
+                (str(word).lower(), KeywordMatcher(exclusions)) for word, exclusions in keywords["aggressive"]
+            ]
+        except (KeyError, TypeError, ValueError) as e:
+            raise RulesError(f"{source}: clé manquante ou invalide ({type(e).__name__}: {e})") from e
+
+        # Chaque texte doit pouvoir être rendu avec les seuils et les paramètres connus
+        for name in self.templates:
+            try:
+                self.template(name, **TEMPLATE_SAMPLE_PARAMS)
+            except (KeyError, IndexError, ValueError) as e:
+                raise RulesError(f"{source}: texte {name} invalide ({type(e).__name__}: {e})") from e
+
+        self.source = source
+        self.loaded_at = time.time()
+
+    @classmethod
+    def from_file(cls, path: str) -> "RuleSet":
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                config = json.load(f)
+        except (OSError, ValueError) as e:
+            raise RulesError(f"{path}: lecture impossible ({type(e).__name__}: {e})") from e
+        return cls(config, path)
+
+    def threshold(self, name: str) -> float:
+        return self.thresholds[name]
+
+    def matcher(self, name: str) -> KeywordMatcher:
+        return self.matchers[name]
+
+    def template(self, name: str, **params: Any) -> str:
+        """Texte de réponse, avec les seuils ({cpf_days}, ...) et les paramètres fournis"""
+        values = {key: _format_number(value) for key, value in self.thresholds.items()}
+        values.update(params)
+        return self.templates[name].format_map(values)
+
+
+def _format_number(value: float):
+    return int(value) if float(value).is_integer() else value
+
+
+class RuleRegistry:
+    """RuleSet courant, rechargé en arrière-plan quand le fichier change"""
+
+    def __init__(self, path: str, reload_interval: float = 2.0):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._current: Optional[RuleSet] = None
+        self._signature: Optional[Tuple[int, int]] = None
+        self._task: Optional["asyncio.Task"] = None
+        self.reloads = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+
+    @property
+    def current(self) -> RuleSet:
+        if self._current is None:
+            self.load()
+        return self._current
+
+    def _file_signature(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _swap(self, ruleset: RuleSet, signature: Optional[Tuple[int, int]]):
+        # Une seule affectation : les requêtes en cours gardent leur RuleSet
+        self._current = ruleset
+        self._signature = signature
+        self.reloads += 1
+        self.last_error = None
+        logger.info(f"📐 Règles {ruleset.version} chargées depuis {ruleset.source}")
+
+    def load(self) -> RuleSet:
+        """Chargement synchrone (démarrage) ; lève RulesError si la configuration est invalide"""
+        signature = self._file_signature()
+        ruleset = RuleSet.from_file(self.path)
+        self._swap(ruleset, signature)
+        return ruleset
+
+    async def reload(self, force: bool = False) -> bool:
+        """Reconstruit le RuleSet dans un thread si le fichier a changé ; vrai si une nouvelle version est en service"""
+        signature = self._file_signature()
+        if not force and (signature is None or signature == self._signature):
+            return False
+        # Import différé : le moteur de décision (api.engine) importe ce module sans boucle asyncio
+        import asyncio
+        try:
+            ruleset = await asyncio.to_thread(RuleSet.from_file, self.path)
+        except RulesError as e:
+            self.failures += 1
+            self.last_error = str(e)
+            # On ne retente pas tant que le fichier n'a pas de nouveau changé
+            self._signature = signature
+            logger.error(f"Error reloading rules: {str(e)}")
+            return False
+        self._swap(ruleset, signature)
+        return True
+
+    async def _watch(self):
+        import asyncio
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            await self.reload()
+
+    def start(self):
+        """Démarre la surveillance du fichier (intervalle <= 0 : désactivée)"""
+        if self.reload_interval > 0 and self._task is None:
+            import asyncio
+            self._task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._task is not None:
+            import asyncio
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        ruleset = self._current
+        return {
+            "version": ruleset.version if ruleset else None,
+            "source": self.path,
+            "loaded_at": datetime.fromtimestamp(ruleset.loaded_at, timezone.utc).isoformat() if ruleset else None,
+            "watching": self._task is not None,
+            "reload_interval_seconds": self.reload_interval,
+            "reloads": self.reloads,
+            "failures": self.failures,
+            "last_error": self.last_error
+        }
@@ -0,0 +1,211 @@
+"""Évaluation shadow d'un jeu de règles candidat sur le trafic réel
+
+Une fraction échantillonnée des messages (SHADOW_SAMPLE_RATE) est rejouée, après
+la réponse, avec les règles candidates (SHADOW_RULES_PATH) : process_message
+dépose une copie des entrées (message, bloc, historique, résumé) et de la
+décision en production, sans jamais attendre. Un worker en tâche de fond évalue
+le candidat et enregistre les désaccords et les temps d'évaluation.
+
+Bornes strictes :
+- file bornée (SHADOW_QUEUE_SIZE) : au-delà, l'échantillon est abandonné et compté ;
+- part de CPU (SHADOW_CPU_SHARE) : après chaque évaluation de durée d, le worker
+  dort d × (1 - part) / part, donc il n'occupe jamais plus que cette part du temps ;
+- désaccords récents conservés en nombre limité (SHADOW_MAX_DISAGREEMENTS).
+Les logs du moteur émis pendant l'évaluation shadow sont supprimés.
+"""
+
+import asyncio
+import contextvars
+import logging
+import random
+import time
+from collections import Counter, deque
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from .blocs import Bloc
+from .engine import ConversationContextManager, MessageProcessor, resolve_priority_response
+from .rules import RuleRegistry, RulesError
+
+logger = logging.getLogger(__name__)
+
+# Vrai dans la tâche du worker shadow : ses logs du moteur ne polluent pas ceux de la production
+_in_shadow = contextvars.ContextVar("in_shadow", default=False)
+
+
+class ShadowLogFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        return not _in_shadow.get()
+
+
+def decision_key(priority_result: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Décision comparée entre production et candidat (avant génération LLM et repli)"""
+    if priority_result is None:
+        return {"priority_detected": "ERROR", "escalade_required": None, "response_type": None}
+    _, response_type, escalade_required = resolve_priority_response(priority_result)
+    return {
+        "priority_detected": priority_result.get("priority_detected", "NONE"),
+        "escalade_required": escalade_required,
+        "response_type": response_type
+    }
+
+
+class ShadowEvaluator:
+    """File bornée d'échantillons + worker d'évaluation du candidat à part de CPU limitée"""
+
+    def __init__(self, registry: Optional[RuleRegistry], sample_rate: float = 0.1, max_queue: int = 256,
+                 cpu_share: float = 0.05, max_disagreements: int = 100, latency_samples: int = 1000):
+        self.registry = registry
+        self.sample_rate = sample_rate
+        self.max_queue = max_queue
+        self.cpu_share = min(max(cpu_share, 0.001), 1.0)
+        self.disagreements: deque = deque(maxlen=max_disagreements)
+        self._latencies: deque = deque(maxlen=latency_samples)
+        self._primary_latencies: deque = deque(maxlen=latency_samples)
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.started_at: Optional[float] = None
+        self.busy_seconds = 0.0
+        self.sampled = 0
+        self.dropped = 0
+        self.skipped_late = 0
+        self.evaluated = 0
+        self.agreed = 0
+        self.disagreed = 0
+        self.candidate_errors = 0
+        self.transitions = Counter()
+        self.last_error: Optional[str] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.registry is not None and self.sample_rate > 0
+
+    def start(self):
+        if not self.enabled or self._task is not None:
+            return
+        try:
+            self.registry.load()
+        except RulesError as e:
+            self.last_error = str(e)
+            logger.error(f"Error loading shadow rules: {str(e)}")
+            return
+        logging.getLogger("api.engine").addFilter(ShadowLogFilter())
+        self.registry.start()
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self.started_at = time.monotonic()
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"👥 Shadow actif : règles {self.registry.current.version}, {self.sample_rate:.0%} du trafic")
+
+    def sample(self) -> bool:
+        """Tirage de l'échantillon (avant toute copie des entrées)"""
+        return self._queue is not None and random.random() < self.sample_rate
+
+    def submit(self, wa_id: str, user_message: str, bloc: Optional[Bloc], history: List[Any],
+               summary: Optional[Dict[str, Any]], primary: Dict[str, Any], primary_seconds: float) -> bool:
+        """Dépose un échantillon sans jamais attendre ; faux si la file est pleine"""
+        self.sampled += 1
+        try:
+            self._queue.put_nowait((wa_id, user_message, bloc, history, summary, primary, primary_seconds))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+        return True
+
+    def skip(self):
+        """Échantillon abandonné : l'échéance de la requête était dépassée à l'enregistrement du tour"""
+        self.sampled += 1
+        self.skipped_late += 1
+
+    def evaluate(self, user_message: str, bloc: Optional[Bloc], history: List[Any],
+                 summary: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        rules = self.registry.current
+        context = ConversationContextManager.analyze_history(user_message, history, summary, rules)
+        try:
+            priority_result = MessageProcessor.detect_priority_rules(
+                user_message, bloc.text if bloc is not None else "", context, bloc, rules
+            )
+            decision = decision_key(priority_result)
+        except Exception as e:
+            self.candidate_errors += 1
+            self.last_error = f"{type(e).__name__}: {str(e)}"
+            decision = decision_key(None)
+        decision["rules_version"] = rules.version
+        return decision
+
+    def record(self, wa_id: str, user_message: str, primary: Dict[str, Any], candidate: Dict[str, Any]):
+        self.evaluated += 1
+        if all(primary.get(key) == candidate.get(key) for key in ("priority_detected", "escalade_required", "response_type")):
+            self.agreed += 1
+            return
+        self.disagreed += 1
+        self.transitions[f"{primary['priority_detected']} -> {candidate['priority_detected']}"] += 1
+        self.disagreements.append({
+            "at": datetime.now(timezone.utc).isoformat(),
+            "wa_id": wa_id,
+            "message": user_message[:200],
+            "primary": primary,
+            "candidate": candidate
+        })
+
+    async def _run(self):
+        _in_shadow.set(True)
+        while True:
+            wa_id, user_message, bloc, history, summary, primary, primary_seconds = await self._queue.get()
+            start = time.perf_counter()
+            try:
+                candidate = self.evaluate(user_message, bloc, history, summary)
+                self.record(wa_id, user_message, primary, candidate)
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {str(e)}"
+                logger.error(f"Shadow evaluation failed: {self.last_error}")
+            elapsed = time.perf_counter() - start
+            self.busy_seconds += elapsed
+            self._latencies.append(elapsed)
+            self._primary_latencies.append(primary_seconds)
+            # Cycle de service : au plus cpu_share du temps passé à évaluer
+            await asyncio.sleep(elapsed * (1 - self.cpu_share) / self.cpu_share)
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self.registry.stop()
+
+    def _latency_stats(self, samples: deque) -> Dict[str, Optional[float]]:
+        if not samples:
+            return {"p50_ms": None, "p95_ms": None}
+        ordered = sorted(samples)
+        return {
+            "p50_ms": round(ordered[len(ordered) // 2] * 1000, 3),
+            "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 3)
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        uptime = time.monotonic() - self.started_at if self.started_at else 0
+        return {
+            "enabled": self.enabled and self._task is not None,
+            "candidate_version": self.registry.current.version if self._task is not None else None,
+            "sample_rate": self.sample_rate,
+            "cpu_share_limit": self.cpu_share,
+            "cpu_share_observed": round(self.busy_seconds / uptime, 4) if uptime else 0.0,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "max_queue": self.max_queue,
+            "sampled": self.sampled,
+            "dropped": self.dropped,
+            "skipped_late": self.skipped_late,
+            "evaluated": self.evaluated,
+            "agreed": self.agreed,
+            "disagreed": self.disagreed,
+            "agreement_rate": round(self.agreed / self.evaluated, 4) if self.evaluated else None,
+            "candidate_errors": self.candidate_errors,
+            "transitions": dict(self.transitions.most_common()),
+            "candidate_latency": self._latency_stats(self._latencies),
+            "primary_latency": self._latency_stats(self._primary_latencies),
+            "last_error": self.last_error
+        }
@@ -0,0 +1,44 @@
+"""Répartition des wa_id entre workers par hachage cohérent
+
+Chaque worker occupe `vnodes` points sur un anneau de hachage 64 bits ; un wa_id
+appartient au premier point qui suit son propre hash. Ajouter ou retirer un
+worker ne déplace qu'environ 1/N des sessions. Le calcul est déterministe
+(blake2b), identique dans le dispatcher et dans les workers.
+"""
+
+import hashlib
+from bisect import bisect
+from typing import Any, Iterable, List
+
+DEFAULT_VNODES = 128
+
+# En-tête d'authentification des endpoints internes /_cluster/* (jeton tiré au démarrage du cluster)
+CLUSTER_TOKEN_HEADER = "X-Cluster-Token"
+
+
+def ring_hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Anneau de hachage cohérent sur des workers numérotés"""
+
+    def __init__(self, workers: Iterable[int], vnodes: int = DEFAULT_VNODES):
+        self.workers: List[int] = sorted(set(workers))
+        if not self.workers:
+            raise ValueError("HashRing requires at least one worker")
+        self.vnodes = vnodes
+        points = sorted(
+            (ring_hash(f"worker-{worker}#{replica}"), worker)
+            for worker in self.workers
+            for replica in range(vnodes)
+        )
+        self._hashes = [point for point, _ in points]
+        self._owners = [worker for _, worker in points]
+
+    def __len__(self) -> int:
+        return len(self.workers)
+
+    def owner(self, wa_id: Any) -> int:
+        index = bisect(self._hashes, ring_hash(str(wa_id)))
+        return self._owners[index % len(self._owners)]
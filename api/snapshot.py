@@ -0,0 +1,364 @@
+"""Snapshot binaire des sessions pour survivre aux redémarrages et déploiements
+
+Format (gzip) :
+    en-tête : MAGIC (4 octets) + version (u8)
+    session : len(wa_id) u16 + wa_id utf-8 + dernière interaction f64 (v2)
+              + len(résumé JSON) u32 + résumé utf-8 (v3, 0 = aucun) + nb_messages u32
+    message : type u8 + len(contenu) u32 + contenu utf-8
+"""
+
+import asyncio
+import gzip
+import io
+import json
+import logging
+import os
+import queue
+import struct
+import time
+import zlib
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from .memory import ChatMessage, ConversationMemory, SessionStore
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"JAKS"
+FORMAT_VERSION = 3
+SUPPORTED_VERSIONS = (1, 2, 3)
+
+MESSAGE_TYPE_CODES = {"human": 0, "ai": 1}
+MESSAGE_TYPES = {code: name for name, code in MESSAGE_TYPE_CODES.items()}
+
+_HEADER = struct.Struct("<4sB")
+_SESSION = struct.Struct("<H")
+_COUNT = struct.Struct("<I")
+_TIMESTAMP = struct.Struct("<d")
+_MESSAGE = struct.Struct("<BI")
+
+
+class SnapshotError(Exception):
+    """Snapshot illisible ou incompatible"""
+
+
+def encode_session(memory: ConversationMemory) -> bytes:
+    """Session sans son wa_id : dernière interaction, résumé, messages (format v3)"""
+    messages = [m for m in memory.chat_memory.messages if m.type in MESSAGE_TYPE_CODES]
+    summary = json.dumps(memory.summary, ensure_ascii=False).encode("utf-8") if memory.summary else b""
+    parts = [
+        _TIMESTAMP.pack(memory.last_interaction),
+        _COUNT.pack(len(summary)), summary,
+        _COUNT.pack(len(messages))
+    ]
+    for message in messages:
+        content = str(message.content).encode("utf-8")
+        parts.append(_MESSAGE.pack(MESSAGE_TYPE_CODES[message.type], len(content)))
+        parts.append(content)
+    return b"".join(parts)
+
+
+def build_memory(last_interaction: float, summary: Optional[Dict[str, Any]],
+                 messages: List[ChatMessage]) -> ConversationMemory:
+    memory = ConversationMemory(memory_key="history", return_messages=True)
+    memory.chat_memory.messages = messages
+    memory.last_interaction = last_interaction
+    memory.summary = summary
+    return memory
+
+
+def decode_session(data: bytes) -> ConversationMemory:
+    """Inverse de encode_session"""
+    return build_memory(*_read_session_body(io.BytesIO(data), FORMAT_VERSION))
+
+
+def _encoded_sessions(store: SessionStore) -> Iterator[Tuple[str, bytes]]:
+    # Un store à deux niveaux fournit ses sessions froides déjà encodées, sans les reconstruire
+    encoded_items = getattr(store, "encoded_items", None)
+    if encoded_items is not None:
+        yield from encoded_items()
+        return
+    for wa_id, memory in list(store.items()):
+        yield wa_id, encode_session(memory)
+
+
+def write_sessions(out, encoded_items: Iterable[Tuple[str, bytes]]) -> int:
+    """Écrit l'en-tête puis les sessions encodées dans un flux (non compressé), retourne leur nombre"""
+    out.write(_HEADER.pack(MAGIC, FORMAT_VERSION))
+    count = 0
+    for wa_id, body in encoded_items:
+        key = wa_id.encode("utf-8")
+        out.write(_SESSION.pack(len(key)) + key + body)
+        count += 1
+    return count
+
+
+def dump_sessions(sessions: Iterable[Tuple[str, ConversationMemory]]) -> Tuple[bytes, int]:
+    """Sessions au format snapshot, en mémoire (transferts entre workers) : (octets, nombre)"""
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode="wb", compresslevel=1) as out:
+        count = write_sessions(out, ((wa_id, encode_session(memory)) for wa_id, memory in sessions))
+    return buffer.getvalue(), count
+
+
+def write_snapshot_file(path: str, encoded_items: Iterable[Tuple[str, bytes]]) -> int:
+    """Écrit des sessions encodées dans un fichier snapshot (écriture atomique), retourne leur nombre"""
+    tmp_path = f"{path}.tmp"
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    try:
+        with open(tmp_path, "wb") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=1) as out:
+                count = write_sessions(out, encoded_items)
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        # Le snapshot précédent reste intact ; pas de fichier temporaire orphelin
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return count
+
+
+def save_snapshot(store: SessionStore, path: str) -> int:
+    """Écrit toutes les sessions dans un fichier (écriture atomique), retourne le nombre de sessions"""
+    return write_snapshot_file(path, _encoded_sessions(store))
+
+
+# Fin de la file d'un checkpoint : terminé normalement, ou interrompu (le fichier n'est pas remplacé)
+_CHECKPOINT_END = object()
+_CHECKPOINT_ABORT = object()
+
+
+def _queued_sessions(items: "queue.Queue") -> Iterator[Tuple[str, bytes]]:
+    """Sessions encodées reçues de la boucle d'événements, côté thread d'écriture"""
+    while True:
+        item = items.get()
+        if item is _CHECKPOINT_END:
+            return
+        if item is _CHECKPOINT_ABORT:
+            raise SnapshotError("Checkpoint interrompu")
+        yield item
+
+
+async def checkpoint_snapshot(store: SessionStore, path: str, time_slice, queue_size: int = 256) -> int:
+    """Snapshot en cours de service : encodage par tranches (`time_slice`), écriture dans un thread
+
+    Les sessions encodées passent au thread d'écriture par une file bornée : la
+    mémoire reste bornée quel que soit le nombre de sessions. Chaque session est
+    cohérente, l'ensemble reflète le store au fil de l'encodage.
+    """
+    items: "queue.Queue" = queue.Queue(maxsize=queue_size)
+    write = asyncio.ensure_future(asyncio.to_thread(write_snapshot_file, path, _queued_sessions(items)))
+
+    async def put(item) -> bool:
+        # File pleine : attendre le thread sans bloquer la boucle (faux s'il s'est arrêté en erreur)
+        while not write.done():
+            try:
+                items.put_nowait(item)
+                return True
+            except queue.Full:
+                await time_slice.wait(asyncio.sleep(0.001))
+        return False
+
+    try:
+        for item in _encoded_sessions(store):
+            if not await put(item):
+                break
+            if time_slice.exhausted():
+                await time_slice.pause()
+        await put(_CHECKPOINT_END)
+    except BaseException:
+        # Encodage interrompu (arrêt, erreur) : le thread abandonne sans remplacer le snapshot
+        if not write.done():
+            await asyncio.to_thread(items.put, _CHECKPOINT_ABORT)
+        await asyncio.gather(write, return_exceptions=True)
+        raise
+    try:
+        return await time_slice.wait(asyncio.shield(write))
+    except asyncio.CancelledError:
+        # Arrêt pendant la fin de l'écriture : la terminer avant que le snapshot d'arrêt ne la remplace
+        await write
+        raise
+
+
+def _read_exact(stream, size: int) -> bytes:
+    data = stream.read(size)
+    if len(data) != size:
+        raise SnapshotError("Snapshot tronqué")
+    return data
+
+
+def _read_session_body(stream, version: int) -> Tuple[float, Optional[Dict[str, Any]], List[ChatMessage]]:
+    if version >= 2:
+        (last_interaction,) = _TIMESTAMP.unpack(_read_exact(stream, _TIMESTAMP.size))
+    else:
+        last_interaction = time.time()
+    summary = None
+    if version >= 3:
+        (summary_length,) = _COUNT.unpack(_read_exact(stream, _COUNT.size))
+        if summary_length:
+            summary = json.loads(_read_exact(stream, summary_length).decode("utf-8"))
+    (message_count,) = _COUNT.unpack(_read_exact(stream, _COUNT.size))
+
+    messages = []
+    for _ in range(message_count):
+        type_code, length = _MESSAGE.unpack(_read_exact(stream, _MESSAGE.size))
+        content = _read_exact(stream, length).decode("utf-8")
+        messages.append(ChatMessage(MESSAGE_TYPES[type_code], content))
+    return last_interaction, summary, messages
+
+
+def iter_snapshot(path) -> Iterator[Tuple[str, float, Optional[Dict[str, Any]], List[ChatMessage]]]:
+    """Lit le snapshot en streaming, session par session (chemin ou flux binaire)"""
+    with gzip.open(path, "rb") as stream:
+        header = stream.read(_HEADER.size)
+        if len(header) != _HEADER.size:
+            raise SnapshotError("Snapshot vide")
+        magic, version = _HEADER.unpack(header)
+        if magic != MAGIC or version not in SUPPORTED_VERSIONS:
+            raise SnapshotError(f"Format de snapshot inconnu: {magic!r} v{version}")
+
+        while True:
+            prefix = stream.read(_SESSION.size)
+            if not prefix:
+                return
+            if len(prefix) != _SESSION.size:
+                raise SnapshotError("Snapshot tronqué")
+            (key_length,) = _SESSION.unpack(prefix)
+            wa_id = _read_exact(stream, key_length).decode("utf-8")
+            yield (wa_id, *_read_session_body(stream, version))
+
+
+class SnapshotRestorer:
+    """Restaure les sessions en arrière-plan, sans perdre celles créées entre-temps
+
+    Un message reçu pendant la restauration attend (`wait_for`, durée bornée) que
+    sa session soit restaurée. Si l'attente expire, la session créée par le
+    trafic est notée (`note_created`) : la restauration y fusionne ensuite l'état
+    sauvegardé (messages plus anciens, résumé) au lieu de l'ignorer.
+    """
+
+    def __init__(self, batch_size: int = 500,
+                 on_restored: Optional[Callable[[str, ConversationMemory], Any]] = None):
+        self.batch_size = batch_size
+        # Appelé pour chaque session restaurée ou fusionnée (marquage pour la compaction en arrière-plan)
+        self.on_restored = on_restored
+        self.restored = 0
+        self.skipped = 0
+        self.merged = 0
+        self.waits = 0
+        self.wait_timeouts = 0
+        self.running = False
+        self.complete = False
+        self.error = None
+        self.duration_seconds = None
+        self._created: Set[str] = set()
+        self._progress = asyncio.Event()
+
+    def start(self, store: SessionStore, path: str) -> asyncio.Task:
+        """Lance la restauration en tâche de fond ; les messages reçus dès maintenant attendent leur session"""
+        self._begin()
+        return asyncio.create_task(self.restore(store, path))
+
+    def _begin(self):
+        self.running = True
+        self.complete = False
+        self._progress = asyncio.Event()
+
+    async def restore(self, store: SessionStore, path: str):
+        start = time.perf_counter()
+        if not self.running:
+            self._begin()
+        try:
+            if not os.path.exists(path):
+                logger.info(f"💾 Aucun snapshot à restaurer ({path})")
+                return
+
+            for index, (wa_id, last_interaction, summary, messages) in enumerate(iter_snapshot(path), start=1):
+                if wa_id in self._created:
+                    # Session ouverte par le trafic avant sa restauration : l'état sauvegardé la précède
+                    # (effacée depuis par /clear_memory : l'effacement l'emporte)
+                    memory = store.get(wa_id)
+                    if memory is not None:
+                        self._merge(memory, summary, messages)
+                        self.merged += 1
+                    else:
+                        self.skipped += 1
+                elif wa_id in store:
+                    # Session déjà présente avant la restauration (transfert entre workers)
+                    memory = None
+                    self.skipped += 1
+                else:
+                    memory = build_memory(last_interaction, summary, messages)
+                    store[wa_id] = memory
+                    self.restored += 1
+                if memory is not None and self.on_restored is not None:
+                    self.on_restored(wa_id, memory)
+
+                if index % self.batch_size == 0:
+                    # Rendre la main à la boucle d'événements (et réveiller les messages en attente)
+                    self._notify()
+                    await asyncio.sleep(0)
+
+            logger.info(f"💾 Snapshot restauré: {self.restored} sessions ({self.merged} fusionnées, {self.skipped} ignorées)")
+        except (OSError, EOFError, zlib.error, SnapshotError, UnicodeDecodeError, ValueError, KeyError) as e:
+            self.error = str(e)
+            logger.error(f"Error restoring session snapshot: {str(e)}")
+        finally:
+            self.running = False
+            self.complete = True
+            self._created.clear()
+            self._notify()
+            self.duration_seconds = round(time.perf_counter() - start, 4)
+
+    @staticmethod
+    def _merge(memory: ConversationMemory, summary: Optional[Dict[str, Any]], messages: List[ChatMessage]):
+        memory.chat_memory.messages = messages + memory.chat_memory.messages
+        if memory.summary is None:
+            memory.summary = summary
+
+    def _notify(self):
+        self._progress.set()
+        self._progress = asyncio.Event()
+
+    async def wait_for(self, store: SessionStore, wa_id: str, timeout: float) -> bool:
+        """Attend au plus `timeout` secondes que la session soit restaurée
+
+        Vrai si la session est disponible ou si la restauration est terminée
+        (session absente du snapshot) ; faux si l'attente a expiré.
+        """
+        expires_at = time.monotonic() + timeout
+        waited = False
+        while self.running and wa_id not in store:
+            remaining = expires_at - time.monotonic()
+            if remaining <= 0:
+                self.wait_timeouts += 1
+                return False
+            waited = True
+            try:
+                await asyncio.wait_for(self._progress.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                pass
+        if waited:
+            self.waits += 1
+        return True
+
+    def note_created(self, wa_id: str):
+        """Session créée par le trafic : si elle est dans le snapshot, son état y sera fusionné"""
+        if self.running:
+            self._created.add(wa_id)
+
+    def status(self) -> Dict[str, object]:
+        return {
+            "restored": self.restored,
+            "skipped": self.skipped,
+            "merged": self.merged,
+            "waits": self.waits,
+            "wait_timeouts": self.wait_timeouts,
+            "complete": self.complete,
+            "error": self.error,
+            "duration_seconds": self.duration_seconds
+        }
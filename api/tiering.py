@@ -0,0 +1,405 @@
+"""Store de sessions à deux niveaux : sessions actives en objets, sessions inactives compressées
+
+Les sessions sans interaction depuis `idle_seconds` sont encodées (format de
+session du snapshot), compressées avec zlib et déplacées dans un niveau froid :
+dictionnaire en mémoire ou fichier SQLite local. Le store garde pour chacune la
+dernière interaction et ses compteurs, si bien que les agrégats globaux (O(1))
+et `len`/`in` ne changent pas. `store[wa_id]` et `store.get` réhydratent une
+session froide de façon transparente (promotion) ; `peek` la décode sans la
+promouvoir, pour les endpoints d'administration.
+
+La rétrogradation a lieu par lots, en tâche de fond (`sweep` toutes les
+`sweep_interval` secondes), en rendant la main à la boucle entre deux lots.
+Le fichier SQLite est un espace d'échange recréé à chaque démarrage : la
+persistance entre redémarrages reste le rôle du snapshot.
+"""
+
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+import zlib
+from collections import deque
+from itertools import chain
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from .memory import ConversationMemory, SessionStore
+from .snapshot import decode_session, encode_session
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryColdTier:
+    """Sessions froides compressées gardées dans un dictionnaire"""
+
+    name = "memory"
+
+    def __init__(self):
+        self._payloads: Dict[str, bytes] = {}
+        self.payload_bytes = 0
+
+    def put_many(self, items: List[Tuple[str, bytes]]):
+        for wa_id, payload in items:
+            previous = self._payloads.get(wa_id)
+            if previous is not None:
+                self.payload_bytes -= len(previous)
+            self._payloads[wa_id] = payload
+            self.payload_bytes += len(payload)
+
+    def get(self, wa_id: str) -> bytes:
+        return self._payloads[wa_id]
+
+    def delete(self, wa_id: str):
+        payload = self._payloads.pop(wa_id, None)
+        if payload is not None:
+            self.payload_bytes -= len(payload)
+
+    def clear(self):
+        self._payloads.clear()
+        self.payload_bytes = 0
+
+    def close(self):
+        pass
+
+
+class SQLiteColdTier:
+    """Sessions froides compressées dans un fichier SQLite local (une transaction par lot)"""
+
+    name = "file"
+
+    def __init__(self, path: str):
+        self.path = path
+        self.payload_bytes = 0
+        self._sizes: Dict[str, int] = {}
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Espace d'échange : repartir d'un fichier vide à chaque démarrage
+        for suffix in ("", "-journal", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        self._connection = sqlite3.connect(path)
+        self._connection.execute("PRAGMA journal_mode=OFF")
+        self._connection.execute("PRAGMA synchronous=OFF")
+        self._connection.execute("CREATE TABLE sessions (wa_id TEXT PRIMARY KEY, payload BLOB) WITHOUT ROWID")
+
+    def put_many(self, items: List[Tuple[str, bytes]]):
+        with self._connection:
+            self._connection.executemany("INSERT OR REPLACE INTO sessions VALUES (?, ?)", items)
+        for wa_id, payload in items:
+            self.payload_bytes += len(payload) - self._sizes.get(wa_id, 0)
+            self._sizes[wa_id] = len(payload)
+
+    def get(self, wa_id: str) -> bytes:
+        row = self._connection.execute("SELECT payload FROM sessions WHERE wa_id = ?", (wa_id,)).fetchone()
+        if row is None:
+            raise KeyError(wa_id)
+        return row[0]
+
+    def delete(self, wa_id: str):
+        size = self._sizes.pop(wa_id, None)
+        if size is not None:
+            with self._connection:
+                self._connection.execute("DELETE FROM sessions WHERE wa_id = ?", (wa_id,))
+            self.payload_bytes -= size
+
+    def clear(self):
+        with self._connection:
+            self._connection.execute("DELETE FROM sessions")
+        self._sizes.clear()
+        self.payload_bytes = 0
+
+    def close(self):
+        self._connection.close()
+
+
+def make_cold_tier(kind: str, path: str = ""):
+    """Niveau froid configuré : "memory", "file" (SQLite) ou "none" (pas de niveau froid)"""
+    kind = (kind or "none").lower()
+    if kind == "memory":
+        return MemoryColdTier()
+    if kind == "file":
+        return SQLiteColdTier(path or "sessions.cold.sqlite3")
+    if kind != "none":
+        logger.warning(f"Niveau froid inconnu '{kind}', sessions gardées en mémoire")
+    return None
+
+
+class ColdSession:
+    """Ce que le store garde d'une session froide : dernière interaction et compteurs"""
+
+    __slots__ = ("last_interaction", "messages", "user_messages", "ai_messages", "chars", "bytes")
+
+    def __init__(self, last_interaction: float, counts: Tuple[int, int, int, int, int]):
+        self.last_interaction = last_interaction
+        self.messages, self.user_messages, self.ai_messages, self.chars, self.bytes = counts
+
+    def counts(self) -> Tuple[int, int, int, int, int]:
+        return self.messages, self.user_messages, self.ai_messages, self.chars, self.bytes
+
+
+class TieredSessionStore(SessionStore):
+    """SessionStore dont les sessions inactives sont compressées dans un niveau froid"""
+
+    def __init__(self, cold_tier=None, idle_seconds: float = 1800.0, sweep_interval: float = 60.0,
+                 compression_level: int = 6, batch_size: int = 100, latency_samples: int = 1000):
+        super().__init__()
+        self.cold_tier = cold_tier
+        self.idle_seconds = idle_seconds
+        self.sweep_interval = sweep_interval
+        self.compression_level = compression_level
+        self.batch_size = batch_size
+        self._cold: Dict[str, ColdSession] = {}
+        self.cold_content_bytes = 0
+        self._rehydration_latencies: deque = deque(maxlen=latency_samples)
+        self._task: Optional[asyncio.Task] = None
+        self.demotions = 0
+        self.promotions = 0
+        self.cold_errors = 0
+        self.last_sweep: Optional[Dict[str, Any]] = None
+        self.last_error: Optional[str] = None
+        # Appelé pour chaque session réhydratée (marquage pour la compaction en arrière-plan)
+        self.on_rehydrate: Optional[Callable[[str, ConversationMemory], Any]] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.cold_tier is not None
+
+    # --- Accès transparents (les deux niveaux) ---
+
+    def __len__(self) -> int:
+        return len(self._sessions) + len(self._cold)
+
+    def __contains__(self, wa_id: str) -> bool:
+        return wa_id in self._sessions or wa_id in self._cold
+
+    def __iter__(self) -> Iterator[str]:
+        return self.keys()
+
+    def __getitem__(self, wa_id: str) -> ConversationMemory:
+        memory = self._sessions.get(wa_id)
+        if memory is not None:
+            return memory
+        if wa_id in self._cold:
+            return self._promote(wa_id)
+        raise KeyError(wa_id)
+
+    def __setitem__(self, wa_id: str, memory: ConversationMemory):
+        if wa_id in self._cold:
+            self._drop_cold(wa_id)
+        # Session déjà inactive (restauration du snapshot) : directement dans le niveau froid
+        if self.enabled and memory.last_interaction < time.time() - self.idle_seconds:
+            if wa_id in self._sessions:
+                super().__delitem__(wa_id)
+            try:
+                self._demote_many([(wa_id, memory)])
+                return
+            except (OSError, sqlite3.Error, ValueError) as e:
+                self._cold_error(e)
+        super().__setitem__(wa_id, memory)
+
+    def __delitem__(self, wa_id: str):
+        if wa_id in self._cold:
+            self._drop_cold(wa_id)
+        else:
+            super().__delitem__(wa_id)
+
+    def get(self, wa_id: str, default: Optional[ConversationMemory] = None) -> Optional[ConversationMemory]:
+        if wa_id in self:
+            return self[wa_id]
+        return default
+
+    def peek(self, wa_id: str) -> Optional[ConversationMemory]:
+        memory = self._sessions.get(wa_id)
+        if memory is None and wa_id in self._cold:
+            return decode_session(zlib.decompress(self.cold_tier.get(wa_id)))
+        return memory
+
+    def last_interaction(self, wa_id: str) -> Optional[float]:
+        memory = self._sessions.get(wa_id)
+        if memory is not None:
+            return memory.last_interaction
+        entry = self._cold.get(wa_id)
+        return entry.last_interaction if entry is not None else None
+
+    def pop(self, wa_id: str, *default):
+        if wa_id in self._cold:
+            memory = self.peek(wa_id)
+            self._drop_cold(wa_id)
+            return memory
+        return super().pop(wa_id, *default)
+
+    def keys(self):
+        # Copie des clés froides : une promotion pendant l'itération ne la perturbe pas
+        return chain(self._sessions.keys(), list(self._cold))
+
+    def values(self):
+        return (memory for _, memory in self.items())
+
+    def items(self):
+        """Sessions actives puis sessions froides décodées (sans promotion)"""
+        yield from list(self._sessions.items())
+        for wa_id in list(self._cold):
+            memory = self.peek(wa_id)
+            if memory is not None:
+                yield wa_id, memory
+
+    def encoded_items(self) -> Iterator[Tuple[str, bytes]]:
+        """Sessions encodées pour le snapshot : les froides sont seulement décompressées
+
+        Les deux listes de clés sont prises ensemble : une session promue ou
+        rétrogradée pendant un parcours interrompu (checkpoint) n'est pas perdue.
+        """
+        hot = list(self._sessions.items())
+        cold = list(self._cold)
+        for wa_id, memory in hot:
+            yield wa_id, encode_session(memory)
+        for wa_id in cold:
+            if wa_id in self._cold:
+                yield wa_id, zlib.decompress(self.cold_tier.get(wa_id))
+            else:
+                # Promue depuis le début du parcours : encodée depuis le niveau actif
+                memory = self._sessions.get(wa_id)
+                if memory is not None:
+                    yield wa_id, encode_session(memory)
+
+    def clear(self):
+        super().clear()
+        self._cold.clear()
+        self.cold_content_bytes = 0
+        if self.cold_tier is not None:
+            self.cold_tier.clear()
+
+    # --- Passage d'un niveau à l'autre ---
+
+    def _demote_many(self, sessions: List[Tuple[str, ConversationMemory]]) -> int:
+        """Compresse et range des sessions (déjà retirées du niveau actif) dans le niveau froid"""
+        payloads = [
+            (wa_id, zlib.compress(encode_session(memory), self.compression_level))
+            for wa_id, memory in sessions
+        ]
+        self.cold_tier.put_many(payloads)
+        for wa_id, memory in sessions:
+            history = memory.chat_memory
+            counts = history._counts()
+            history.detach()
+            # La session reste comptée dans les agrégats globaux
+            self.stats.sessions += 1
+            self.stats.apply(1, *counts)
+            self._cold[wa_id] = ColdSession(memory.last_interaction, counts)
+            self.cold_content_bytes += counts[4]
+        self.demotions += len(sessions)
+        return len(sessions)
+
+    def _drop_cold(self, wa_id: str) -> ColdSession:
+        entry = self._cold.pop(wa_id)
+        self.stats.sessions -= 1
+        self.stats.apply(-1, *entry.counts())
+        self.cold_content_bytes -= entry.bytes
+        self.cold_tier.delete(wa_id)
+        return entry
+
+    def _promote(self, wa_id: str) -> ConversationMemory:
+        start = time.perf_counter()
+        memory = decode_session(zlib.decompress(self.cold_tier.get(wa_id)))
+        self._drop_cold(wa_id)
+        super().__setitem__(wa_id, memory)
+        self.promotions += 1
+        self._rehydration_latencies.append(time.perf_counter() - start)
+        if self.on_rehydrate is not None:
+            self.on_rehydrate(wa_id, memory)
+        return memory
+
+    def _cold_error(self, error: Exception):
+        self.cold_errors += 1
+        self.last_error = f"{type(error).__name__}: {str(error)}"
+        logger.error(f"Error demoting sessions to cold tier: {str(error)}")
+
+    def idle_sessions(self, now: Optional[float] = None) -> List[str]:
+        cutoff = (now or time.time()) - self.idle_seconds
+        return [wa_id for wa_id, memory in self._sessions.items() if memory.last_interaction < cutoff]
+
+    async def sweep(self) -> int:
+        """Rétrograde les sessions inactives par lots, en rendant la main entre deux lots"""
+        if not self.enabled:
+            return 0
+        start = time.perf_counter()
+        candidates = self.idle_sessions()
+        demoted = 0
+        for index in range(0, len(candidates), self.batch_size):
+            cutoff = time.time() - self.idle_seconds
+            batch = []
+            for wa_id in candidates[index:index + self.batch_size]:
+                memory = self._sessions.get(wa_id)
+                # Session redevenue active depuis la sélection : elle reste en mémoire
+                if memory is not None and memory.last_interaction < cutoff:
+                    del self._sessions[wa_id]
+                    batch.append((wa_id, memory))
+            if batch:
+                try:
+                    demoted += self._demote_many(batch)
+                except (OSError, sqlite3.Error, ValueError) as e:
+                    # Niveau froid indisponible : les sessions (toujours comptées) restent actives
+                    self._cold_error(e)
+                    for wa_id, memory in batch:
+                        self._sessions[wa_id] = memory
+                    break
+            await asyncio.sleep(0)
+        self.last_sweep = {
+            "demoted": demoted,
+            "candidates": len(candidates),
+            "seconds": round(time.perf_counter() - start, 4)
+        }
+        if demoted:
+            logger.info(f"🧊 {demoted} sessions inactives compressées en {self.last_sweep['seconds']}s")
+        return demoted
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            await self.sweep()
+
+    def start(self):
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"🧊 Niveau froid des sessions : {self.cold_tier.name}, inactivité {self.idle_seconds}s")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def close(self):
+        if self.cold_tier is not None:
+            self.cold_tier.close()
+
+    def tier_stats(self) -> Dict[str, Any]:
+        cold_content_bytes = self.cold_content_bytes
+        payload_bytes = self.cold_tier.payload_bytes if self.cold_tier is not None else 0
+        latencies = sorted(self._rehydration_latencies)
+        return {
+            "enabled": self.enabled,
+            "cold_tier": self.cold_tier.name if self.cold_tier is not None else None,
+            "idle_seconds": self.idle_seconds,
+            "hot_sessions": len(self._sessions),
+            "cold_sessions": len(self._cold),
+            "cold_content_bytes": cold_content_bytes,
+            "cold_payload_bytes": payload_bytes,
+            "compression_ratio": round(cold_content_bytes / payload_bytes, 2) if payload_bytes else None,
+            "demotions": self.demotions,
+            "promotions": self.promotions,
+            "rehydration_ms": {
+                "p50": round(latencies[len(latencies) // 2] * 1000, 3) if latencies else None,
+                "p95": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 3) if latencies else None,
+                "max": round(latencies[-1] * 1000, 3) if latencies else None
+            },
+            "last_sweep": self.last_sweep,
+            "cold_errors": self.cold_errors,
+            "last_error": self.last_error
+        }
@@ -0,0 +1,75 @@
+"""Benchmark du temps d'import de api.process (budget de démarrage à froid)
+
+Usage : python scripts/bench_import_time.py [--budget-ms 1000] [--runs 5] [--top 15]
+
+Lance plusieurs imports à froid dans des sous-processus avec `python -X importtime`,
+affiche les modules les plus coûteux et échoue (code 1) si la médiane dépasse le budget.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+TARGET_MODULE = "api.process"
+
+
+def measure_once(module: str):
+    """Importe le module dans un interpréteur neuf et parse la sortie -X importtime"""
+    env = dict(os.environ)
+    env.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_ROOT, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Import de {module} impossible :\n{result.stderr[-2000:]}")
+
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        # Le nom est indenté selon la profondeur d'import
+        cumulative[name[1:].rstrip()] = int(cumulative_us)
+    return cumulative
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module", default=TARGET_MODULE)
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("IMPORT_TIME_BUDGET_MS", "1000")))
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    totals = []
+    last = {}
+    for _ in range(args.runs):
+        last = measure_once(args.module)
+        totals.append(max((us for name, us in last.items() if name.strip() == args.module), default=0) / 1000)
+
+    median_ms = statistics.median(totals)
+    print(f"{args.module}: médiane {median_ms:.1f} ms sur {args.runs} runs (budget {args.budget_ms:.0f} ms)")
+    print("Imports directs les plus coûteux (cumulatif, dernier run) :")
+    target_indent = min(len(name) - len(name.lstrip()) for name in last if name.strip() == args.module)
+    children = {
+        name.strip(): us for name, us in last.items()
+        if len(name) - len(name.lstrip()) == target_indent + 2
+    }
+    for name, us in sorted(children.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f"  {us / 1000:8.1f} ms  {name}")
+
+    if median_ms > args.budget_ms:
+        print(f"❌ Budget dépassé de {median_ms - args.budget_ms:.1f} ms")
+        return 1
+    print("✅ Budget respecté")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""Benchmark pire cas des étapes regex face à des entrées adverses (ReDoS)
+
+Usage : python scripts/bench_redos.py [--budget-ms 50] [--size 100000] [--legacy]
+
+Deux mesures par entrée adverse (longues suites de chiffres, d'espaces, préfixes
+répétés, gros copier-coller) :
+- pipeline : nettoyage, plafond MAX_MESSAGE_CHARS, contexte et règles de priorité,
+  comme process_message ; échoue (code 1) si le pire cas dépasse le budget ;
+- patterns : extract_time_delay directement sur --size caractères, pour vérifier
+  que le coût reste linéaire même sans le plafond.
+--legacy mesure aussi les anciens patterns (quadratiques) à titre de comparaison.
+"""
+
+import argparse
+import logging
+import os
+import re
+import sys
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+from api.engine import (  # noqa: E402
+    DEFAULT_MAX_MESSAGE_CHARS as MAX_MESSAGE_CHARS,
+    ConversationContextManager,
+    MessageProcessor,
+    PaymentContextProcessor,
+    ResponseValidator,
+)
+
+# Patterns d'avant la réécriture, conservés uniquement pour --legacy
+LEGACY_DELAY_PATTERNS = [
+    r'(?:il y a|depuis|ça fait|ca fait)\s*(\d+)\s*mois',
+    r'(\d+)\s*(mois|semaines?|jours?)\s+que',
+    r'(\d+)\s*(mois|semaines?|jours?)$',
+    r'\s+(\d+)\s*(mois|semaines?|jours?)\s',
+    r'il y a\s+(\d+)(?!\s*(?:mois|semaines?|jours?))',
+]
+
+
+def adversarial_inputs(size: int):
+    """Entrées construites pour maximiser le retour arrière des anciens patterns"""
+    paste = "Bonjour, ma formation CPF est terminée, j'attends mon paiement depuis longtemps. "
+    return {
+        "digits": "1" * size,
+        "digits_then_space": "1" * size + " x",
+        "whitespace": " " * size + "x",
+        "digit_space_runs": "1 " * (size // 2),
+        "il_y_a_digits": "il y a " + "9" * size + " x",
+        "il_y_a_repeated": "il y a 1 " * (size // 9),
+        "unit_without_que": ("12 mois " * (size // 8)) + "x",
+        "control_chars": "\x00\x01\t\n " * (size // 5),
+        "huge_paste": (paste * (size // len(paste) + 1))[:size],
+    }
+
+
+def timed(func, *args) -> float:
+    start = time.perf_counter()
+    func(*args)
+    return (time.perf_counter() - start) * 1000
+
+
+def run_pipeline(raw: str):
+    message = ResponseValidator.cap_length(ResponseValidator.clean_response(raw), MAX_MESSAGE_CHARS, "Message")
+    context = ConversationContextManager.analyze_history(message, [])
+    MessageProcessor.detect_priority_rules(message, "", context)
+
+
+def run_legacy(message: str):
+    lowered = message.lower()
+    for pattern in LEGACY_DELAY_PATTERNS:
+        re.search(pattern, lowered)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("REDOS_BUDGET_MS", "50")))
+    parser.add_argument("--size", type=int, default=100_000)
+    parser.add_argument("--legacy", action="store_true")
+    parser.add_argument("--legacy-size", type=int, default=MAX_MESSAGE_CHARS)
+    args = parser.parse_args()
+
+    # Les règles journalisent chaque message : on coupe les logs pendant la mesure
+    logging.disable(logging.CRITICAL)
+    PaymentContextProcessor.compiled_delay_patterns()
+
+    worst = 0.0
+    print(f"{'entrée':<20} {'pipeline (ms)':>14} {'patterns (ms)':>14}" + (f" {'legacy (ms)':>12}" if args.legacy else ""))
+    for name, raw in adversarial_inputs(args.size).items():
+        pipeline_ms = timed(run_pipeline, raw)
+        patterns_ms = timed(PaymentContextProcessor.extract_time_delay, raw)
+        worst = max(worst, pipeline_ms)
+        line = f"{name:<20} {pipeline_ms:>14.2f} {patterns_ms:>14.2f}"
+        if args.legacy:
+            line += f" {timed(run_legacy, raw[:args.legacy_size]):>12.2f}"
+        print(line)
+
+    print(f"Pire cas pipeline : {worst:.2f} ms (budget {args.budget_ms:.0f} ms, entrées de {args.size} caractères)")
+    if worst > args.budget_ms:
+        print(f"❌ Budget dépassé de {worst - args.budget_ms:.2f} ms")
+        return 1
+    print("✅ Budget respecté")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,368 @@
+"""Diff des décisions et des latences par étape entre deux versions du moteur
+
+Usage : python scripts/decision_diff.py [--corpus corpus.ndjson | --synthetic 5000]
+            [--base-code git:HEAD] [--base-rules rules.json]
+            [--candidate-code .] [--candidate-rules rules.json]
+            [--repeat 3] [--max-latency-regression 25] [--json]
+
+Chaque côté est un code (répertoire contenant le paquet api, ou git:REF extrait
+dans un répertoire temporaire) et, optionnellement, une configuration de règles.
+Les deux côtés rejouent le même corpus, dans le même ordre, chacun dans son propre
+interpréteur (deux versions du paquet api ne peuvent pas cohabiter dans un
+processus) : contexte, règles, résolution et trim, avec l'historique reconstruit
+par wa_id comme sur le serveur (sans LLM).
+
+Rapport : décisions (priority_detected, escalade_required, type de réponse) qui
+changent, puis latences p50/p95 par étape côte à côte. Code de sortie 1 si une
+décision change (sauf --allow-changes) ou si le p50 total régresse de plus de
+--max-latency-regression %. Le corpus synthétique (--synthetic) est généré à
+partir des mots-clés des règles avec une graine fixe : le résultat est
+déterministe.
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+STAGES = ("context", "rules", "resolve", "trim")
+
+SYNTHETIC_EXTRA = [
+    "bonjour", "ok merci", "oui", "non", "2 semaines", "3 mois", "10 jours", "60 jours",
+    "il y a 5 mois", "8 semaines", "depuis 1 mois", "cpf il y a 2 semaines", "comment ça marche ?"
+]
+SYNTHETIC_BLOCS = ["", "", "", "Le délai de paiement est de 45 jours", "Je vais faire suivre ta demande à notre équipe"]
+
+
+# --- Côté exécuté dans un sous-processus (code de la version testée) -------------------------
+
+def load_side(rules_path):
+    """Fonctions d'étapes de la version importée (moteur api.engine, ou api.process avant son extraction)"""
+    import logging
+    logging.disable(logging.CRITICAL)
+    if rules_path:
+        os.environ["RULES_CONFIG_PATH"] = rules_path
+    os.environ.setdefault("OPENAI_API_KEY", "sk-decision-diff")
+    os.environ.setdefault("LLM_ENABLED", "false")
+    os.environ.setdefault("SESSION_SNAPSHOT_PATH", "")
+
+    try:
+        from api import engine as module
+        if rules_path:
+            from api.rules import RuleRegistry
+            module.set_rule_registry(RuleRegistry(rules_path, reload_interval=0))
+        trim = module.trim_history
+    except ImportError:
+        from api import process as module
+        trim = module.MemoryManager.trim_memory
+    from api.memory import ConversationMemory
+
+    def resolve(priority_result, context):
+        final_response, response_type, escalade_required = module.resolve_priority_response(priority_result)
+        if final_response is None:
+            final_response = module.fallback_response(context)
+            response_type, escalade_required = "fallback_with_context", True
+        return final_response, response_type, escalade_required
+
+    return {
+        "memory": ConversationMemory,
+        "clean": module.ResponseValidator.clean_response,
+        "context": module.ConversationContextManager.analyze_conversation_context,
+        "rules": module.MessageProcessor.detect_priority_rules,
+        "resolve": resolve,
+        "trim": trim,
+    }
+
+
+def replay_once(side, corpus):
+    """Rejoue le corpus sur des sessions neuves ; (décisions, durées par étape en ns)"""
+    sessions = {}
+    decisions = []
+    timings = {stage: [] for stage in STAGES}
+    clock = time.perf_counter_ns
+
+    for record in corpus:
+        memory = sessions.get(record["wa_id"])
+        if memory is None:
+            memory = sessions[record["wa_id"]] = side["memory"]()
+        message = side["clean"](record["message"])
+        if not record["inbound"]:
+            memory.chat_memory.add_ai_message(message)
+            continue
+
+        t0 = clock()
+        side["trim"](memory)
+        t1 = clock()
+        context = side["context"](message, memory)
+        t2 = clock()
+        memory.chat_memory.add_user_message(message)
+        try:
+            priority_result = side["rules"](message, record["bloc"], context)
+            t3 = clock()
+            final_response, response_type, escalade_required = side["resolve"](priority_result, context)
+            t4 = clock()
+            decision = [priority_result.get("priority_detected", "NONE"), escalade_required, response_type]
+        except Exception as e:
+            t3 = t4 = clock()
+            final_response = None
+            decision = ["ERROR", None, type(e).__name__]
+        if final_response and record["simulate_reply"]:
+            memory.chat_memory.add_ai_message(final_response)
+        side["trim"](memory)
+        t5 = clock()
+
+        decisions.append(decision)
+        timings["trim"].append((t1 - t0) + (t5 - t4))
+        timings["context"].append(t2 - t1)
+        timings["rules"].append(t3 - t2)
+        timings["resolve"].append(t4 - t3)
+
+    return decisions, timings
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0
+
+
+def run_side(rules_path, corpus_path, repeat):
+    side = load_side(rules_path)
+    with open(corpus_path, "r", encoding="utf-8") as f:
+        corpus = json.load(f)
+
+    decisions = None
+    samples = {stage: [] for stage in STAGES + ("total",)}
+    deterministic = True
+    for _ in range(repeat):
+        run_decisions, timings = replay_once(side, corpus)
+        if decisions is None:
+            decisions = run_decisions
+        elif run_decisions != decisions:
+            deterministic = False
+        for stage in STAGES:
+            samples[stage].extend(timings[stage])
+        samples["total"].extend(map(sum, zip(*(timings[stage] for stage in STAGES))))
+
+    latency = {
+        stage: {
+            "p50_us": round(percentile(values, 0.50) / 1000, 2),
+            "p95_us": round(percentile(values, 0.95) / 1000, 2),
+            "mean_us": round(statistics.fmean(values) / 1000, 2) if values else 0.0
+        }
+        for stage, values in samples.items()
+    }
+    json.dump({"decisions": decisions, "latency": latency, "deterministic": deterministic}, sys.stdout)
+
+
+# --- Orchestration ---------------------------------------------------------------------------
+
+def materialize_code(spec, workdir):
+    """Répertoire racine d'un côté : chemin existant, ou git:REF extrait (paquet api seulement)"""
+    if not spec.startswith("git:"):
+        return str(Path(spec).resolve())
+    ref = spec[len("git:"):]
+    archive = subprocess.run(["git", "archive", "--format=tar", ref, "api"], cwd=REPO_ROOT,
+                             capture_output=True, check=True).stdout
+    target = Path(workdir) / ref.replace("/", "_")
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        tar.extractall(target)
+    return str(target)
+
+
+def default_rules(code_root):
+    path = Path(code_root) / "api" / "rules.json"
+    return str(path) if path.exists() else None
+
+
+def normalize_record(record):
+    role = str(record.get("role") or record.get("direction") or "user").lower()
+    message = record.get("message_original") or record.get("message") or record.get("text") or ""
+    return {
+        "wa_id": str(record.get("wa_id") or "default_wa_id"),
+        "message": str(message),
+        "bloc": str(record.get("matched_bloc_response") or ""),
+        "inbound": role in ("user", "human", "inbound", "in", "incoming", "client"),
+        # Sans réponses du bot dans le corpus, la réponse décidée alimente l'historique
+        "simulate_reply": True
+    }
+
+
+def load_corpus(path):
+    corpus = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                corpus.append(normalize_record(json.loads(line)))
+    corpus = [record for record in corpus if record["message"].strip()]
+    if any(not record["inbound"] for record in corpus):
+        for record in corpus:
+            record["simulate_reply"] = False
+    return corpus
+
+
+def synthetic_corpus(size, seed, rules_path):
+    """Corpus déterministe : conversations de 1 à 5 messages composés de mots-clés des règles"""
+    vocabulary = list(SYNTHETIC_EXTRA)
+    if rules_path:
+        with open(rules_path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+
+        def walk(value):
+            if isinstance(value, str):
+                if len(value) < 60:
+                    vocabulary.append(value)
+            elif isinstance(value, list):
+                for item in value:
+                    walk(item)
+            elif isinstance(value, dict):
+                for item in value.values():
+                    walk(item)
+
+        walk(config.get("keywords", {}))
+        walk(config.get("context_markers", {}))
+
+    rng = random.Random(seed)
+    corpus = []
+    conversation = 0
+    while len(corpus) < size:
+        for _ in range(rng.randint(1, 5)):
+            message = " ".join(rng.choice(vocabulary) for _ in range(rng.randint(1, 4)))
+            corpus.append({"wa_id": f"synthetic-{conversation}", "message": message,
+                           "bloc": rng.choice(SYNTHETIC_BLOCS), "inbound": True, "simulate_reply": True})
+        conversation += 1
+    return corpus[:size]
+
+
+def replay_side(code_root, rules_path, corpus_path, repeat):
+    env = dict(os.environ, PYTHONPATH=code_root, PYTHONDONTWRITEBYTECODE="1")
+    command = [sys.executable, str(Path(__file__).resolve()), "--run-side", "--corpus", corpus_path,
+               "--repeat", str(repeat)]
+    if rules_path:
+        command += ["--rules", rules_path]
+    result = subprocess.run(command, cwd=code_root, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Rejeu impossible pour {code_root} :\n{result.stderr[-2000:]}")
+    return json.loads(result.stdout)
+
+
+def compare(corpus, base, candidate, max_examples):
+    changes = []
+    transitions = Counter()
+    inbound = [record for record in corpus if record["inbound"]]
+    for index, (before, after) in enumerate(zip(base["decisions"], candidate["decisions"])):
+        if before[:2] != after[:2]:
+            transitions[f"{before[0]} -> {after[0]}"] += 1
+            if len(changes) < max_examples:
+                changes.append({
+                    "turn": index,
+                    "wa_id": inbound[index]["wa_id"],
+                    "message": inbound[index]["message"][:80],
+                    "base": {"priority_detected": before[0], "escalade_required": before[1], "status": before[2]},
+                    "candidate": {"priority_detected": after[0], "escalade_required": after[1], "status": after[2]}
+                })
+
+    latency = {}
+    for stage in STAGES + ("total",):
+        before, after = base["latency"][stage], candidate["latency"][stage]
+        delta = (after["p50_us"] - before["p50_us"]) / before["p50_us"] * 100 if before["p50_us"] else 0.0
+        latency[stage] = {"base": before, "candidate": after, "p50_delta_pct": round(delta, 1)}
+
+    return {
+        "turns": len(base["decisions"]),
+        "changed": sum(transitions.values()),
+        "transitions": dict(transitions.most_common()),
+        "examples": changes,
+        "latency": latency,
+        "deterministic": base["deterministic"] and candidate["deterministic"]
+    }
+
+
+def print_report(report, labels):
+    print(f"Base : {labels[0]}")
+    print(f"Candidat : {labels[1]}")
+    print(f"{report['turns']} tours rejoués, {report['changed']} décisions modifiées")
+    for transition, count in report["transitions"].items():
+        print(f"  {count:6d}  {transition}")
+    for change in report["examples"]:
+        print(f"  tour {change['turn']} [{change['wa_id']}] {change['message']!r}")
+        print(f"      {change['base']} -> {change['candidate']}")
+
+    print(f"\n{'étape':<10} {'base p50':>10} {'cand. p50':>10} {'Δ p50':>8} {'base p95':>10} {'cand. p95':>10}  (µs)")
+    for stage, values in report["latency"].items():
+        base, candidate = values["base"], values["candidate"]
+        print(f"{stage:<10} {base['p50_us']:>10.2f} {candidate['p50_us']:>10.2f} {values['p50_delta_pct']:>7.1f}%"
+              f" {base['p95_us']:>10.2f} {candidate['p95_us']:>10.2f}")
+    if not report["deterministic"]:
+        print("⚠️ Décisions différentes d'une répétition à l'autre : le moteur n'est pas déterministe")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", help="corpus NDJSON (wa_id, message, role, matched_bloc_response)")
+    parser.add_argument("--synthetic", type=int, default=5000, help="taille du corpus synthétique sans --corpus")
+    parser.add_argument("--seed", type=int, default=14)
+    parser.add_argument("--base-code", default="git:HEAD")
+    parser.add_argument("--base-rules")
+    parser.add_argument("--candidate-code", default=str(REPO_ROOT))
+    parser.add_argument("--candidate-rules")
+    parser.add_argument("--repeat", type=int, default=3, help="répétitions pour stabiliser les latences")
+    parser.add_argument("--max-examples", type=int, default=20)
+    parser.add_argument("--max-latency-regression", type=float, default=float(os.getenv("DECISION_DIFF_MAX_REGRESSION_PCT", "25")))
+    parser.add_argument("--allow-changes", action="store_true", help="ne pas échouer si des décisions changent")
+    parser.add_argument("--json", action="store_true", help="rapport JSON sur la sortie standard")
+    parser.add_argument("--run-side", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--rules", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_side:
+        run_side(args.rules, args.corpus, args.repeat)
+        return 0
+
+    with tempfile.TemporaryDirectory(prefix="decision-diff-") as workdir:
+        base_root = materialize_code(args.base_code, workdir)
+        candidate_root = materialize_code(args.candidate_code, workdir)
+        base_rules = args.base_rules or default_rules(base_root)
+        candidate_rules = args.candidate_rules or default_rules(candidate_root)
+
+        corpus = load_corpus(args.corpus) if args.corpus else synthetic_corpus(args.synthetic, args.seed, base_rules)
+        corpus_path = os.path.join(workdir, "corpus.json")
+        with open(corpus_path, "w", encoding="utf-8") as f:
+            json.dump(corpus, f, ensure_ascii=False)
+
+        base = replay_side(base_root, base_rules, corpus_path, args.repeat)
+        candidate = replay_side(candidate_root, candidate_rules, corpus_path, args.repeat)
+
+    report = compare(corpus, base, candidate, args.max_examples)
+    labels = (f"{args.base_code} ({base_rules or 'règles intégrées'})",
+              f"{args.candidate_code} ({candidate_rules or 'règles intégrées'})")
+    if args.json:
+        print(json.dumps({"base": labels[0], "candidate": labels[1], **report}, ensure_ascii=False, indent=2))
+    else:
+        print_report(report, labels)
+
+    regression = report["latency"]["total"]["p50_delta_pct"]
+    failed = False
+    if report["changed"] and not args.allow_changes:
+        print(f"❌ {report['changed']} décisions modifiées", file=sys.stderr)
+        failed = True
+    if regression > args.max_latency_regression:
+        print(f"❌ Latence p50 totale +{regression}% (max {args.max_latency_regression}%)", file=sys.stderr)
+        failed = True
+    if not report["deterministic"]:
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+"""Serveur local compatible OpenAI (/v1/chat/completions) pour tester l'étape de génération
+
+Usage : python scripts/stub_llm_server.py [--port 8089] [--delay 0.2] [--token-delay 0.05] [--fail-rate 0]
+Puis lancer l'API avec OPENAI_BASE_URL=http://127.0.0.1:8089/v1
+
+La réponse reprend le dernier message utilisateur, ce qui rend les tests déterministes.
+Avec "stream": true, elle est émise mot par mot en SSE comme l'API OpenAI.
+"""
+
+import argparse
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def build_reply(payload):
+    user_messages = [m["content"] for m in payload.get("messages", []) if m.get("role") == "user"]
+    last = user_messages[-1] if user_messages else ""
+    return f"Réponse simulée à : {last}"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    delay = 0.0
+    token_delay = 0.0
+    fail_rate = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # Le client a abandonné (budget de latence dépassé)
+            pass
+
+    def _send_stream(self, payload):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        words = build_reply(payload).split(" ")
+        try:
+            for index, word in enumerate(words):
+                chunk = {
+                    "id": "chatcmpl-stub",
+                    "object": "chat.completion.chunk",
+                    "choices": [{"index": 0, "delta": {"content": word if index == 0 else f" {word}"}}]
+                }
+                self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+                time.sleep(self.token_delay)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/v1/chat/completions":
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+
+        length = int(self.headers.get("Content-Length", "0"))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        time.sleep(self.delay)
+
+        if random.random() < self.fail_rate:
+            self._send_json(500, {"error": {"message": "stub failure"}})
+            return
+
+        if payload.get("stream"):
+            self._send_stream(payload)
+            return
+
+        self._send_json(200, {
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "model": payload.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": build_reply(payload)},
+                "finish_reason": "stop"
+            }]
+        })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--delay", type=float, default=0.0, help="latence simulée (secondes)")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="délai entre deux tokens en streaming")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="proportion de réponses 500")
+    args = parser.parse_args()
+
+    StubHandler.delay = args.delay
+    StubHandler.token_delay = args.token_delay
+    StubHandler.fail_rate = args.fail_rate
+    server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+    print(f"Stub LLM sur http://{args.host}:{args.port}/v1")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
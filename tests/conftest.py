@@ -0,0 +1,9 @@
+"""Configuration lue à l'import de api.process : pas de LLM, pas de fichiers dans le répertoire courant"""
+
+import os
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ["LLM_ENABLED"] = "false"
+os.environ["SESSION_SNAPSHOT_PATH"] = ""
+os.environ["DECISION_LOG_DIR"] = ""
+os.environ["ESCALATION_SINK"] = "none"
@@ -0,0 +1,89 @@
+"""Admission : seau de jetons par wa_id, délestage sur file pleine et attente bornée"""
+
+import asyncio
+
+from api.admission import (
+    SHED_QUEUE_FULL, SHED_QUEUE_TIMEOUT, SHED_RATE_LIMITED, AdmissionController, TokenBucket
+)
+
+
+def test_token_bucket_refills_at_rate():
+    bucket = TokenBucket(2, now=0.0)
+    assert bucket.try_take(1.0, 2, now=0.0)
+    assert bucket.try_take(1.0, 2, now=0.0)
+    assert not bucket.try_take(1.0, 2, now=0.0)
+    assert bucket.seconds_until_token(1.0) == 1.0
+    assert bucket.try_take(1.0, 2, now=1.0)
+    # La recharge ne dépasse jamais la capacité
+    bucket.try_take(1.0, 2, now=100.0)
+    assert bucket.tokens == 1
+
+
+def test_burst_then_rate_limited_per_wa_id():
+    async def scenario():
+        admission = AdmissionController(max_concurrency=10, rate_per_minute=6, burst=2)
+        decisions = []
+        for _ in range(3):
+            decision = await admission.acquire("33600000001")
+            if decision.admitted:
+                admission.release()
+            decisions.append(decision)
+        other = await admission.acquire("33600000002")
+        admission.release()
+        return admission, decisions, other
+
+    admission, decisions, other = asyncio.run(scenario())
+    assert [d.admitted for d in decisions] == [True, True, False]
+    assert decisions[2].reason == SHED_RATE_LIMITED
+    assert 0 < decisions[2].retry_after <= 10
+    assert other.admitted
+    assert admission.shed[SHED_RATE_LIMITED] == 1
+    assert admission.stats()["tracked_wa_ids"] == 2
+
+
+def test_bucket_count_is_bounded():
+    async def scenario():
+        admission = AdmissionController(max_buckets=2)
+        for wa_id in ("a", "b", "c"):
+            await admission.acquire(wa_id)
+            admission.release()
+        return admission
+
+    assert asyncio.run(scenario()).stats()["tracked_wa_ids"] == 2
+
+
+def test_queue_full_is_shed_immediately():
+    async def scenario():
+        admission = AdmissionController(max_concurrency=1, max_queue=1, queue_timeout=5, rate_per_minute=0)
+        assert (await admission.acquire("a")).admitted
+        queued = asyncio.create_task(admission.acquire("b"))
+        await asyncio.sleep(0)
+        shed = await admission.acquire("c")
+        admission.release()
+        assert (await queued).admitted
+        admission.release()
+        return admission, shed
+
+    admission, shed = asyncio.run(scenario())
+    assert not shed.admitted
+    assert shed.reason == SHED_QUEUE_FULL
+    assert shed.retry_after >= 1.0
+    stats = admission.stats()
+    assert stats["admitted"] == 2
+    assert stats["peak_waiting"] == 1
+    assert (stats["active"], stats["waiting"]) == (0, 0)
+
+
+def test_queue_wait_is_bounded_by_deadline():
+    async def scenario():
+        admission = AdmissionController(max_concurrency=1, max_queue=4, queue_timeout=5, rate_per_minute=0)
+        assert (await admission.acquire("a")).admitted
+        decision = await admission.acquire("b", timeout=0.01)
+        admission.release()
+        return admission, decision
+
+    admission, decision = asyncio.run(scenario())
+    assert not decision.admitted
+    assert decision.reason == SHED_QUEUE_TIMEOUT
+    assert admission.shed[SHED_QUEUE_TIMEOUT] == 1
+    assert (admission.active, admission.waiting) == (0, 0)
@@ -0,0 +1,48 @@
+"""Catalogue des blocs n8n : chargement, texte nettoyé une fois, compteurs de résolution"""
+
+import json
+import os
+
+import pytest
+
+from api.blocs import Bloc, BlocCatalog
+
+SHIPPED_CATALOG = os.path.join(os.path.dirname(__file__), os.pardir, "api", "blocs.json")
+
+
+def test_shipped_catalog_is_versioned_and_empty():
+    # Les textes des blocs appartiennent à n8n : aucune copie des modèles de rules.json
+    catalog = BlocCatalog.load(SHIPPED_CATALOG, str.strip)
+    assert catalog.version and len(catalog) == 0
+
+
+def test_load_cleans_once_and_resolves_by_id_and_text(tmp_path):
+    path = tmp_path / "blocs.json"
+    path.write_text(json.dumps({"version": "v2", "blocs": {
+        "paiement": "  Le paiement intervient sous 45 jours.  ",
+        "repli": "Je vais faire suivre ta demande à notre équipe",
+        "vide": "   "
+    }}), encoding="utf-8")
+    catalog = BlocCatalog.load(str(path), str.strip)
+
+    assert (catalog.version, len(catalog)) == ("v2", 2)
+    bloc = catalog.get("paiement")
+    assert bloc.text == "Le paiement intervient sous 45 jours."
+    assert bloc.mentions_payment_delay and not bloc.is_fallback
+    assert catalog.get("repli").is_fallback
+    assert catalog.get("inconnu") is None
+    assert catalog.match_text("Le paiement intervient sous 45 jours.") is bloc
+    assert catalog.match_text("autre texte").bloc_id is None
+    stats = catalog.stats()
+    assert (stats["id_hits"], stats["id_misses"], stats["text_hits"], stats["text_misses"]) == (2, 1, 1, 1)
+
+
+def test_invalid_catalog_raises(tmp_path):
+    path = tmp_path / "blocs.json"
+    path.write_text(json.dumps({"version": "v1"}), encoding="utf-8")
+    with pytest.raises(KeyError):
+        BlocCatalog.load(str(path), str.strip)
+
+
+def test_bloc_without_catalog():
+    assert repr(Bloc("texte")) == "Bloc(bloc_id=None, text='texte')"
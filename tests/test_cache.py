@@ -0,0 +1,45 @@
+"""Clé du cache de réponses : état résumé et dernier tour de l'assistant, pas tout l'historique"""
+
+from api.cache import ResponseCache, history_digest, make_cache_key
+from api.memory import ChatMessage
+
+
+def conversation(*pairs):
+    return [ChatMessage(kind, content) for kind, content in pairs]
+
+
+def summary(collapsed, **state):
+    return {"collapsed_messages": collapsed, "state": state}
+
+
+def test_same_point_in_different_conversations_shares_the_key():
+    first = conversation(("human", "bonjour"), ("ai", "Bonjour !"), ("human", "cpf ?"), ("ai", "Votre CPF ?"))
+    second = conversation(("human", "salut, j'ai une question"), ("ai", "Je vous écoute"),
+                          ("human", "et le cpf"), ("ai", "Votre CPF ?"))
+    assert history_digest(first, summary(4, awaiting_cpf_info=True)) == \
+        history_digest(second, summary(12, awaiting_cpf_info=True, needs_greeting=False))
+
+
+def test_last_assistant_turn_and_state_change_the_key():
+    history = conversation(("human", "cpf ?"), ("ai", "Votre CPF ?"))
+    reference = history_digest(history)
+    assert history_digest(conversation(("human", "cpf ?"), ("ai", "Autre réponse"))) != reference
+    assert history_digest(history, summary(2, awaiting_cpf_info=True)) != reference
+    assert history_digest([]) != reference
+    # Le dernier message humain est déjà dans la clé (message normalisé) : seul le tour de l'assistant compte
+    assert history_digest(history + conversation(("human", "merci"))) == reference
+
+
+def test_key_and_cache_round_trip():
+    context = {"previous_topic": "cpf", "is_follow_up": True}
+    digest = history_digest(conversation(("ai", "Votre CPF ?")))
+    key = make_cache_key("CPF", "Oui, c'est ça !", context, "v1", digest)
+    assert key == make_cache_key("CPF", "oui c est ca", context, "v1", digest)
+    assert key != make_cache_key("CPF", "oui c est ca", context, "v2", digest)
+
+    cache = ResponseCache(max_entries=1)
+    cache.put(key, "réponse")
+    assert cache.get(key) == "réponse"
+    cache.put(("autre",), "x")
+    assert cache.get(key) is None
+    assert cache.stats()["evictions"] == 1
@@ -0,0 +1,69 @@
+"""Dispatcher du cluster : routage par wa_id, réponses 503 quand le worker est injoignable"""
+
+import asyncio
+
+import httpx
+
+from api.cluster import RoutingTimeout, create_app, extract_wa_id, worker_path
+
+
+class UnreachableCluster:
+    """Routage réussi, mais le worker propriétaire ne répond pas (ou routage en attente)"""
+
+    def __init__(self, error):
+        self.error = error
+        self.routed = []
+
+    async def route(self, wa_id):
+        self.routed.append(wa_id)
+        if isinstance(self.error, RoutingTimeout):
+            raise self.error
+        return object()
+
+    async def forward(self, worker, request, body):
+        raise self.error
+
+
+def post(cluster, path, payload=None):
+    async def run():
+        transport = httpx.ASGITransport(app=create_app(cluster))
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post(path, json=payload)
+
+    return asyncio.run(run())
+
+
+def test_clear_memory_returns_503_when_owner_is_unreachable():
+    cluster = UnreachableCluster(httpx.ConnectError("connection refused"))
+    response = post(cluster, "/clear_memory/33612345678")
+
+    assert response.status_code == 503
+    assert response.json() == {"detail": "worker unavailable"}
+    assert response.headers["retry-after"] == "1"
+    assert cluster.routed == ["33612345678"]
+
+
+def test_message_returns_503_when_owner_is_unreachable():
+    cluster = UnreachableCluster(httpx.ReadTimeout("timeout"))
+    response = post(cluster, "/", {"wa_id": 33612345678, "message": "Bonjour"})
+
+    assert (response.status_code, response.json()) == (503, {"detail": "worker unavailable"})
+    assert cluster.routed == ["33612345678"]
+
+
+def test_routing_timeout_is_reported():
+    for path in ("/", "/clear_memory/a"):
+        response = post(UnreachableCluster(RoutingTimeout("cluster is rebalancing")), path, {"wa_id": "a"})
+        assert (response.status_code, response.json()) == (503, {"detail": "cluster is rebalancing"})
+
+
+def test_extract_wa_id_matches_process_message_defaults():
+    assert extract_wa_id(b'{"wa_id": 336, "message": "x"}') == "336"
+    assert extract_wa_id(b'{"message": "x"}') == "default_wa_id"
+    assert extract_wa_id(b'["x"]') == "fallback_wa_id"
+    assert extract_wa_id(b"\xff") == "fallback_wa_id"
+
+
+def test_worker_path():
+    assert worker_path("sessions.snapshot", 2, False) == "sessions.worker2.snapshot"
+    assert worker_path("decision_logs", 2, True) == "decision_logs/worker2"
@@ -0,0 +1,60 @@
+"""Échéance par requête : budget demandé, dépassement compté une fois sur la première étape"""
+
+import time
+
+from api import process
+from api.deadline import STAGES, DeadlineMetrics, RequestDeadline, resolve_budget
+
+
+def test_resolve_budget():
+    assert resolve_budget(None, 10, 30) == 10
+    assert resolve_budget("2500", 10, 30) == 2.5
+    assert resolve_budget("600000", 10, 30) == 30
+    assert resolve_budget("abc", 10, 30) == 10
+    assert resolve_budget("-5", 10, 30) == 10
+    assert resolve_budget(None, 60, 30) == 30
+
+
+def test_overrun_counted_once_on_first_stage():
+    metrics = DeadlineMetrics(10, 30)
+    deadline = RequestDeadline(0.001, metrics)
+    assert not deadline.check("parse")
+    time.sleep(0.002)
+    assert deadline.check("rules")
+    assert deadline.check("generation")
+    assert deadline.check("commit")
+
+    assert deadline.exceeded_stage == "rules"
+    assert deadline.remaining() == 0.0
+    report = metrics.to_dict()
+    assert (report["requests"], report["exceeded"]) == (1, 1)
+    assert report["overruns_by_stage"] == {stage: int(stage == "rules") for stage in STAGES}
+
+
+def test_requests_within_budget_are_not_counted():
+    metrics = DeadlineMetrics(10, 30)
+    for _ in range(3):
+        deadline = RequestDeadline(10, metrics)
+        assert not any(deadline.check(stage) for stage in STAGES)
+    assert (metrics.requests, metrics.exceeded) == (3, 0)
+
+
+def test_commit_overrun_skips_shadow_but_keeps_the_turn(monkeypatch):
+    process.memory_store.clear()
+    metrics = DeadlineMetrics(10, 30)
+    deadline = RequestDeadline(10, metrics)
+    monkeypatch.setattr(process.shadow_evaluator, "sample", lambda: True)
+    turn = process.prepare_turn("late", "bonjour", None, deadline)
+    process.apply_fallback(turn)
+    assert turn["shadow_sample"] is not None
+
+    # Échéance atteinte pendant la génération, constatée à l'enregistrement
+    deadline.expires_at = time.monotonic()
+    skipped = process.shadow_evaluator.skipped_late
+    response = process.commit_turn(turn)
+
+    assert metrics.overruns["commit"] == 1 and deadline.exceeded_stage == "commit"
+    assert response["deadline_exceeded"] == "commit"
+    assert process.shadow_evaluator.skipped_late == skipped + 1
+    assert [message["content"] for message in response["memory"]][-1] == response["matched_bloc_response"]
+    process.memory_store.clear()
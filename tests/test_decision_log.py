@@ -0,0 +1,124 @@
+"""Journal des décisions : enregistrements relus à l'identique, rotation et reprise"""
+
+import asyncio
+import glob
+import os
+import threading
+import time
+
+import pytest
+
+from api.decision_log import (
+    ACTIVE_NAME, FLAG_CACHE_HIT, FLAG_ESCALATED, MISSING_US, RECORD, ROTATED_PATTERN, UNKNOWN_DELAY,
+    DecisionLog, PRIORITIES, RESPONSE_TYPES, aggregate, hash_wa_id, log_files, make_header, open_log
+)
+
+np = pytest.importorskip("numpy")
+
+
+def write_decisions(directory, count, **options):
+    async def run():
+        log = DecisionLog(str(directory), flush_interval=3600, **options)
+        log.start()
+        for index in range(count):
+            log.record(
+                f"336{index:08d}", "CPF_DELAI_NORMAL", "cpf_delay_normal", escalated=index % 2 == 0,
+                signals={"financing_type": "CPF", "delay_days": index + 1},
+                timings={"context": 0.000125, "total": 0.002}, cache_hit=index % 3 == 0
+            )
+        await log.stop()
+        return log
+
+    return asyncio.run(run())
+
+
+def read_records(directory):
+    return np.concatenate([open_log(path)[1] for path in log_files([str(directory)])])
+
+
+def test_records_round_trip(tmp_path):
+    log = write_decisions(tmp_path, 10)
+    assert (log.recorded, log.written, log.dropped) == (10, 10, 0)
+
+    records = read_records(tmp_path)
+    assert len(records) == 10
+    first = records[0]
+    assert first["wa_hash"] == hash_wa_id("33600000000")
+    assert PRIORITIES[first["priority"]] == "CPF_DELAI_NORMAL"
+    assert RESPONSE_TYPES[first["response_type"]] == "cpf_delay_normal"
+    assert first["flags"] == FLAG_ESCALATED | FLAG_CACHE_HIT
+    assert (first["context_us"], first["rules_us"], first["total_us"]) == (125, MISSING_US, 2000)
+    assert list(records["delay_days"]) == list(range(1, 11))
+    report = aggregate([str(tmp_path)])
+    assert (report["decisions"], report["unique_sessions"]) == (10, 10)
+    assert report["flags"]["escalated"] == 5 and report["flags"]["cache_hit"] == 4
+
+
+def test_unknown_values_are_coded_other(tmp_path):
+    async def run():
+        log = DecisionLog(str(tmp_path), flush_interval=3600)
+        log.start()
+        log.record("a", "NOUVELLE_PRIORITE", "nouveau_type", escalated=False)
+        await log.stop()
+
+    asyncio.run(run())
+    [record] = read_records(tmp_path)
+    assert (record["priority"], record["response_type"], record["delay_days"]) == (0, 0, UNKNOWN_DELAY)
+
+
+def test_rotation_keeps_every_record_up_to_max_files(tmp_path):
+    per_file = 5
+    max_file_bytes = len(make_header()) + per_file * RECORD.size
+    log = write_decisions(tmp_path, 23, max_file_bytes=max_file_bytes, max_files=10)
+
+    rotated = glob.glob(os.path.join(str(tmp_path), ROTATED_PATTERN))
+    assert log.rotations == len(rotated) == 4
+    assert all(os.path.getsize(path) <= max_file_bytes for path in log_files([str(tmp_path)]))
+    # Rotations dans l'ordre chronologique puis fichier actif : enregistrements dans l'ordre d'écriture
+    assert list(read_records(tmp_path)["delay_days"]) == list(range(1, 24))
+
+
+def test_rotation_drops_oldest_files(tmp_path):
+    max_file_bytes = len(make_header()) + 5 * RECORD.size
+    write_decisions(tmp_path, 23, max_file_bytes=max_file_bytes, max_files=2)
+
+    # Le fichier actif compte parmi les max_files conservés
+    assert len(glob.glob(os.path.join(str(tmp_path), ROTATED_PATTERN))) == 1
+    assert list(read_records(tmp_path)["delay_days"]) == list(range(16, 24))
+
+
+def test_reopen_truncates_partial_record(tmp_path):
+    write_decisions(tmp_path, 3)
+    with open(os.path.join(str(tmp_path), ACTIVE_NAME), "ab") as f:
+        f.write(b"\x00" * (RECORD.size // 2))
+
+    write_decisions(tmp_path, 2)
+    assert list(read_records(tmp_path)["delay_days"]) == [1, 2, 3, 1, 2]
+
+
+def test_stop_during_write_keeps_every_record(tmp_path):
+    async def run():
+        log = DecisionLog(str(tmp_path), flush_interval=0.01)
+        write = log._write
+        writing = threading.Event()
+
+        def slow_write(chunk):
+            writing.set()
+            time.sleep(0.2)
+            write(chunk)
+
+        log._write = slow_write
+        log.start()
+        for index in range(300):
+            log.record(str(index), "NONE", "OTHER", escalated=False)
+        # Le worker est annulé pendant que le thread écrit le premier lot
+        await asyncio.to_thread(writing.wait)
+        for index in range(300):
+            log.record(str(index), "NONE", "OTHER", escalated=False)
+        await log.stop()
+        return log
+
+    log = asyncio.run(run())
+    assert (log.recorded, log.written, log.dropped, log.last_error) == (600, 600, 0, None)
+    assert log.flushes == 2
+    assert len(read_records(tmp_path)) == 600
@@ -0,0 +1,57 @@
+"""Escalades : aucun sink par défaut, sink fichier borné par rotation"""
+
+import asyncio
+import glob
+import json
+import os
+
+from api.escalation import EscalationDispatcher, FileSink, make_escalation_event, make_sink
+
+
+def event(index):
+    return make_escalation_event(f"wa{index}", "admin", "PAIEMENT_SUIVI", "auto_escalade", "x" * 200, "réponse")
+
+
+def test_no_sink_by_default():
+    assert make_sink("") is None and make_sink("none") is None
+    dispatcher = EscalationDispatcher(make_sink("none"))
+    assert not dispatcher.enabled and not dispatcher.submit(event(0))
+
+
+def test_file_sink_rotates_and_keeps_max_files(tmp_path):
+    path = str(tmp_path / "escalations.ndjson")
+    sink = FileSink(path, max_file_bytes=2000, max_files=3)
+    for index in range(40):
+        sink._write([event(index)])
+
+    files = sorted(glob.glob(str(tmp_path / "escalations-*.ndjson"))) + [path]
+    assert len(files) == 3 and sink.rotations > 2
+    assert all(os.path.getsize(file) <= 2000 for file in files)
+    # Les fichiers conservés contiennent les événements les plus récents, dans l'ordre
+    wa_ids = [json.loads(line)["wa_id"] for file in files for line in open(file, encoding="utf-8")]
+    assert wa_ids == [f"wa{index}" for index in range(40 - len(wa_ids), 40)]
+
+
+def test_batch_is_never_split(tmp_path):
+    path = str(tmp_path / "escalations.ndjson")
+    sink = FileSink(path, max_file_bytes=100, max_files=2)
+    sink._write([event(0), event(1)])
+    sink._write([event(2)])
+    assert sink.rotations == 1
+    assert len(open(path, encoding="utf-8").readlines()) == 1
+
+
+def test_dispatcher_delivers_to_file(tmp_path):
+    path = str(tmp_path / "escalations.ndjson")
+
+    async def run():
+        dispatcher = EscalationDispatcher(make_sink("file", path), flush_interval=0.01)
+        dispatcher.start()
+        for index in range(5):
+            assert dispatcher.submit(event(index))
+        await dispatcher.stop()
+        return dispatcher
+
+    dispatcher = asyncio.run(run())
+    assert dispatcher.delivered == 5
+    assert len(open(path, encoding="utf-8").readlines()) == 5
@@ -0,0 +1,51 @@
+"""Fenêtre d'historique par budget de tokens : bornes et résumé des tours compactés"""
+
+from api.engine import history_window, trim_history
+from api.memory import ChatMessage, ConversationMemory
+
+
+def make_memory(contents):
+    memory = ConversationMemory()
+    for index, content in enumerate(contents):
+        memory.chat_memory.add_message(ChatMessage("human" if index % 2 == 0 else "ai", content))
+    return memory
+
+
+def test_history_within_limits_is_kept_whole():
+    # 4 messages de 8 octets = 2 tokens chacun : exactement aux deux limites
+    memory = make_memory(["a" * 8] * 4)
+    assert memory.chat_memory.tokens == 8
+    assert history_window(memory, max_messages=4, max_tokens=8) == 4
+    assert trim_history(memory, max_messages=4, max_tokens=8) == 0
+    assert memory.summary is None
+
+
+def test_message_cap():
+    memory = make_memory(["a" * 8] * 5)
+    assert history_window(memory, max_messages=4, max_tokens=1000) == 4
+
+
+def test_token_budget_keeps_most_recent_messages():
+    memory = make_memory(["a" * 40, "b" * 8, "c" * 8, "d" * 8])
+    # 10 + 2 + 2 + 2 tokens : le premier message ne tient plus dans un budget de 15
+    assert history_window(memory, max_messages=10, max_tokens=15) == 3
+    assert history_window(memory, max_messages=10, max_tokens=16) == 4
+
+
+def test_last_message_always_kept_even_over_budget():
+    memory = make_memory(["a" * 8, "b" * 400])
+    assert history_window(memory, max_messages=10, max_tokens=5) == 1
+
+
+def test_trim_collapses_old_turns_into_summary():
+    memory = make_memory([f"message {index}" for index in range(10)])
+    assert trim_history(memory, max_messages=4, max_tokens=1000) == 6
+    assert [m.content for m in memory.chat_memory.messages] == [f"message {index}" for index in range(6, 10)]
+    assert (memory.summary["collapsed_messages"], memory.summary["collapsed_user_messages"]) == (6, 3)
+    assert memory.chat_memory.tokens == sum(m.tokens for m in memory.chat_memory.messages)
+
+    # Second trim : le résumé cumule les tours compactés
+    memory.chat_memory.add_user_message("message 10")
+    memory.chat_memory.add_ai_message("message 11")
+    assert trim_history(memory, max_messages=4, max_tokens=1000) == 2
+    assert (memory.summary["collapsed_messages"], memory.summary["collapsed_user_messages"]) == (8, 4)
@@ -0,0 +1,147 @@
+"""Maintenance en arrière-plan : tranches de temps et compaction différée des historiques"""
+
+import asyncio
+import time
+
+from api import process
+from api.engine import trim_history
+from api.housekeeping import HistoryCompactor, HousekeepingScheduler, TimeSlice
+from api.memory import ConversationMemory, SessionStore
+from api.tiering import MemoryColdTier, TieredSessionStore
+
+MAX_MESSAGES = 4
+MAX_TOKENS = 1000
+
+
+def make_memory(turns):
+    memory = ConversationMemory()
+    for index in range(turns):
+        memory.chat_memory.add_user_message(f"question {index}")
+        memory.chat_memory.add_ai_message(f"réponse {index}")
+    return memory
+
+
+def trim(memory):
+    return trim_history(memory, MAX_MESSAGES, MAX_TOKENS)
+
+
+def test_time_slice_counts_slices_and_overruns():
+    async def run():
+        time_slice = TimeSlice(0.001)
+        assert not time_slice.exhausted()
+        time.sleep(0.003)
+        assert time_slice.exhausted()
+        await time_slice.pause()
+        assert not time_slice.exhausted()
+        # Attente hors budget : elle ne compte pas dans la tranche suivante
+        await time_slice.wait(asyncio.sleep(0.005))
+        assert not time_slice.exhausted()
+        time_slice.close()
+        return time_slice
+
+    time_slice = asyncio.run(run())
+    assert time_slice.slices == 3
+    assert time_slice.overruns == 1
+    assert time_slice.max_slice_seconds >= 0.003
+
+
+def test_mark_only_sessions_over_the_window():
+    store = SessionStore()
+    compactor = HistoryCompactor(store, trim, MAX_MESSAGES, MAX_TOKENS)
+    store["short"] = short = make_memory(2)
+    store["long"] = long = make_memory(3)
+
+    compactor.mark("short", short)
+    compactor.mark("long", long)
+    assert compactor.pending == 1
+    assert not compactor.take("short")
+    assert compactor.take("long")
+    assert not compactor.take("long")
+    assert compactor.pending == 0
+
+
+def test_deferred_compaction_matches_inline_trim():
+    store = SessionStore()
+    compactor = HistoryCompactor(store, trim, MAX_MESSAGES, MAX_TOKENS)
+    inline = make_memory(5)
+    trim(inline)
+    store["a"] = deferred = make_memory(5)
+    compactor.mark("a", deferred)
+
+    assert asyncio.run(compactor.run(TimeSlice(1))) == 1
+    assert [m.content for m in deferred.chat_memory.messages] == [m.content for m in inline.chat_memory.messages]
+    assert deferred.summary == inline.summary
+    assert (compactor.compacted, compactor.pending) == (1, 0)
+
+
+def test_run_skips_sessions_cleared_or_replaced():
+    store = SessionStore()
+    compactor = HistoryCompactor(store, trim, MAX_MESSAGES, MAX_TOKENS)
+    store["cleared"] = cleared = make_memory(5)
+    store["replaced"] = replaced = make_memory(5)
+    compactor.mark("cleared", cleared)
+    compactor.mark("replaced", replaced)
+    del store["cleared"]
+    store["replaced"] = make_memory(1)
+
+    assert asyncio.run(compactor.run(TimeSlice(1))) == 0
+    assert len(replaced.chat_memory.messages) == 10
+
+
+def test_run_yields_between_slices():
+    store = SessionStore()
+    compactor = HistoryCompactor(store, trim, MAX_MESSAGES, MAX_TOKENS)
+    for index in range(200):
+        store[str(index)] = memory = make_memory(20)
+        compactor.mark(str(index), memory)
+
+    async def run():
+        time_slice = TimeSlice(0.0001)
+        compacted = await compactor.run(time_slice)
+        time_slice.close()
+        return compacted, time_slice
+
+    compacted, time_slice = asyncio.run(run())
+    assert compacted == 200 and time_slice.slices > 1
+    assert all(len(memory.chat_memory.messages) == MAX_MESSAGES for memory in store.values())
+
+
+def test_rehydrated_session_is_marked():
+    store = TieredSessionStore(MemoryColdTier(), idle_seconds=60)
+    compactor = HistoryCompactor(store, trim, MAX_MESSAGES, MAX_TOKENS)
+    store.on_rehydrate = compactor.mark
+    old = make_memory(5)
+    old.last_interaction = time.time() - 3600
+    store["a"] = old
+
+    memory = store["a"]
+    assert compactor.take("a")
+    assert len(memory.chat_memory.messages) == 10
+
+
+def test_scheduler_records_job_errors():
+    scheduler = HousekeepingScheduler(slice_seconds=0.001)
+
+    async def failing(time_slice):
+        raise RuntimeError("boom")
+
+    scheduler.add("failing", failing, interval=60)
+    scheduler.add("disabled", failing, interval=0)
+    stats = asyncio.run(scheduler.run_now("failing"))
+    assert list(scheduler.jobs) == ["failing"]
+    assert (stats["runs"], stats["errors"], stats["last_error"]) == (1, 1, "RuntimeError: boom")
+
+
+def test_turn_trims_only_marked_sessions(monkeypatch):
+    trimmed = []
+    monkeypatch.setattr(process.MemoryManager, "trim_memory", staticmethod(trimmed.append))
+    process.memory_store.clear()
+    process.memory_store["within"] = make_memory(1)
+    process.memory_store["marked"] = marked = make_memory(process.MAX_MESSAGES_PER_SESSION)
+    process.history_compactor.mark("marked", marked)
+
+    process.prepare_turn("within", "bonjour", None)
+    assert trimmed == []
+    process.prepare_turn("marked", "bonjour", None)
+    assert trimmed == [marked]
+    process.memory_store.clear()
@@ -0,0 +1,72 @@
+"""Agrégats mémoire maintenus incrémentalement : ajout, remplacement, trim, suppression"""
+
+from api.engine import trim_history
+from api.memory import ChatMessage, ConversationMemory, SessionStore, estimate_tokens
+
+
+def recount(store):
+    """Agrégats recalculés en parcourant toutes les sessions (référence)"""
+    messages = [m for memory in store.values() for m in memory.chat_memory.messages]
+    return {
+        "active_sessions": len(store),
+        "total_messages": len(messages),
+        "user_messages": sum(1 for m in messages if m.type == "human"),
+        "ai_messages": sum(1 for m in messages if m.type == "ai"),
+        "total_memory_size_chars": sum(len(m.content) for m in messages),
+        "total_memory_size_bytes": sum(m.size for m in messages)
+    }
+
+
+def make_memory(turns):
+    memory = ConversationMemory()
+    for index in range(turns):
+        memory.chat_memory.add_user_message(f"question {index} é")
+        memory.chat_memory.add_ai_message(f"réponse {index}")
+    return memory
+
+
+def test_message_size_and_tokens():
+    message = ChatMessage("human", "délai")
+    assert (message.size, message.tokens) == (6, 2)
+    assert estimate_tokens(0) == 1
+
+
+def test_counters_after_add_trim_and_delete():
+    store = SessionStore()
+    store["a"] = make_memory(3)
+    store["b"] = make_memory(1)
+    assert store.stats.to_dict() == recount(store)
+
+    # Message ajouté à une session déjà dans le store
+    store["b"].chat_memory.add_user_message("encore une question")
+    assert store.stats.to_dict() == recount(store)
+
+    # Trim : les messages retirés sortent des agrégats
+    assert trim_history(store["a"], max_messages=2, max_tokens=1000) == 4
+    assert store.stats.to_dict() == recount(store)
+    history = store["a"].chat_memory
+    assert (len(history.messages), history.user_messages, history.ai_messages) == (2, 1, 1)
+
+    # Remplacement puis suppression
+    store["b"] = make_memory(2)
+    assert store.stats.to_dict() == recount(store)
+    del store["a"]
+    assert store.pop("missing", None) is None
+    store.pop("b")
+    assert store.stats.to_dict() == recount(store) == {key: 0 for key in recount(store)}
+
+
+def test_detached_session_no_longer_counts():
+    store = SessionStore()
+    store["a"] = memory = make_memory(2)
+    del store["a"]
+    memory.chat_memory.add_user_message("après suppression")
+    assert store.stats.messages == 0
+
+
+def test_clear_resets_aggregates():
+    store = SessionStore()
+    store["a"] = memory = make_memory(2)
+    store.clear()
+    memory.chat_memory.add_user_message("après clear")
+    assert store.stats.to_dict() == recount(store)
@@ -0,0 +1,57 @@
+"""Anneau de hachage cohérent : attribution stable et déplacements minimaux"""
+
+import pytest
+
+from api.sharding import HashRing, ring_hash
+
+WA_IDS = [f"336{index:08d}" for index in range(20_000)]
+
+
+def owners(ring):
+    return {wa_id: ring.owner(wa_id) for wa_id in WA_IDS}
+
+
+def test_owner_is_deterministic():
+    # Même calcul dans le dispatcher et dans chaque worker, quel que soit l'ordre des workers
+    assert owners(HashRing(range(4))) == owners(HashRing([3, 1, 0, 2, 2]))
+    # Valeurs figées : un changement de hachage déplacerait les sessions d'un cluster existant
+    assert ring_hash("33612345678") == 16309897662348647777
+    ring = HashRing(range(4))
+    assert [ring.owner(wa_id) for wa_id in ("33612345678", "33700000000", "default_wa_id", "")] == [3, 1, 2, 2]
+
+def test_numeric_wa_id_has_same_owner_as_text():
+    ring = HashRing(range(8))
+    assert ring.owner(33612345678) == ring.owner("33612345678")
+
+
+def test_load_is_balanced():
+    counts = {}
+    for worker in owners(HashRing(range(4))).values():
+        counts[worker] = counts.get(worker, 0) + 1
+    assert sorted(counts) == [0, 1, 2, 3]
+    assert max(counts.values()) < 1.3 * len(WA_IDS) / 4
+
+
+@pytest.mark.parametrize("workers", [1, 2, 3, 7])
+def test_adding_a_worker_only_moves_sessions_to_it(workers):
+    before = owners(HashRing(range(workers)))
+    after = owners(HashRing(range(workers + 1)))
+    moved = [wa_id for wa_id in WA_IDS if before[wa_id] != after[wa_id]]
+    assert all(after[wa_id] == workers for wa_id in moved)
+    # Environ 1/(N+1) des sessions changent de worker
+    assert abs(len(moved) / len(WA_IDS) - 1 / (workers + 1)) < 0.1
+
+
+def test_removing_a_worker_only_moves_its_sessions():
+    before = owners(HashRing(range(5)))
+    after = owners(HashRing([0, 1, 3, 4]))
+    for wa_id in WA_IDS:
+        if before[wa_id] != 2:
+            assert after[wa_id] == before[wa_id]
+        else:
+            assert after[wa_id] != 2
+
+
+def test_empty_ring_is_rejected():
+    with pytest.raises(ValueError):
+        HashRing([])
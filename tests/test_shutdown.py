@@ -0,0 +1,98 @@
+"""Cycle de vie de l'application : restauration non bloquante, wa_id numérique, étapes d'arrêt isolées"""
+
+import asyncio
+import os
+
+import httpx
+import pytest
+
+from api import process
+from api.memory import ChatMessage, SessionStore
+from api.snapshot import build_memory, iter_snapshot, save_snapshot
+
+
+@pytest.fixture
+def app_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(process, "SESSION_SNAPSHOT_PATH", str(tmp_path / "sessions.snapshot"))
+    monkeypatch.setattr(process.decision_log, "directory", str(tmp_path / "decision_logs"))
+    process.memory_store.clear()
+    yield tmp_path
+    process.memory_store.clear()
+
+
+def run_app(*payloads):
+    async def run():
+        responses = []
+        async with process.app.router.lifespan_context(process.app):
+            transport = httpx.ASGITransport(app=process.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                for payload in payloads:
+                    responses.append(await client.post("/", json=payload))
+        return responses
+
+    return asyncio.run(run())
+
+
+def test_numeric_wa_id_is_saved_in_snapshot(app_files):
+    [response] = run_app({"wa_id": 33612345678, "message": "Bonjour"})
+
+    assert response.status_code == 200
+    assert response.json()["session_id"] == "33612345678"
+    sessions = {wa_id: messages for wa_id, _, _, messages in iter_snapshot(str(app_files / "sessions.snapshot"))}
+    assert list(sessions) == ["33612345678"]
+    assert sessions["33612345678"][0].content == "Bonjour"
+
+
+def test_failed_shutdown_step_does_not_stop_the_others(app_files, monkeypatch):
+    def fail(store, path):
+        raise RuntimeError("disque plein")
+
+    monkeypatch.setattr(process, "save_snapshot", fail)
+    written = process.decision_log.written
+    run_app({"wa_id": 42, "message": "Bonjour"})
+
+    assert not (app_files / "sessions.snapshot").exists()
+    # Étapes suivantes exécutées : journal des décisions écrit et fermé
+    assert process.decision_log.stats()["enabled"] is False
+    assert process.decision_log.written == written + 1
+    assert os.path.getsize(app_files / "decision_logs" / "decisions.dlog") > 0
+
+
+@pytest.fixture
+def saved_sessions(app_files, monkeypatch):
+    """Snapshot de 3000 sessions, restauré par petits lots après un budget de démarrage nul"""
+    store = SessionStore()
+    for index in range(3000):
+        store[f"wa{index}"] = build_memory(
+            1_700_000_000.0, {"collapsed_messages": 4, "state": {"awaiting_cpf_info": True}},
+            [ChatMessage("human", "cpf"), ChatMessage("ai", f"réponse {index}")]
+        )
+    save_snapshot(store, str(app_files / "sessions.snapshot"))
+    monkeypatch.setattr(process, "SNAPSHOT_RESTORE_BUDGET_SECONDS", 0)
+    monkeypatch.setattr(process.snapshot_restorer, "batch_size", 5)
+    return app_files
+
+
+def saved_history(path, wa_id):
+    for saved_wa_id, _, summary, messages in iter_snapshot(str(path)):
+        if saved_wa_id == wa_id:
+            return summary, [message.content for message in messages]
+    return None
+
+
+def test_message_during_restore_sees_saved_session(saved_sessions):
+    [response] = run_app({"wa_id": "wa2999", "message": "Bonjour"})
+
+    assert [message["content"] for message in response.json()["memory"]][:3] == ["cpf", "réponse 2999", "Bonjour"]
+    status = process.snapshot_restorer.status()
+    assert status["waits"] >= 1 and status["merged"] == 0 and status["complete"]
+
+
+def test_session_opened_before_its_restore_is_merged(saved_sessions, monkeypatch):
+    monkeypatch.setattr(process, "SNAPSHOT_RESTORE_WAIT_SECONDS", 0)
+    run_app({"wa_id": "wa2999", "message": "Bonjour"})
+
+    assert process.snapshot_restorer.merged == 1
+    summary, messages = saved_history(saved_sessions / "sessions.snapshot", "wa2999")
+    assert summary["state"]["awaiting_cpf_info"] is True
+    assert messages[:3] == ["cpf", "réponse 2999", "Bonjour"]
@@ -0,0 +1,189 @@
+"""Format du snapshot des sessions : aller-retour v3, lecture v1/v2, restauration en arrière-plan"""
+
+import asyncio
+import gzip
+import io
+import struct
+import time
+
+import pytest
+
+from api.memory import ChatMessage, ConversationMemory, SessionStore
+from api.snapshot import (
+    FORMAT_VERSION, MAGIC, SnapshotError, SnapshotRestorer, decode_session, dump_sessions, encode_session,
+    iter_snapshot, save_snapshot
+)
+
+
+def make_memory(last_interaction, messages, summary=None):
+    memory = ConversationMemory()
+    for message_type, content in messages:
+        memory.chat_memory.add_message(ChatMessage(message_type, content))
+    memory.last_interaction = last_interaction
+    memory.summary = summary
+    return memory
+
+
+def copy_memory(memory):
+    return make_memory(
+        memory.last_interaction, [(m.type, m.content) for m in memory.chat_memory.messages], memory.summary
+    )
+
+
+def as_tuple(memory):
+    return (
+        memory.last_interaction,
+        memory.summary,
+        [(m.type, m.content) for m in memory.chat_memory.messages]
+    )
+
+
+SESSIONS = {
+    "33612345678": make_memory(1_700_000_000.25, [("human", "Bonjour"), ("ai", "Salut 👋")]),
+    "33700000000": make_memory(
+        1_700_000_100.5, [("human", "paiement CPF ?")],
+        {"collapsed_messages": 4, "state": {"financing": "CPF", "escalated": True}}
+    ),
+    "empty": make_memory(1_700_000_200.0, []),
+}
+
+
+def legacy_stream(version, sessions):
+    """Snapshot v1 (sans horodatage) ou v2 (sans résumé) construit à la main"""
+    raw = io.BytesIO()
+    with gzip.GzipFile(fileobj=raw, mode="wb") as out:
+        out.write(struct.pack("<4sB", MAGIC, version))
+        for wa_id, last_interaction, messages in sessions:
+            key = wa_id.encode("utf-8")
+            out.write(struct.pack("<H", len(key)) + key)
+            if version >= 2:
+                out.write(struct.pack("<d", last_interaction))
+            out.write(struct.pack("<I", len(messages)))
+            for type_code, content in messages:
+                data = content.encode("utf-8")
+                out.write(struct.pack("<BI", type_code, len(data)) + data)
+    raw.seek(0)
+    return raw
+
+
+def test_encode_decode_session_round_trip():
+    for memory in SESSIONS.values():
+        assert as_tuple(decode_session(encode_session(memory))) == as_tuple(memory)
+
+
+def test_save_snapshot_round_trip(tmp_path):
+    store = SessionStore()
+    for wa_id, memory in SESSIONS.items():
+        store[wa_id] = copy_memory(memory)
+    path = str(tmp_path / "sessions.snapshot")
+
+    assert save_snapshot(store, path) == len(SESSIONS)
+    restored = {wa_id: (last, summary, [(m.type, m.content) for m in messages])
+                for wa_id, last, summary, messages in iter_snapshot(path)}
+    assert restored == {wa_id: as_tuple(memory) for wa_id, memory in SESSIONS.items()}
+    assert not (tmp_path / "sessions.snapshot.tmp").exists()
+
+
+def test_dump_sessions_is_readable_as_stream():
+    data, count = dump_sessions(SESSIONS.items())
+    assert count == len(SESSIONS)
+    assert [wa_id for wa_id, *_ in iter_snapshot(io.BytesIO(data))] == list(SESSIONS)
+
+
+def test_read_v2_snapshot():
+    stream = legacy_stream(2, [("a", 1_600_000_000.0, [(0, "Bonjour"), (1, "Salut")])])
+    [(wa_id, last_interaction, summary, messages)] = list(iter_snapshot(stream))
+    assert (wa_id, last_interaction, summary) == ("a", 1_600_000_000.0, None)
+    assert [(m.type, m.content) for m in messages] == [("human", "Bonjour"), ("ai", "Salut")]
+
+
+def test_read_v1_snapshot_uses_restore_time():
+    before = time.time()
+    stream = legacy_stream(1, [("a", None, [(0, "Bonjour")]), ("b", None, [])])
+    sessions = list(iter_snapshot(stream))
+    assert [wa_id for wa_id, *_ in sessions] == ["a", "b"]
+    assert all(last_interaction >= before and summary is None for _, last_interaction, summary, _ in sessions)
+
+
+def test_unknown_version_is_rejected():
+    raw = io.BytesIO()
+    with gzip.GzipFile(fileobj=raw, mode="wb") as out:
+        out.write(struct.pack("<4sB", MAGIC, FORMAT_VERSION + 1))
+    raw.seek(0)
+    with pytest.raises(SnapshotError):
+        list(iter_snapshot(raw))
+
+
+def test_truncated_snapshot_is_rejected():
+    data, _ = dump_sessions(SESSIONS.items())
+    truncated = gzip.compress(gzip.decompress(data)[:-3])
+    with pytest.raises(SnapshotError):
+        list(iter_snapshot(io.BytesIO(truncated)))
+
+
+def write_large_snapshot(path, count):
+    store = SessionStore()
+    for index in range(count):
+        store[f"wa{index}"] = make_memory(
+            1_700_000_000.0, [("human", f"message {index}")], {"collapsed_messages": 2, "state": {"awaiting_cpf_info": True}}
+        )
+    save_snapshot(store, path)
+
+
+def test_message_during_restore_waits_for_its_session(tmp_path):
+    path = str(tmp_path / "sessions.snapshot")
+    write_large_snapshot(path, 2000)
+
+    async def run():
+        store = SessionStore()
+        restorer = SnapshotRestorer(batch_size=10)
+        task = asyncio.create_task(restorer.restore(store, path))
+        await asyncio.sleep(0)
+        assert restorer.running and "wa1999" not in store
+        assert await restorer.wait_for(store, "wa1999", timeout=30)
+        memory = store["wa1999"]
+        await task
+        return restorer, memory
+
+    restorer, memory = asyncio.run(run())
+    assert [m.content for m in memory.chat_memory.messages] == ["message 1999"]
+    assert memory.summary["state"]["awaiting_cpf_info"] is True
+    assert restorer.status()["waits"] == 1 and restorer.restored == 2000
+
+
+def test_session_created_during_restore_keeps_saved_state(tmp_path):
+    path = str(tmp_path / "sessions.snapshot")
+    write_large_snapshot(path, 2000)
+
+    async def run():
+        store = SessionStore()
+        restorer = SnapshotRestorer(batch_size=10)
+        task = asyncio.create_task(restorer.restore(store, path))
+        await asyncio.sleep(0)
+        # Attente expirée : le tour ouvre la session, la restauration fusionne l'état sauvegardé
+        assert not await restorer.wait_for(store, "wa1999", timeout=0)
+        live = ConversationMemory()
+        store["wa1999"] = live
+        restorer.note_created("wa1999")
+        live.chat_memory.add_user_message("nouveau message")
+        await task
+        return restorer, store, live
+
+    restorer, store, live = asyncio.run(run())
+    assert store["wa1999"] is live
+    assert [m.content for m in live.chat_memory.messages] == ["message 1999", "nouveau message"]
+    assert live.summary["state"]["awaiting_cpf_info"] is True
+    assert (restorer.merged, restorer.restored, restorer.wait_timeouts) == (1, 1999, 1)
+    assert store.stats.messages == 2001
+
+
+def test_session_existing_before_restore_is_kept(tmp_path):
+    path = str(tmp_path / "sessions.snapshot")
+    write_large_snapshot(path, 3)
+    store = SessionStore()
+    store["wa0"] = make_memory(1_800_000_000.0, [("human", "transféré")])
+
+    restorer = SnapshotRestorer()
+    asyncio.run(restorer.restore(store, path))
+    assert [m.content for m in store["wa0"].chat_memory.messages] == ["transféré"]
+    assert (restorer.skipped, restorer.restored, restorer.complete) == (1, 2, True)
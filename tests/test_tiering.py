@@ -0,0 +1,124 @@
+"""Stockage à deux niveaux : sessions inactives compressées, réhydratées à la demande"""
+
+import asyncio
+import time
+import zlib
+
+import pytest
+
+from api import process
+from api.memory import ConversationMemory
+from api.snapshot import encode_session
+from api.tiering import MemoryColdTier, SQLiteColdTier, TieredSessionStore
+
+
+def make_memory(turns, idle_seconds=0.0, summary=None):
+    memory = ConversationMemory()
+    for index in range(turns):
+        memory.chat_memory.add_user_message(f"question {index}")
+        memory.chat_memory.add_ai_message(f"réponse {index} é")
+    memory.last_interaction = time.time() - idle_seconds
+    memory.summary = summary
+    return memory
+
+
+def memory_copy(memory):
+    copy = ConversationMemory()
+    copy.chat_memory.messages = list(memory.chat_memory.messages)
+    copy.last_interaction = memory.last_interaction
+    copy.summary = memory.summary
+    return copy
+
+
+def as_tuple(memory):
+    return memory.last_interaction, memory.summary, [(m.type, m.content) for m in memory.chat_memory.messages]
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    tier = MemoryColdTier() if request.param == "memory" else SQLiteColdTier(str(tmp_path / "cold.sqlite3"))
+    store = TieredSessionStore(tier, idle_seconds=60, batch_size=3)
+    yield store
+    store.close()
+
+
+def test_cold_round_trip_without_rehydration(store):
+    expected = {f"wa{index}": make_memory(index + 1, idle_seconds=3600, summary={"collapsed_messages": index})
+                for index in range(5)}
+    for wa_id, memory in expected.items():
+        store[wa_id] = memory_copy(memory)
+    assert (store.tier_stats()["hot_sessions"], store.tier_stats()["cold_sessions"]) == (0, 5)
+
+    # Snapshot et lecture d'administration : décompressées, jamais réhydratées
+    assert dict(store.encoded_items()) == {wa_id: encode_session(memory) for wa_id, memory in expected.items()}
+    assert zlib.decompress(store.cold_tier.get("wa0")) == encode_session(expected["wa0"])
+    assert as_tuple(store.peek("wa3")) == as_tuple(expected["wa3"])
+    assert store.promotions == 0
+
+    for wa_id, memory in expected.items():
+        assert as_tuple(store[wa_id]) == as_tuple(memory)
+    assert store.promotions == 5 and store.tier_stats()["cold_sessions"] == 0
+
+
+def test_aggregates_follow_sessions_across_tiers(store):
+    store["hot"] = make_memory(2)
+    store["idle"] = make_memory(3)
+    # Session déjà inactive : directement dans le niveau froid ; l'autre le devient au balayage
+    store["cold"] = make_memory(4, idle_seconds=3600)
+    store["idle"].last_interaction -= 3600
+    assert asyncio.run(store.sweep()) == 1
+    totals = store.stats.to_dict()
+    assert (totals["active_sessions"], totals["total_messages"], totals["user_messages"]) == (3, 18, 9)
+
+    store["idle"]
+    del store["cold"]
+    totals = store.stats.to_dict()
+    assert (totals["active_sessions"], totals["total_messages"]) == (2, 10)
+    assert len(store) == 2 and "cold" not in store
+    assert store.cold_tier.payload_bytes == 0 and store.cold_content_bytes == 0
+
+
+def test_sweep_keeps_sessions_active_again(store):
+    for index in range(7):
+        store[f"wa{index}"] = make_memory(1)
+        store[f"wa{index}"].last_interaction = time.time() - 3600
+    store["wa6"].touch()
+    assert asyncio.run(store.sweep()) == 6
+    assert store.last_sweep["candidates"] == 6
+    assert list(store.keys()) == ["wa6"] + [f"wa{index}" for index in range(6)]
+
+
+def test_encoded_items_keeps_sessions_promoted_during_iteration(store):
+    store["hot"] = make_memory(1)
+    for index in range(3):
+        store[f"cold{index}"] = make_memory(1, idle_seconds=3600)
+
+    items = store.encoded_items()
+    first = next(items)
+    # Réhydratée pendant le parcours (checkpoint interrompu entre deux tranches)
+    store["cold1"]
+    seen = dict([first, *items])
+    assert sorted(seen) == ["cold0", "cold1", "cold2", "hot"]
+    assert seen["cold1"] == encode_session(store.peek("cold1"))
+
+
+def test_disabled_tier_keeps_everything_hot():
+    store = TieredSessionStore(None)
+    store["a"] = make_memory(1, idle_seconds=3600)
+    assert asyncio.run(store.sweep()) == 0
+    assert store.tier_stats()["hot_sessions"] == 1 and not store.enabled
+
+
+def test_memory_status_pages_over_keys_without_rehydrating():
+    process.memory_store.clear()
+    for index in range(10):
+        process.memory_store[f"wa{index}"] = make_memory(1, idle_seconds=0 if index < 4 else 7200)
+    promotions = process.memory_store.promotions
+
+    page = asyncio.run(process.memory_status(offset=2, limit=4))
+    assert list(page["sessions"]) == ["wa2", "wa3", "wa4", "wa5"]
+    assert page["next_offset"] == 6 and page["total_messages"] == 20
+    assert asyncio.run(process.memory_status(offset=8, limit=4))["next_offset"] is None
+    assert process.memory_store.promotions == promotions
+    assert process.memory_store.tier_stats()["cold_sessions"] == 6
+    process.memory_store.clear()